@@ -0,0 +1,63 @@
+import sys
+import argparse
+import json
+import logging
+from core import benchmark
+
+
+def parse_command_line():
+    """Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Smashmon benchmarks")
+    parser.add_argument("--only", type=str, nargs="+", default=None,
+                        help="Only run the benchmarks whose names contain one of these strings")
+    parser.add_argument("--iterations", type=int, default=None,
+                        help="Number of measured iterations per benchmark (default: depends on the benchmark)")
+    parser.add_argument("--port", type=int, default=32090,
+                        help="First port of the broadcast benchmarks")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the results as JSON to this file (printed if not given)")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare the results with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative slowdown of the median time that counts as regression")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print verbose output")
+    args = parser.parse_args()
+    assert args.iterations is None or args.iterations > 0
+    assert 0 < args.port < 65536
+    assert args.threshold >= 0
+
+    if args.verbose:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s")
+
+    return args
+
+
+def main():
+    """
+    Runs the benchmarks and compares them with the baseline. Returns the exit status (1 if there are regressions).
+    """
+    args = parse_command_line()
+    results = benchmark.run_benchmarks(names=args.only, iterations=args.iterations, port=args.port)
+    if args.output is None:
+        print json.dumps(results, indent=2, sort_keys=True)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = benchmark.compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            logging.error("Regression in %s: %.6f s -> %.6f s (%+.1f%%)" % (name, old, new, 100 * (new / old - 1)))
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Benchmarks of the hot paths of a frame.
+
+Each benchmark measures the time of many iterations of one operation and summarizes it (see the stats module). The
+results are a dictionary {benchmark name: summary} that can be stored as JSON and compared with a baseline:
+
+    results = run_benchmarks()
+    regressions = compare(results, baseline, threshold=0.1)
+"""
+import os
+import random
+import socket
+import threading
+import time
+import pygame
+import events
+import network
+import snapshot
+import stage
+import stage_view
+import stats
+
+
+def measure(func, iterations=1000, warmup=10):
+    """Call func warmup + iterations times and return the summary of the times of the measured calls in seconds.
+    """
+    for i in xrange(warmup):
+        func()
+    times = []
+    for i in xrange(iterations):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return stats.summarize(times)
+
+
+class _CountingListener(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def notify(self, event):
+        self.count += 1
+
+
+def bench_event_post(num_listeners, num_events, iterations=1000):
+    """Measure one tick of an event manager with num_listeners listeners and num_events events per tick.
+    """
+    ev_manager = events.EventManager()
+    listeners = [_CountingListener() for i in xrange(num_listeners)]
+    for i, listener in enumerate(listeners):
+        if i % 2 == 0:
+            ev_manager.register_listener(listener)
+        else:
+            ev_manager.register_listener(listener, [events.TickEvent, events.CharacterInputState])
+
+    def tick():
+        for i in xrange(num_events):
+            ev_manager.post(events.CharacterInputState(i % 2, i % 4, i + 1))
+        ev_manager.post(events.TickEvent(elapsed_time=1/60.0))
+    return measure(tick, iterations)
+
+
+def sample_snapshot(num_bodies):
+    """Return snapshot data with num_bodies moving character records.
+    """
+    data = []
+    for i in xrange(num_bodies):
+        data.extend((snapshot.CHARACTER, i, 3.0 + 0.1 * i, 7.0, 0.01 * i, 1.5, -2.0, 0.1, 1, i + 1, 0))
+    return data
+
+
+def sample_events():
+    """Return one instance of each event class that is sent over network.
+    """
+    return [events.TickEvent(1/60.0), events.CharacterMoveLeftRequest(1, 17), events.CharacterMoveRightRequest(1, 18),
+            events.CharacterJumpRequest(1, 19), events.CharacterInputState(1, 3, 20), events.ModelBroadcastRequest(),
+            events.ModelBroadcast(sample_snapshot(4)), events.ModelDeltaBroadcast(42, 40, sample_snapshot(2)),
+            events.ModelBroadcastAck(42), events.ModelMetaBroadcastRequest(),
+            events.ModelMetaBroadcast({"level_name": "Level 1", "character_names": ["char0", "char1"]}),
+            events.AssignCharacter(1), events.JoinMatch(-1)]
+
+
+def bench_codec_round_trips(codec, iterations=1000):
+    """Measure the encoding and decoding of each event in sample_events() with the given codec.
+    Return the dictionary {event class name: summary}.
+    """
+    encode, decode, header = events.codecs[codec]
+    results = {}
+    for event in sample_events():
+        results[event.__class__.__name__] = measure(lambda: decode(encode(event)), iterations)
+    return results
+
+
+def bench_broadcast(engine, num_clients, codec="json", port=32090, iterations=200, timeout=5.0):
+    """
+    Measure the broadcast of a model snapshot from a server to num_clients clients on the loopback interface, until
+    every client has received it.
+    """
+    encode, decode, header = events.codecs[codec]
+    server = network.server_engines[engine](port=port, decode=decode, encode=encode, header=header, batch=True)
+    server.accept_clients()
+    host = socket.gethostname()
+    client_cls = network.client_transports["udp" if engine == "udp" else "tcp"]
+    clients = []
+
+    def connect():
+        # The clients connect in a thread, because the UDP handshake needs the server to be polled meanwhile.
+        deadline = time.time() + timeout
+        while len(clients) < num_clients:
+            try:
+                clients.append(client_cls(host, port, decode=decode, encode=encode, header=header))
+            except socket.error:
+                # The threaded server may not listen yet.
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+    connector = threading.Thread(target=connect)
+    connector.daemon = True
+    connector.start()
+    try:
+        deadline = time.time() + timeout
+        while connector.isAlive() or server.num_clients() < num_clients:
+            if time.time() > deadline:
+                raise Exception("Only %d of %d benchmark clients connected." % (server.num_clients(), num_clients))
+            server.update_client_list()
+            time.sleep(0.001)
+        broadcast = events.ModelBroadcast(sample_snapshot(4))
+
+        def broadcast_and_receive():
+            server.broadcast(broadcast, snapshot=True)
+            server.flush()
+            waiting = set(clients)
+            deadline = time.time() + timeout
+            while len(waiting) > 0:
+                if time.time() > deadline:
+                    raise Exception("The benchmark broadcast did not reach %d clients." % len(waiting))
+                server.update_client_list()
+                for c in list(waiting):
+                    if len(c.get_objects()) > 0:
+                        waiting.discard(c)
+        return measure(broadcast_and_receive, iterations)
+    finally:
+        for c in clients:
+            c.close_all()
+        server.close_all()
+
+
+def _create_stage(ev_manager, num_characters, physics_rate=None):
+    """Return an authoritative stage model with num_characters characters that hold random buttons.
+    """
+    model = stage.StageModel(ev_manager, ignore_model_broadcasts=True, physics_rate=physics_rate)
+    character_names = ["char%d" % (i % 2) for i in xrange(num_characters)]
+    ev_manager.post(events.ModelMetaBroadcast({"level_name": "Level 1", "character_names": character_names}))
+    rand = random.Random(0)
+    for i in xrange(num_characters):
+        ev_manager.post(events.CharacterInputState(i, rand.choice((0, events.CharacterInputState.LEFT,
+                                                                   events.CharacterInputState.RIGHT))))
+    ev_manager.post(events.TickEvent(elapsed_time=0))
+    return model
+
+
+def bench_world_step(num_characters, physics_rate=None, iterations=500):
+    """Measure one tick of a stage model with num_characters characters.
+    """
+    ev_manager = events.EventManager()
+    model = _create_stage(ev_manager, num_characters, physics_rate)
+    tick = events.TickEvent(elapsed_time=1/60.0)
+    return measure(lambda: model.notify(tick), iterations)
+
+
+def bench_view_draw(num_characters, size=(600, 400), iterations=500):
+    """Measure the drawing of a stage with num_characters characters. Pygame uses the dummy SDL video driver.
+    """
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.display.init()
+    try:
+        pygame.display.set_mode(size)
+        ev_manager = events.EventManager()
+        model = _create_stage(ev_manager, num_characters)
+        view = stage_view.StagePygameView(ev_manager, model)
+        tick = events.TickEvent(elapsed_time=1/60.0)
+        return measure(lambda: view.notify(tick), iterations)
+    finally:
+        pygame.display.quit()
+
+
+def run_benchmarks(names=None, iterations=None, port=32090):
+    """
+    Run the benchmarks and return the dictionary {benchmark name: summary}.
+
+    :param names: only the benchmarks whose names contain one of these strings are run (all if None)
+    :param iterations: number of measured iterations per benchmark (the defaults of the benchmarks if None)
+    :param port: first port of the broadcast benchmarks
+    """
+    kwargs = {} if iterations is None else {"iterations": iterations}
+    benchmarks = []
+    for num_listeners, num_events in ((10, 10), (100, 10), (10, 100)):
+        benchmarks.append(("event_post.listeners_%d.events_%d" % (num_listeners, num_events),
+                           lambda l=num_listeners, e=num_events: {"": bench_event_post(l, e, **kwargs)}))
+    for codec in sorted(events.codecs):
+        benchmarks.append(("codec.%s" % codec, lambda c=codec: bench_codec_round_trips(c, **kwargs)))
+    for engine in sorted(network.server_engines):
+        for num_clients in (1, 16):
+            # Each broadcast benchmark uses its own port, so it does not wait for the sockets of the previous one.
+            benchmarks.append(("broadcast.%s.clients_%d" % (engine, num_clients),
+                               lambda e=engine, n=num_clients, p=port: {"": bench_broadcast(e, n, port=p, **kwargs)}))
+            port += 1
+    for num_characters in (2, 16):
+        benchmarks.append(("world_step.characters_%d" % num_characters,
+                           lambda n=num_characters: {"": bench_world_step(n, **kwargs)}))
+        benchmarks.append(("view_draw.characters_%d" % num_characters,
+                           lambda n=num_characters: {"": bench_view_draw(n, **kwargs)}))
+
+    results = {}
+    for name, bench in benchmarks:
+        if names is not None and not any(n in name for n in names):
+            continue
+        for sub_name, summary in bench().iteritems():
+            results[name + "." + sub_name if sub_name else name] = summary
+    return results
+
+
+def compare(results, baseline, threshold=0.1, key="p50"):
+    """
+    Compare the results with the baseline results and return the list of regressions (name, baseline time, time) of
+    the benchmarks whose time (the given summary key) is more than threshold (relative) above the baseline.
+    Benchmarks that are missing in one of the results are ignored.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name].get(key)
+        new = results[name].get(key)
+        if old is not None and new is not None and new > old * (1 + threshold):
+            regressions.append((name, old, new))
+    return regressions
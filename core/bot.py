@@ -0,0 +1,153 @@
+"""
+Headless bot clients.
+
+A bot connects to a server like a normal client (see events.NetworkEventManager), but it has no Pygame view and no
+local model. It plays its character with scripted or random inputs and measures the input latency: the time from
+sending an input until the server acknowledges it in a model broadcast (see the input sequence in the snapshot module).
+"""
+import logging
+import random
+import time
+import events
+import snapshot
+
+
+class BotController(object):
+    """
+    Plays the assigned character like a player who uses the StageIOController: The held buttons are sent as
+    CharacterInputState when they change and every input_resend_interval seconds. Jumps are sent as
+    CharacterJumpRequest.
+
+    The inputs are taken from the script, a list of steps (duration in seconds, buttons, jump) that is repeated. If
+    there is no script, the buttons change every change_interval seconds to a random state and the bot jumps with the
+    probability jump_probability at each change.
+    The controller also acknowledges the model delta broadcasts, so the server can send deltas to the bot.
+    """
+
+    def __init__(self, ev_manager, script=None, seed=None, change_interval=0.5, jump_probability=0.2,
+                 input_resend_interval=0.25):
+        """
+        :param ev_manager: event manager that sends the events over network (a NetworkEventManager that numbers the
+                           input events, see its predict_events)
+        :param script: list of steps (duration in seconds, buttons, jump), or None for random inputs
+        :param seed: seed of the random inputs
+        :param change_interval: interval of the random input changes in seconds
+        :param jump_probability: probability of a jump at a random input change
+        :param input_resend_interval: the held buttons are sent again after this many seconds
+        """
+        assert isinstance(ev_manager, events.EventManager)
+        assert script is None or (len(script) > 0 and all(step[0] > 0 for step in script))
+        assert change_interval > 0
+        self._ev_manager = ev_manager
+        self._ev_manager.register_listener(self, [events.AssignCharacter, events.TickEvent, events.ModelBroadcast,
+                                                  events.ModelDeltaBroadcast])
+        self._script = script
+        self._random = random.Random(seed)
+        self._change_interval = change_interval
+        self._jump_probability = jump_probability
+        self._input_resend_interval = input_resend_interval
+        self._character_id = None
+        self._buttons = 0
+        self._step_index = -1
+        self._step_time = 0  # remaining time of the current script step or random input
+        self._last_input_state = 0  # elapsed time since the input state was sent
+        self._send_times = {}  # {input sequence: time at which the input was sent}
+        self._acked_sequence = 0
+        self.latencies = []  # input latencies in seconds
+
+    def notify(self, event):
+        if isinstance(event, events.AssignCharacter):
+            self._character_id = event.character_id
+        elif isinstance(event, events.TickEvent):
+            if self._character_id is not None:
+                self._play(event.elapsed_time)
+        elif isinstance(event, events.ModelDeltaBroadcast):
+            self._ev_manager.post(events.ModelBroadcastAck(event.sequence))
+            self._handle_snapshot(event.data)
+        elif isinstance(event, events.ModelBroadcast):
+            self._handle_snapshot(event.data)
+
+    def _next_inputs(self):
+        """Return the buttons and the jump flag of the next script step or random input and start it.
+        """
+        if self._script is not None:
+            self._step_index = (self._step_index + 1) % len(self._script)
+            duration, buttons, jump = self._script[self._step_index]
+            self._step_time += duration
+            return buttons, jump
+        self._step_time += self._change_interval
+        buttons = self._random.choice((0, events.CharacterInputState.LEFT, events.CharacterInputState.RIGHT))
+        return buttons, self._random.random() < self._jump_probability
+
+    def _play(self, elapsed_time):
+        self._step_time -= elapsed_time
+        self._last_input_state += elapsed_time
+        buttons = self._buttons
+        if self._step_time <= 0:
+            buttons, jump = self._next_inputs()
+            if jump:
+                self._send(events.CharacterJumpRequest(self._character_id))
+        if buttons != self._buttons or self._last_input_state >= self._input_resend_interval:
+            self._buttons = buttons
+            self._last_input_state = 0
+            self._send(events.CharacterInputState(self._character_id, buttons))
+
+    def _send(self, event):
+        self._ev_manager.post(event)
+        if event.sequence > 0:
+            self._send_times[event.sequence] = time.time()
+
+    def _handle_snapshot(self, data):
+        """Measure the latency of the inputs that the server applied since the last snapshot.
+        """
+        if self._character_id is None:
+            return
+        for i in xrange(0, len(data), snapshot.RECORD_SIZE):
+            if data[i] == snapshot.CHARACTER and data[i+1] == self._character_id:
+                input_sequence = int(data[i+9])
+                if input_sequence > self._acked_sequence:
+                    now = time.time()
+                    for sequence in [s for s in self._send_times if s <= input_sequence]:
+                        self.latencies.append(now - self._send_times.pop(sequence))
+                    self._acked_sequence = input_sequence
+                break
+
+
+class BotClient(object):
+    """
+    A complete headless client: an event manager, the network connection and a BotController. The bot is driven by
+    calling tick(), so that many bots can run in one process.
+    """
+
+    def __init__(self, host, port=32072, codec="json", match_id=None, transport="tcp", script=None, seed=None):
+        """
+        :param host: server host
+        :param port: server port
+        :param codec: name of the codec in events.codecs
+        :param match_id: if not None, the bot joins this match of a match host (see JoinMatch)
+        :param transport: name of the network client in network.client_transports
+        :param script: input script of the BotController (random inputs if None)
+        :param seed: seed of the random inputs
+        """
+        self.ev_manager = events.EventManager()
+        self._network_ev_manager = events.NetworkEventManager(
+            self.ev_manager, host, port=port, codec=codec,
+            predict_events=[events.CharacterInputState, events.CharacterJumpRequest], match_id=match_id,
+            flush_events=[events.CharacterJumpRequest], transport=transport,
+            unreliable_events=[events.CharacterInputState, events.ModelBroadcastAck])
+        self.controller = BotController(self._network_ev_manager, script=script, seed=seed)
+        self.ev_manager.post(events.InitEvent())
+
+    def tick(self, elapsed_time):
+        self.ev_manager.post(events.TickEvent(elapsed_time=elapsed_time))
+
+    def stats(self):
+        """Return the network statistics of the bot (see NetworkEventManager.network_stats).
+        """
+        return self._network_ev_manager.network_stats()
+
+    def shutdown(self):
+        try:
+            self._network_ev_manager.shutdown()
+        except Exception as e:
+            logging.debug("BotClient: Error on shutdown: %s" % e)
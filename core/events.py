@@ -2,8 +2,13 @@ import weakref
 import logging
 import collections
 import json
+import struct
+import array
+import sys
+import time
 import IPython
 import network
+import profiling
 
 
 class Event(object):
@@ -23,6 +28,14 @@ class TickEvent(Event):
         self.elapsed_time = elapsed_time
 
 
+class TickDoneEvent(Event):
+    """The tick done event is sent after all events that were posted until the end of a tick have been handled.
+    """
+
+    def __init__(self):
+        super(TickDoneEvent, self).__init__(name="Tick done")
+
+
 class InitEvent(Event):
     """The init event is sent after all models, views and controllers have been registered at the event manager.
     """
@@ -135,26 +148,45 @@ class CharacterMoveLeftRequest(Event):
     """This event is sent, when a controller wats to move a character to the left.
     """
 
-    def __init__(self, character_id):
+    def __init__(self, character_id, sequence=0):
         super(CharacterMoveLeftRequest, self).__init__(name="Character move left request")
         self.character_id = character_id
+        self.sequence = sequence  # input sequence number (0 if the input is not numbered)
 
 class CharacterMoveRightRequest(Event):
     """This event is sent, when a controller wants to move a character to the right.
     """
 
-    def __init__(self, character_id):
+    def __init__(self, character_id, sequence=0):
         super(CharacterMoveRightRequest, self).__init__(name="Character move right request")
         self.character_id = character_id
+        self.sequence = sequence  # input sequence number (0 if the input is not numbered)
 
 
 class CharacterJumpRequest(Event):
     """This event is sent, when a controller wants a character to jump.
     """
 
-    def __init__(self, character_id):
+    def __init__(self, character_id, sequence=0):
         super(CharacterJumpRequest, self).__init__(name="Character jump request")
         self.character_id = character_id
+        self.sequence = sequence  # input sequence number (0 if the input is not numbered)
+
+
+class CharacterInputState(Event):
+    """
+    This event is sent, when a controller changes the buttons that are held for a character. The buttons are a bitmask
+    of LEFT and RIGHT. The model moves the character in every world step while a button is held.
+    """
+
+    LEFT = 1
+    RIGHT = 2
+
+    def __init__(self, character_id, buttons, sequence=0):
+        super(CharacterInputState, self).__init__(name="Character input state")
+        self.character_id = character_id
+        self.buttons = buttons
+        self.sequence = sequence  # input sequence number (0 if the input is not numbered)
 
 
 class ModelBroadcastRequest(Event):
@@ -176,6 +208,39 @@ class ModelBroadcast(Event):
         self.data = data
 
 
+class ModelDeltaBroadcast(Event):
+    """
+    This event contains the state of all bodies that changed since the baseline model broadcast (see the snapshot
+    module). A baseline of -1 means that the data contains the full state.
+    """
+
+    def __init__(self, sequence, baseline, data):
+        super(ModelDeltaBroadcast, self).__init__(name="Model delta broadcast")
+        self.sequence = sequence
+        self.baseline = baseline
+        self.data = data
+
+
+class ModelBroadcastAck(Event):
+    """This event is sent by a client after it applied the model delta broadcast with the given sequence number.
+    """
+
+    def __init__(self, sequence):
+        super(ModelBroadcastAck, self).__init__(name="Model broadcast ack")
+        self.sequence = sequence
+
+
+class ModelSnapshotApplied(Event):
+    """
+    This event is sent by a client model after it applied an authoritative snapshot. The data contains the full
+    snapshot (see the snapshot module).
+    """
+
+    def __init__(self, data):
+        super(ModelSnapshotApplied, self).__init__(name="Model snapshot applied")
+        self.data = data
+
+
 class ModelMetaBroadcastRequest(Event):
     """
     This event is sent, when a component needs meta information (such as level name, number of characters, ...)
@@ -234,45 +299,141 @@ class AssignCharacter(Event):
         self.character_id = character_id
 
 
+class JoinMatch(Event):
+    """
+    This event is sent by a client to a match host to join the match with the given id. A match id of -1 joins the
+    first match that has a free character.
+    """
+
+    def __init__(self, match_id):
+        super(JoinMatch, self).__init__(name="Join match")
+        self.match_id = match_id
+
+
+class IdleStateEvent(Event):
+    """
+    This event is sent by a view when it becomes idle (nothing changed on the screen for a while) or active again.
+    The TickerController lowers the tick rate while the view is idle.
+    """
+
+    def __init__(self, idle):
+        super(IdleStateEvent, self).__init__(name="Idle state")
+        self.idle = idle
+
+
 class EventManager(object):
     """
-    Receives events and posts them to all _listeners.
+    Receives events and posts them to the registered listeners.
     Is used for communication between Model, View and Controller.
+
+    A listener can be registered with a list of event classes. It is then only notified about events that are instances
+    of one of these classes. Listeners that are registered without event classes are notified about all events.
+
+    If the event manager has a profiler (see the profiling module), the time of each listener per event class and the
+    time of each tick are recorded. The components use the profiler of their event manager for their own phases.
     """
 
-    def __init__(self):
-        self._listeners = weakref.WeakKeyDictionary()
+    def __init__(self, profiler=None, tick_phase="tick"):
+        """
+        :param profiler: None or a profiling.Profiler
+        :param tick_phase: name of the phase in the profiler that contains the whole tick
+        """
+        self.profiler = profiler
+        self._tick_phase = tick_phase
+        self._profile_names = {}  # {(listener class, event class): name of the notify phase in the profiler}
+        self._listeners = weakref.WeakKeyDictionary()  # {listener: id}
+        self._subscriptions = weakref.WeakKeyDictionary()  # {listener: tuple of event classes or None}
+        self._dispatch_table = {}  # {event class: list of weak references to the interested listeners}
         self.next_model_name = None
         self._queue = collections.deque()
         self._next_id = 0
+        self._tick_done_event = TickDoneEvent()
 
-    def register_listener(self, listener):
+    def register_listener(self, listener, event_classes=None):
+        """
+        Register the listener and return its id.
+
+        :param listener: object with a notify(event) method
+        :param event_classes: the listener is only notified about instances of these classes (all events if None)
+        """
         id = self._next_id
         self._next_id += 1
         self._listeners[listener] = id
+        if event_classes is None:
+            self._subscriptions[listener] = None
+        else:
+            self._subscriptions[listener] = tuple(event_classes)
+        self._dispatch_table.clear()
         logging.debug("Register listener: %s, id %d" % (listener.__class__.__name__, id))
         return id
 
     def unregister_listener(self, listener):
         if listener in self._listeners:
             del self._listeners[listener]
+            del self._subscriptions[listener]
+            self._dispatch_table.clear()
             logging.debug("Unregister listener: %s" % listener.__class__.__name__)
 
+    def _get_listeners(self, cls):
+        """Return the weak references to all listeners that are interested in events of the given class.
+        """
+        refs = self._dispatch_table.get(cls)
+        if refs is None:
+            # Resolve the listeners for the given class once and keep them in the dispatch table until a listener
+            # is registered or unregistered. The listeners are kept in the order of registration.
+            interested = []
+            for l, classes in self._subscriptions.items():
+                if classes is None or issubclass(cls, classes):
+                    interested.append((self._listeners[l], weakref.ref(l)))
+            interested.sort(key=lambda x: x[0])
+            refs = [r for i, r in interested]
+            self._dispatch_table[cls] = refs
+        return refs
+
+    def _dispatch(self, event):
+        """Notify all interested listeners about the event.
+        """
+        # The listener lists in the dispatch table are never modified (the table is cleared instead), so even from
+        # within the loop listeners can delete themselves.
+        if self.profiler is not None:
+            self._profiled_dispatch(event)
+            return
+        for r in self._get_listeners(event.__class__):
+            l = r()
+            if l is not None:
+                l.notify(event)
+
+    def _profiled_dispatch(self, event):
+        """Notify all interested listeners about the event and record the time of each listener.
+        """
+        for r in self._get_listeners(event.__class__):
+            l = r()
+            if l is not None:
+                key = (l.__class__, event.__class__)
+                name = self._profile_names.get(key)
+                if name is None:
+                    name = "notify.%s.%s" % (l.__class__.__name__, event.__class__.__name__)
+                    self._profile_names[key] = name
+                start = time.time()
+                l.notify(event)
+                self.profiler.record(name, time.time() - start)
+
     def post(self, event):
         self._queue.append(event)
         if isinstance(event, CloseCurrentModel):
             self.next_model_name = event.next_model_name
         elif isinstance(event, TickEvent) or isinstance(event, InitEvent):
+            start = time.time()
             while len(self._queue) > 0:
                 ev = self._queue.popleft()
                 if not isinstance(ev, TickEvent) and not isinstance(ev, WorldStep):
                     logging.debug("Event: %s" % ev.name)
-
-                # Iterate over a copy of the dict, so even from within the loop listeners
-                # can delete themselves from the dict.
-                listeners = list(self._listeners)
-                for l in listeners:
-                    l.notify(ev)
+                self._dispatch(ev)
+            if isinstance(event, TickEvent):
+                # Events that are posted by the listeners of the tick done event are handled in the next tick.
+                self._dispatch(self._tick_done_event)
+                if self.profiler is not None:
+                    self.profiler.record(self._tick_phase, time.time() - start)
 
 
 class NetworkEventManager(EventManager):
@@ -282,28 +443,72 @@ class NetworkEventManager(EventManager):
     All events coming from the normal event manager are given to the controllers.
     """
 
-    def __init__(self, ev_manager, host, port=32072):
+    def __init__(self, ev_manager, host, port=32072, codec="json", predict_events=None, match_id=None,
+                 flush_events=None, transport="tcp", unreliable_events=None):
+        """
+        :param ev_manager: the normal event manager
+        :param host: server host
+        :param port: server port
+        :param codec: name of the codec in codecs
+        :param predict_events: events of these classes get a sequence number and are posted in the normal event manager
+                               in addition to being sent over network (client-side prediction)
+        :param match_id: if not None, the client joins this match of a match host (see JoinMatch)
+        :param flush_events: events of these classes are sent immediately, all other events are sent together at the
+                             end of the tick (see TickDoneEvent)
+        :param transport: name of the network client in network.client_transports
+        :param unreliable_events: events of these classes are sent on the unreliable channel of the transport (if it
+                                  has one)
+        """
         assert isinstance(ev_manager, EventManager)
         self._ev_manager = ev_manager
         self._ev_manager.register_listener(self)
-        super(NetworkEventManager, self).__init__()
-        self._client = network.NetworkClient(host=host, port=port, decode=to_event, encode=to_string)
-        self._ignore_events = [TickEvent, InitEvent]
+        super(NetworkEventManager, self).__init__(profiler=ev_manager.profiler)
+        encode, decode, header = codecs[codec]
+        encode = profiling.timed(self.profiler, "network.encode", encode)
+        decode = profiling.timed(self.profiler, "network.decode", decode)
+        self._client = network.client_transports[transport](host=host, port=port, decode=decode, encode=encode,
+                                                            header=header)
+        if match_id is not None:
+            self._client.send(JoinMatch(match_id))
+        self._ignore_events = [TickEvent, InitEvent, TickDoneEvent]
         # TODO: Complete the list of ignore-events. What about WorldStep and CloseCurrentModel?
+        if predict_events is None:
+            self._predict_events = ()
+        else:
+            self._predict_events = tuple(predict_events)
+        if flush_events is None:
+            self._flush_events = ()
+        else:
+            self._flush_events = tuple(flush_events)
+        if unreliable_events is None:
+            self._unreliable_events = ()
+        else:
+            self._unreliable_events = tuple(unreliable_events)
+        self._next_sequence = 1
 
     def post(self, event):
         if isinstance(event, CloseCurrentModel):
             self._ev_manager.post(event)
+        if isinstance(event, self._predict_events):
+            event.sequence = self._next_sequence
+            self._next_sequence += 1
+            self._ev_manager.post(event)
         for cls in self._ignore_events:
             if isinstance(event, cls):
                 break
         else:
-            self._client.send(event)
+            reliable = not isinstance(event, self._unreliable_events)
+            if isinstance(event, self._flush_events):
+                self._client.send(event, reliable)
+            else:
+                self._client.queue(event, reliable)
 
     def notify(self, event):
-        listeners = list(self._listeners)
-        for l in listeners:
-            l.notify(event)
+        self._dispatch(event)
+
+        if isinstance(event, TickDoneEvent):
+            with profiling.section(self.profiler, "network.send"):
+                self._client.flush()
 
         if isinstance(event, TickEvent):
             event_list = self._client.get_objects()
@@ -314,24 +519,36 @@ class NetworkEventManager(EventManager):
                 else:
                     self._ev_manager.post(ev)
 
+    def network_stats(self):
+        """Return the dictionary with the number of sent and received objects and their encoded size in bytes.
+        """
+        return {"bytes_sent": self._client.num_bytes_sent, "bytes_received": self._client.num_bytes_received,
+                "objects_sent": self._client.num_objects_sent,
+                "objects_received": self._client.num_objects_received}
+
     def shutdown(self):
         self._client.close_all()
 
 
 # Create a dictionary {class_identifier: class} and a dictionary {class: class_identifier}.
 # Currently, __class__.__name__ is used as identifier, but this may change later.
+# The binary codec uses the index in _event_classes as identifier, so new classes must be appended at the end.
 _event_classes = [TickEvent, InitEvent, MenuCreatedEvent, ButtonHoverRequestedEvent, ButtonUnhoverRequestedEvent,
                   ButtonHoverEvent, ButtonUnhoverEvent, ButtonPressRequestedEvent, ButtonPressEvent,
                   ButtonActionRequestedEvent, ButtonActionEvent, CloseCurrentModel, WorldStep, AssignCharacter,
                   CharacterMoveLeftRequest, CharacterMoveRightRequest, CharacterJumpRequest, ModelBroadcastRequest,
                   ModelBroadcast, ModelMetaBroadcast, ModelMetaBroadcastRequest, ClientAccepted, ClientRemoved,
-                  AssignCharacterToClient]
+                  AssignCharacterToClient, ModelDeltaBroadcast, ModelBroadcastAck, ModelSnapshotApplied,
+                  JoinMatch, TickDoneEvent, CharacterInputState, IdleStateEvent]
 _str_to_cls = {}
 _cls_to_str = {}
 for _cls in _event_classes:
     _s = _cls.__name__
     _str_to_cls[_s] = _cls
     _cls_to_str[_cls] = _s
+_cls_to_id = {}
+for _i, _cls in enumerate(_event_classes):
+    _cls_to_id[_cls] = _i
 
 
 def to_string(event):
@@ -354,3 +571,102 @@ def to_event(s):
     event = object.__new__(cls)
     event.__dict__.update(event_dict)
     return event
+
+
+class _StructSchema(object):
+    """
+    Binary layout of an event whose attributes are packed with a fixed struct format.
+    The attributes must be the positional arguments of the event constructor.
+    """
+
+    def __init__(self, cls, fmt, attributes):
+        self._cls = cls
+        self._struct = struct.Struct("!" + fmt)
+        self._attributes = attributes
+
+    def pack(self, event):
+        return self._struct.pack(*[getattr(event, a) for a in self._attributes])
+
+    def unpack(self, s, offset):
+        return self._cls(*self._struct.unpack_from(s, offset))
+
+
+class _FloatArraySchema(object):
+    """
+    Binary layout of an event whose last attribute holds a flat list of numbers. The other attributes are packed with a
+    fixed struct format. The numbers are packed as 32 bit floats in network byte order, prefixed with their count.
+    The attributes must be the positional arguments of the event constructor.
+    """
+
+    def __init__(self, cls, fmt, attributes, array_attribute):
+        self._cls = cls
+        self._struct = struct.Struct("!" + fmt + "I")
+        self._attributes = attributes
+        self._array_attribute = array_attribute
+
+    def pack(self, event):
+        values = array.array("f", getattr(event, self._array_attribute))
+        if sys.byteorder == "little":
+            values.byteswap()
+        args = [getattr(event, a) for a in self._attributes]
+        args.append(len(values))
+        return self._struct.pack(*args) + values.tostring()
+
+    def unpack(self, s, offset):
+        args = list(self._struct.unpack_from(s, offset))
+        count = args.pop()
+        offset += self._struct.size
+        values = array.array("f")
+        values.fromstring(s[offset:offset+4*count])
+        if sys.byteorder == "little":
+            values.byteswap()
+        args.append(values.tolist())
+        return self._cls(*args)
+
+
+# Events that are sent very often have a fixed binary layout. All other events are encoded as json.
+_binary_schemas = {
+    CharacterMoveLeftRequest: _StructSchema(CharacterMoveLeftRequest, "iI", ["character_id", "sequence"]),
+    CharacterMoveRightRequest: _StructSchema(CharacterMoveRightRequest, "iI", ["character_id", "sequence"]),
+    CharacterJumpRequest: _StructSchema(CharacterJumpRequest, "iI", ["character_id", "sequence"]),
+    ModelBroadcast: _FloatArraySchema(ModelBroadcast, "", [], "data"),
+    ModelDeltaBroadcast: _FloatArraySchema(ModelDeltaBroadcast, "ii", ["sequence", "baseline"], "data"),
+    ModelBroadcastAck: _StructSchema(ModelBroadcastAck, "i", ["sequence"]),
+    JoinMatch: _StructSchema(JoinMatch, "i", ["match_id"]),
+    CharacterInputState: _StructSchema(CharacterInputState, "iBI", ["character_id", "buttons", "sequence"])
+}
+_type_struct = struct.Struct("!B")
+
+
+def to_bytes(event):
+    """
+    Return a compact binary string that can be decoded to the given event.
+    The string starts with the event type id, followed by the fixed binary layout of the event or its json dict.
+    """
+    cls = event.__class__
+    type_id = _type_struct.pack(_cls_to_id[cls])
+    schema = _binary_schemas.get(cls)
+    if schema is None:
+        return type_id + json.dumps(event.__dict__)
+    else:
+        return type_id + schema.pack(event)
+
+
+def from_bytes(s):
+    """Return the event that was encoded in the given binary string.
+    """
+    cls = _event_classes[_type_struct.unpack_from(s)[0]]
+    schema = _binary_schemas.get(cls)
+    if schema is None:
+        event = object.__new__(cls)
+        event.__dict__.update(json.loads(s[_type_struct.size:]))
+        return event
+    else:
+        return schema.unpack(s, _type_struct.size)
+
+
+# The codecs that can be used to send events over the network: {name: (encode, decode, frame header)}.
+codecs = {
+    "json": (to_string, to_event, network.AsciiLengthHeader()),
+    "binary": (to_bytes, from_bytes, network.BinaryLengthHeader())
+}
@@ -1,4 +1,5 @@
 import pygame
+import time
 import events
 import menu_io
 import menu
@@ -9,26 +10,79 @@ import stage_view
 import stage_io
 import network
 import network_controller
+import match_host
+import match_pool
+import netsim
+import profiling
+import resource_manager
 
 
 class TickerController(object):
     """
     Regularly sends a tick event to keep the game running (heart beat).
+    While a view is idle (see IdleStateEvent), the ticks are sent with the lower idle_fps rate.
     """
 
-    def __init__(self, ev_manager, fps=60):
+    def __init__(self, ev_manager, fps=60, idle_fps=10):
+        assert 0 < idle_fps <= fps
         self._ev_manager = ev_manager
-        self._ev_manager.register_listener(self)
+        self._ev_manager.register_listener(self, [events.CloseCurrentModel, events.IdleStateEvent])
         self._running = False
         self._fps = fps
+        self._idle_fps = idle_fps
+        self._idle = False
         self._clock = pygame.time.Clock()
 
     def run(self):
         self._running = True
+        self._idle = False
         elapsed_time = 0
         while self._running:
             self._ev_manager.post(events.TickEvent(elapsed_time=elapsed_time))
-            elapsed_time = self._clock.tick(self._fps) / 1000.0  # elapsed time since last frame in seconds
+            fps = self._idle_fps if self._idle else self._fps
+            elapsed_time = self._clock.tick(fps) / 1000.0  # elapsed time since last frame in seconds
+
+    def notify(self, event):
+        if isinstance(event, events.CloseCurrentModel):
+            self._running = False
+        elif isinstance(event, events.IdleStateEvent):
+            self._idle = event.idle
+
+
+class HeadlessTickerController(object):
+    """
+    Regularly sends a tick event like the TickerController, but does not use Pygame.
+    The ticks are scheduled on fixed deadlines, so the tick rate does not drift. If a tick takes longer than the tick
+    interval, the schedule is reset instead of sending the missed ticks in a burst.
+    The ticker stops on a KeyboardInterrupt.
+    """
+
+    def __init__(self, ev_manager, fps=60):
+        self._ev_manager = ev_manager
+        self._ev_manager.register_listener(self, [events.CloseCurrentModel])
+        self._running = False
+        self._interval = 1.0 / fps
+
+    def run(self):
+        self._running = True
+        elapsed_time = 0
+        last_tick = time.time()
+        next_tick = last_tick
+        try:
+            while self._running:
+                self._ev_manager.post(events.TickEvent(elapsed_time=elapsed_time))
+                next_tick += self._interval
+                now = time.time()
+                if next_tick > now:
+                    time.sleep(next_tick - now)
+                else:
+                    next_tick = now
+                now = time.time()
+                elapsed_time = now - last_tick  # elapsed time since last frame in seconds
+                last_tick = now
+        except KeyboardInterrupt:
+            logging.debug("HeadlessTickerController: Interrupted")
+            self._running = False
 
     def notify(self, event):
         if isinstance(event, events.CloseCurrentModel):
@@ -50,9 +104,26 @@ class GameApp(object):
             "Main Menu": self._main_menu_model,
             "Stage": self._stage_model
         }
-        self._ev_manager = events.EventManager()
+        self._profiler = None
+        self._metrics_server = None
+        if self._args.profile or self._args.profile_output is not None or self._args.metrics_port is not None:
+            self._profiler = profiling.Profiler()
+            if self._args.metrics_port is not None:
+                self._metrics_server = profiling.MetricsServer(self._profiler, port=self._args.metrics_port)
+        self._ev_manager = events.EventManager(profiler=self._profiler)
+        resource_manager.ResourceManager.instance().set_max_image_bytes(self._args.image_cache_size * 1024 * 1024)
         self._ev_manager.next_model_name = self._args.model
-        self._ticker = TickerController(self._ev_manager, self._args.fps)
+        if self._args.headless:
+            # A dedicated server has no menu.
+            self._ev_manager.next_model_name = "Stage"
+            self._ticker = HeadlessTickerController(self._ev_manager, self._args.fps)
+        else:
+            self._ticker = TickerController(self._ev_manager, self._args.fps, min(self._args.idle_fps, self._args.fps))
+
+    def _server_engine(self):
+        if self._args.transport == "udp":
+            return "udp"
+        return self._args.server_engine
 
     def _main_menu_model(self):
         logging.debug("GameApp: Loading main menu model")
@@ -69,25 +140,78 @@ class GameApp(object):
     def _stage_model(self):
         logging.debug("GameApp: Loading stage model")
 
-        if self._args.server:
-            stage_model = stage.StageModel(self._ev_manager, ignore_model_broadcasts=True)
+        if self._args.server and self._args.workers is not None:
+            # Dedicated server that distributes the matches over several processes.
+            network_server_controller = match_pool.MatchPool(
+                self._ev_manager, num_workers=self._args.workers, num_matches=self._args.matches,
+                port=self._args.port, codec=self._args.codec, engine=self._server_engine(), fps=self._args.fps,
+                physics_rate=self._args.physics_rate, model_broadcast_rate=self._args.snapshot_rate,
+                interest_cell_size=self._args.interest_cell_size)
+        elif self._args.server and self._args.matches is not None:
+            # Dedicated server that hosts several matches.
+            network_server_controller = match_host.MatchHost(
+                self._ev_manager, self._args.matches, port=self._args.port, codec=self._args.codec,
+                engine=self._server_engine(), physics_rate=self._args.physics_rate,
+                model_broadcast_rate=self._args.snapshot_rate,
+                interest_cell_size=self._args.interest_cell_size)
+        elif self._args.server and self._args.headless:
+            # Dedicated server without window and local player.
+            stage_model = stage.StageModel(self._ev_manager, ignore_model_broadcasts=True,
+                                           physics_rate=self._args.physics_rate)
+            max_num_clients = self._args.max_clients if self._args.max_clients is not None else 2
+            network_server_controller = network_controller.ServerController(
+                self._ev_manager, port=self._args.port, max_num_clients=max_num_clients, codec=self._args.codec,
+                engine=self._server_engine(), model_broadcast_rate=self._args.snapshot_rate,
+                interest_cell_size=self._args.interest_cell_size, flush_events=[events.AssignCharacter])
+            load_controller = stage.StageStateController(self._ev_manager, local_player=False)
+        elif self._args.server:
+            stage_model = stage.StageModel(self._ev_manager, ignore_model_broadcasts=True,
+                                           physics_rate=self._args.physics_rate)
             stage_pygame_view = stage_view.StagePygameView(self._ev_manager, stage_model)
             stage_controller = stage_io.StageIOController(self._ev_manager, character_index=0)
-            network_server_controller = network_controller.ServerController(self._ev_manager, max_num_clients=1)
+            max_num_clients = self._args.max_clients if self._args.max_clients is not None else 1
+            network_server_controller = network_controller.ServerController(
+                self._ev_manager, port=self._args.port, max_num_clients=max_num_clients, codec=self._args.codec,
+                engine=self._server_engine(), model_broadcast_rate=self._args.snapshot_rate,
+                interest_cell_size=self._args.interest_cell_size, flush_events=[events.AssignCharacter])
             load_controller = stage.StageStateController(self._ev_manager)
         elif self._args.client:
             # Network-Client.
-            stage_model = stage.StageModel(self._ev_manager)
-            stage_pygame_view = stage_view.StagePygameView(self._ev_manager, stage_model)
+            stage_model = stage.StageModel(self._ev_manager, physics_rate=self._args.physics_rate)
+            stage_pygame_view = stage_view.StagePygameView(self._ev_manager, stage_model,
+                                                           interpolation_delay=self._args.interpolation_delay)
 
-            # TODO: Somehow get the host.
             from socket import gethostname
-            network_ev_manager = events.NetworkEventManager(self._ev_manager, gethostname())
+            if self._args.host is None:
+                host = gethostname()
+            else:
+                host = self._args.host
+            port = self._args.port
+            simulator = None
+            if self._args.netsim:
+                # Connect through a local proxy that simulates the network conditions in both directions.
+                upstream, downstream = [netsim.LinkConditions(latency=self._args.netsim_latency,
+                                                              jitter=self._args.netsim_jitter,
+                                                              bandwidth=self._args.netsim_bandwidth,
+                                                              loss=self._args.netsim_loss,
+                                                              reorder=self._args.netsim_reorder) for _ in xrange(2)]
+                simulator = netsim.NetworkSimulator(host, port, upstream=upstream, downstream=downstream,
+                                                    protocol=self._args.transport, seed=self._args.netsim_seed)
+                simulator.start()
+                host, port = gethostname(), simulator.port
+            predict_events = [events.CharacterMoveLeftRequest, events.CharacterMoveRightRequest,
+                              events.CharacterJumpRequest, events.CharacterInputState]
+            network_ev_manager = events.NetworkEventManager(self._ev_manager, host, port=port,
+                                                            codec=self._args.codec, predict_events=predict_events,
+                                                            match_id=self._args.match, transport=self._args.transport,
+                                                            flush_events=[events.CharacterJumpRequest],
+                                                            unreliable_events=[events.CharacterInputState,
+                                                                               events.ModelBroadcastAck])
             stage_controller = stage_io.StageIOController(network_ev_manager)
             load_controller = stage.StageStateClientController(network_ev_manager)
         else:
             # Single-player.
-            stage_model = stage.StageModel(self._ev_manager)
+            stage_model = stage.StageModel(self._ev_manager, physics_rate=self._args.physics_rate)
             stage_pygame_view = stage_view.StagePygameView(self._ev_manager, stage_model)
             stage_controller = stage_io.StageIOController(self._ev_manager)
             load_controller = stage.StageStateController(self._ev_manager)
@@ -100,6 +224,8 @@ class GameApp(object):
             network_server_controller.shutdown()
         elif self._args.client:
             network_ev_manager.shutdown()
+            if simulator is not None:
+                simulator.stop()
 
     def run(self):
         """Runs the game loop.
@@ -181,7 +307,11 @@ class GameApp(object):
         # return
 
         # Show the window.
-        pygame.display.set_mode((self._args.width, self._args.height))
+        if not self._args.headless:
+            pygame.display.set_mode((self._args.width, self._args.height))
+
+        if self._metrics_server is not None:
+            self._metrics_server.start()
 
         while self._ev_manager.next_model_name is not None:
             if self._ev_manager.next_model_name in self._models:
@@ -193,4 +323,11 @@ class GameApp(object):
                 raise Exception("Unknown model name: %s" % self._ev_manager.next_model_name)
 
         # Quit when all models finished.
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        if self._profiler is not None:
+            if self._args.profile_output is not None:
+                self._profiler.write_json(self._args.profile_output)
+            else:
+                print self._profiler.to_json()
         pygame.quit()
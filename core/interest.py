@@ -0,0 +1,95 @@
+"""
+Interest management for the server.
+
+The bodies of a snapshot are sorted into a uniform grid over the stage. A client is only interested in the bodies in
+the cells around its character, so the server does not have to send the state of far away bodies.
+"""
+import math
+import snapshot
+
+
+class SpatialGrid(object):
+    """
+    A uniform grid that maps cells of size cell_size x cell_size (in game coordinates) to the keys of the bodies
+    inside. The grid is unbounded, so it works for stages of any size.
+    """
+
+    def __init__(self, cell_size):
+        assert cell_size > 0
+        self._cell_size = float(cell_size)
+        self._cells = {}  # {(cell x, cell y): list of keys}
+
+    def cell(self, x, y):
+        """Return the cell that contains the given position.
+        """
+        return int(math.floor(x / self._cell_size)), int(math.floor(y / self._cell_size))
+
+    def clear(self):
+        self._cells.clear()
+
+    def insert(self, key, x, y):
+        self._cells.setdefault(self.cell(x, y), []).append(key)
+
+    def query(self, x, y, radius=1):
+        """Return the set of keys in the cells whose distance to the cell of the given position is at most radius.
+        """
+        cx, cy = self.cell(x, y)
+        keys = set()
+        for i in xrange(cx - radius, cx + radius + 1):
+            for j in xrange(cy - radius, cy + radius + 1):
+                keys.update(self._cells.get((i, j), ()))
+        return keys
+
+
+class InterestManager(object):
+    """
+    Computes the bodies each client is interested in: all bodies near the character of the client and the character
+    itself. Clients without character are interested in all bodies.
+    """
+
+    def __init__(self, cell_size=5.0, radius=1):
+        """
+        :param cell_size: cell size of the spatial grid in game coordinates
+        :param radius: a client is interested in the bodies that are at most this many cells away from its character
+        """
+        assert radius >= 0
+        self._grid = SpatialGrid(cell_size)
+        self._radius = radius
+        self._client_characters = {}  # {client: character id}
+
+    def assign_character(self, client, character_id):
+        self._client_characters[client] = character_id
+
+    def remove_client(self, client):
+        self._client_characters.pop(client, None)
+
+    def interests(self, data):
+        """
+        Return the dictionary {client: set of body keys (kind, id)} with the interests of all clients that have a
+        character in the given snapshot data.
+        """
+        self._grid.clear()
+        positions = {}
+        for r in snapshot.records(data):
+            key = (r[0], r[1])
+            self._grid.insert(key, r[2], r[3])
+            positions[key] = (r[2], r[3])
+        result = {}
+        for client, character_id in self._client_characters.iteritems():
+            key = (snapshot.CHARACTER, character_id)
+            if key in positions:
+                x, y = positions[key]
+                keys = self._grid.query(x, y, self._radius)
+                keys.add(key)
+                result[client] = keys
+        return result
+
+
+def filter_records(data, keys):
+    """Return the snapshot data that only contains the records of the bodies with the given keys.
+    """
+    filtered = []
+    for r in snapshot.records(data):
+        if (r[0], r[1]) in keys:
+            filtered.extend(r)
+    return filtered
@@ -0,0 +1,196 @@
+"""
+Load generator.
+
+Starts many BotClients against one server and reports the server tick time, the network traffic and the input
+latency of the bots. Without a target host, the load generator starts a dedicated match host server in a separate
+process, so that the server has its own core and its tick time can be measured.
+"""
+import logging
+import multiprocessing
+import signal
+import socket
+import time
+import events
+import match_host
+import bot
+import stats
+
+
+def run_load_server(conn, port, num_matches, codec="json", engine="select", fps=60, physics_rate=None,
+                    model_broadcast_rate=20):
+    """
+    Main function of the server process of the load generator. Runs a MatchHost and measures the time of each tick.
+    The server stops when it receives a message on the pipe and sends back the list of tick times in seconds.
+
+    :param conn: pipe connection to the load generator
+    :param port: port
+    :param num_matches: number of matches
+    :param codec: name of the codec in events.codecs
+    :param engine: name of the network server in network.server_engines
+    :param fps: number of ticks per second
+    :param physics_rate: number of fixed physics steps per second (see StageModel)
+    :param model_broadcast_rate: number of model broadcasts per second
+    """
+    # The load generator handles the KeyboardInterrupt and stops the server.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    ev_manager = events.EventManager()
+    host = match_host.MatchHost(ev_manager, num_matches, port=port, codec=codec, engine=engine,
+                                physics_rate=physics_rate, model_broadcast_rate=model_broadcast_rate)
+    ev_manager.post(events.InitEvent())
+    conn.send("ready")
+    tick_times = []
+    interval = 1.0 / fps
+    last_tick = time.time()
+    next_tick = last_tick
+    elapsed_time = 0
+    while not conn.poll():
+        start = time.time()
+        ev_manager.post(events.TickEvent(elapsed_time=elapsed_time))
+        tick_times.append(time.time() - start)
+
+        # Wait for the next tick.
+        next_tick += interval
+        now = time.time()
+        if next_tick > now:
+            time.sleep(next_tick - now)
+        else:
+            next_tick = now
+        now = time.time()
+        elapsed_time = now - last_tick
+        last_tick = now
+    conn.recv()
+    host.shutdown()
+    conn.send(tick_times)
+    conn.close()
+
+
+class LoadGenerator(object):
+    """
+    Runs num_bots BotClients in this process. The bots join a match with the id -1, so a server with N matches takes
+    2 * N bots. If host is None, a match host with enough matches is started in a separate process.
+    """
+
+    def __init__(self, num_bots, host=None, port=32072, codec="json", transport="tcp", engine="select", fps=30,
+                 server_fps=60, connect_interval=0.01, seed=None):
+        """
+        :param num_bots: number of bots
+        :param host: host of the server, or None to start a local server
+        :param port: server port
+        :param codec: name of the codec in events.codecs
+        :param transport: name of the network client in network.client_transports
+        :param engine: name of the network server of the local server in network.server_engines
+        :param fps: number of ticks per second of the bots
+        :param server_fps: number of ticks per second of the local server
+        :param connect_interval: delay between the connections of the bots in seconds
+        :param seed: seed of the random inputs (bot i uses seed + i)
+        """
+        assert num_bots > 0
+        assert fps > 0
+        if transport == "udp":
+            engine = "udp"
+        self._num_bots = num_bots
+        self._host = host
+        self._port = port
+        self._codec = codec
+        self._transport = transport
+        self._engine = engine
+        self._interval = 1.0 / fps
+        self._server_fps = server_fps
+        self._connect_interval = connect_interval
+        self._seed = seed
+        self._server = None  # (process, pipe connection) of the local server
+        self._bots = []
+
+    def _start_server(self):
+        conn, server_conn = multiprocessing.Pipe()
+        num_matches = (self._num_bots + 1) // 2
+        process = multiprocessing.Process(target=run_load_server, args=(server_conn, self._port, num_matches),
+                                          kwargs={"codec": self._codec, "engine": self._engine,
+                                                  "fps": self._server_fps})
+        process.daemon = True
+        process.start()
+        conn.recv()
+        self._server = (process, conn)
+
+    def _stop_server(self):
+        """Stop the local server and return its tick times.
+        """
+        process, conn = self._server
+        conn.send("stop")
+        tick_times = conn.recv()
+        process.join()
+        self._server = None
+        return tick_times
+
+    def run(self, duration):
+        """Connect the bots, let them play for duration seconds and return the report (see report()).
+        """
+        if self._host is None:
+            self._start_server()
+            host = socket.gethostname()
+        else:
+            host = self._host
+        try:
+            for i in xrange(self._num_bots):
+                seed = None if self._seed is None else self._seed + i
+                self._bots.append(bot.BotClient(host, port=self._port, codec=self._codec, match_id=-1,
+                                                transport=self._transport, seed=seed))
+                time.sleep(self._connect_interval)
+            logging.debug("LoadGenerator: Connected %d bots." % self._num_bots)
+
+            start = time.time()
+            last_tick = start
+            next_tick = start
+            elapsed_time = 0
+            try:
+                while last_tick - start < duration:
+                    for b in self._bots:
+                        b.tick(elapsed_time)
+                    next_tick += self._interval
+                    now = time.time()
+                    if next_tick > now:
+                        time.sleep(next_tick - now)
+                    else:
+                        next_tick = now
+                    now = time.time()
+                    elapsed_time = now - last_tick
+                    last_tick = now
+            except KeyboardInterrupt:
+                logging.debug("LoadGenerator: Interrupted")
+            measured_time = time.time() - start
+        finally:
+            for b in self._bots:
+                b.shutdown()
+            tick_times = None
+            if self._server is not None:
+                tick_times = self._stop_server()
+        return self.report(measured_time, tick_times)
+
+    def report(self, duration, tick_times=None):
+        """
+        Return the dictionary with the results of a run. The bytes and messages are counted on the bots, so the bytes
+        in and out of the server are the received and sent bytes of the bots (encoded events without frame headers).
+
+        :param duration: measured duration in seconds
+        :param tick_times: tick times of the server in seconds (None if unknown)
+        """
+        bot_stats = [b.stats() for b in self._bots]
+        totals = {}
+        for key in ("bytes_sent", "bytes_received", "objects_sent", "objects_received"):
+            totals[key] = sum(s[key] for s in bot_stats)
+        latencies = []
+        for b in self._bots:
+            latencies.extend(b.controller.latencies)
+        return {
+            "bots": self._num_bots,
+            "duration": duration,
+            "server_tick_time": None if tick_times is None else stats.summarize(tick_times),
+            "server_bytes_in": totals["bytes_sent"],
+            "server_bytes_out": totals["bytes_received"],
+            "server_bytes_in_per_second": totals["bytes_sent"] / duration,
+            "server_bytes_out_per_second": totals["bytes_received"] / duration,
+            "server_messages_in_per_second": totals["objects_sent"] / duration,
+            "server_messages_out_per_second": totals["objects_received"] / duration,
+            "input_latency": stats.summarize(latencies)
+        }
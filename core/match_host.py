@@ -0,0 +1,225 @@
+import logging
+import events
+import network
+import network_controller
+import profiling
+import stage
+
+
+class MatchServer(object):
+    """
+    The MatchServer class is the part of the network server of a MatchHost that belongs to a single match.
+    It has the same interface as network.NetworkServer, so it can be given to a ServerController, but it only contains
+    the clients that joined the match. The connections are accepted and closed by the match host.
+    """
+
+    def __init__(self, server):
+        """
+        :param server: the shared network server of the match host
+        """
+        self._server = server
+        self._clients = set()
+        self._new_client_names = []
+        self._removed_client_names = []
+        self._items = []
+
+    def num_clients(self):
+        return len(self._clients)
+
+    def accept_clients(self, max_num_connections=None):
+        """The match host accepts the connections, so this does nothing.
+        """
+        pass
+
+    def add_client(self, addr):
+        """Add the client with the given address to the match.
+        """
+        self._clients.add(addr)
+        self._new_client_names.append(addr)
+
+    def remove_client(self, addr):
+        """Remove the client with the given address from the match.
+        """
+        self._clients.discard(addr)
+        self._removed_client_names.append(addr)
+
+    def put(self, addr, obj):
+        """Add an object that was received from the client with the given address.
+        """
+        self._items.append((addr, obj))
+
+    def update_client_list(self):
+        """Return the names of the clients that were added and removed since the last call.
+        """
+        new_client_names, self._new_client_names = self._new_client_names, []
+        removed_client_names, self._removed_client_names = self._removed_client_names, []
+        return new_client_names, removed_client_names
+
+    def get_objects(self):
+        """Return a list with all objects that came in since the last call.
+        """
+        return [item for addr, item in self.get_objects_with_senders()]
+
+    def get_objects_with_senders(self):
+        """Return a list with the tuples (client address, object) of all objects that came in since the last call.
+        """
+        items, self._items = self._items, []
+        return items
+
+    def close_all(self):
+        """The match host closes the connections, so this only forgets the clients.
+        """
+        self._clients.clear()
+
+    def broadcast(self, obj, snapshot=False):
+        """Send the object to all clients of the match.
+        """
+        self._server.send_to_many(self._clients, obj, snapshot)
+
+    def send_to(self, addr, obj, snapshot=False):
+        """Send the object to the client with the given address if it belongs to the match.
+        """
+        self.send_to_many([addr], obj, snapshot)
+
+    def send_to_many(self, addrs, obj, snapshot=False):
+        """Send the object to the clients with the given addresses that belong to the match.
+        """
+        self._server.send_to_many(self._clients.intersection(addrs), obj, snapshot)
+
+    def flush(self):
+        """Send the queued data of the clients of the match.
+        """
+        self._server.flush(self._clients)
+
+
+class Match(object):
+    """
+    A single stage that is hosted by a MatchHost. Each match has its own event manager, stage model (and thus its own
+    Box2D world) and server controller.
+    """
+
+    def __init__(self, match_id, server, physics_rate=None, model_broadcast_rate=20, interest_cell_size=None,
+                 profiler=None):
+        """
+        :param match_id: match id
+        :param server: the shared network server of the match host
+        :param physics_rate: number of fixed physics steps per second (see StageModel)
+        :param model_broadcast_rate: number of model broadcasts per second
+        :param interest_cell_size: cell size of the interest management (see ServerController)
+        :param profiler: None or the profiler of the match host (the phases of all matches are recorded together)
+        """
+        self.match_id = match_id
+        self.server = MatchServer(server)
+        self.ev_manager = events.EventManager(profiler=profiler, tick_phase="match_tick")
+        self._stage_model = stage.StageModel(self.ev_manager, ignore_model_broadcasts=True, physics_rate=physics_rate)
+        self._state_controller = stage.StageStateController(self.ev_manager, local_player=False)
+        self._network_controller = network_controller.ServerController(self.ev_manager,
+                                                                       model_broadcast_rate=model_broadcast_rate,
+                                                                       server=self.server,
+                                                                       interest_cell_size=interest_cell_size,
+                                                                       flush_events=[events.AssignCharacter])
+
+    def is_full(self):
+        return self.server.num_clients() >= self._state_controller.num_client_characters()
+
+    def start(self):
+        self.ev_manager.post(events.InitEvent())
+
+    def tick(self, elapsed_time):
+        self.ev_manager.post(events.TickEvent(elapsed_time=elapsed_time))
+
+    def shutdown(self):
+        self._network_controller.shutdown()
+
+
+class MatchHost(object):
+    """
+    The MatchHost runs several independent matches in one process. All matches share a single listening socket. A new
+    client is not part of any match until it sends a JoinMatch event. After that, all events of the client are routed
+    to its match.
+    The match host is driven by the tick events of the given event manager.
+    """
+
+    def __init__(self, ev_manager, num_matches, port=32072, codec="json", engine="select", max_queued_bytes=None,
+                 max_queued_snapshots=1, physics_rate=None, model_broadcast_rate=20, interest_cell_size=None):
+        """
+        :param ev_manager: event manager that sends the init and tick events
+        :param num_matches: number of matches
+        :param port: port
+        :param codec: name of the codec in events.codecs
+        :param engine: name of the network server in network.server_engines
+        :param max_queued_bytes: a client is disconnected if more bytes are waiting to be sent to it
+        :param max_queued_snapshots: only this many model broadcasts are queued per client, older ones are dropped
+        :param physics_rate: number of fixed physics steps per second (see StageModel)
+        :param model_broadcast_rate: number of model broadcasts per second
+        :param interest_cell_size: cell size of the interest management (see ServerController)
+        """
+        assert num_matches > 0
+        assert isinstance(ev_manager, events.EventManager)
+        self._ev_manager = ev_manager
+        self._ev_manager.register_listener(self, [events.InitEvent, events.TickEvent])
+        encode, decode, header = events.codecs[codec]
+        encode = profiling.timed(ev_manager.profiler, "network.encode", encode)
+        decode = profiling.timed(ev_manager.profiler, "network.decode", decode)
+        self._server = network.server_engines[engine](port=port, decode=decode, encode=encode, header=header,
+                                                      max_queued_bytes=max_queued_bytes,
+                                                      max_queued_snapshots=max_queued_snapshots, batch=True)
+        self._matches = [Match(i, self._server, physics_rate=physics_rate, model_broadcast_rate=model_broadcast_rate,
+                               interest_cell_size=interest_cell_size, profiler=ev_manager.profiler)
+                         for i in xrange(num_matches)]
+        self._lobby = set()  # clients that did not join a match yet
+        self._client_matches = {}  # {client address: match}
+
+    def notify(self, event):
+        if isinstance(event, events.InitEvent):
+            self._server.accept_clients()
+            for match in self._matches:
+                match.start()
+        elif isinstance(event, events.TickEvent):
+            new_client_names, removed_client_names = self._server.update_client_list()
+            for addr in new_client_names:
+                self._lobby.add(addr)
+            for addr in removed_client_names:
+                self._lobby.discard(addr)
+                if addr in self._client_matches:
+                    self._client_matches.pop(addr).server.remove_client(addr)
+
+            # Route the network events to the matches.
+            for addr, ev in self._server.get_objects_with_senders():
+                if addr in self._client_matches:
+                    self._client_matches[addr].server.put(addr, ev)
+                elif isinstance(ev, events.JoinMatch):
+                    self._join(addr, ev.match_id)
+                else:
+                    logging.debug("MatchHost: Ignoring %s from client %s without match." % (ev.name, str(addr)))
+
+            for match in self._matches:
+                match.tick(event.elapsed_time)
+
+    def _join(self, addr, match_id):
+        """Add the client to the match with the given id (or the first free match if the id is -1).
+        """
+        if match_id == -1:
+            for match in self._matches:
+                if not match.is_full():
+                    break
+            else:
+                logging.warning("MatchHost: Client %s could not join a match, all matches are full." % str(addr))
+                return
+        elif 0 <= match_id < len(self._matches):
+            match = self._matches[match_id]
+            if match.is_full():
+                logging.warning("MatchHost: Client %s could not join match %d, it is full." % (str(addr), match_id))
+                return
+        else:
+            logging.warning("MatchHost: Client %s tried to join unknown match %d." % (str(addr), match_id))
+            return
+        self._lobby.discard(addr)
+        self._client_matches[addr] = match
+        match.server.add_client(addr)
+        logging.debug("MatchHost: Client %s joined match %d." % (str(addr), match.match_id))
+
+    def shutdown(self):
+        for match in self._matches:
+            match.shutdown()
+        self._server.close_all()
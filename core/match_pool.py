@@ -0,0 +1,343 @@
+import logging
+import multiprocessing
+import Queue
+import signal
+import threading
+import time
+import events
+import network
+import match_host
+
+
+class FrameSender(object):
+    """
+    Stands in for the shared network server of the matches in a worker process. The objects are encoded in the worker
+    and collected, so that the front-end only has to put the finished frames into the send queues of the clients.
+    """
+
+    def __init__(self, encode, header):
+        self._encode = encode
+        self._header = header
+        self._frames = []  # [(client addresses, frame, snapshot)]
+
+    def send_to_many(self, addrs, obj, snapshot=False):
+        addrs = list(addrs)
+        if len(addrs) > 0:
+            self._frames.append((addrs, self._header.pack(self._encode(obj)), snapshot))
+
+    def flush(self, addrs=None):
+        """The front-end sends the frames once per tick of the worker, so this does nothing.
+        """
+        pass
+
+    def pop_frames(self):
+        """Return and clear the frames that were collected since the last call.
+        """
+        frames, self._frames = self._frames, []
+        return frames
+
+
+class PipeSender(object):
+    """
+    Sends the messages over a pipe connection in its own thread. Both ends of the pipe between the front-end and a
+    worker send and receive. A send blocks while the pipe buffer is full, so if both ends sent at the same time without
+    receiving, they would wait for each other forever. With a PipeSender, the owner of the connection keeps receiving
+    while its messages are sent.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, obj):
+        self._queue.put(obj)
+
+    def _run(self):
+        while True:
+            obj = self._queue.get()
+            if obj is None:
+                return
+            try:
+                self._conn.send(obj)
+            except (IOError, EOFError) as e:
+                logging.debug("PipeSender: Could not send over the pipe: %s" % e)
+                return
+
+    def close(self):
+        """Stop the thread after the queued messages were sent.
+        """
+        self._queue.put(None)
+
+
+def run_match_worker(conn, codec="json", fps=60, physics_rate=None, model_broadcast_rate=20,
+                     load_report_interval=0.5, interest_cell_size=None):
+    """
+    Main function of a worker process of the MatchPool. The worker runs its matches with its own tick rate.
+
+    Each message from the front-end is a list of commands:
+    ("add_match", match_id), ("add_client", match_id, addr), ("remove_client", match_id, addr),
+    ("event", match_id, addr, event) and ("stop",).
+    Each message to the front-end is a list of replies:
+    ("frames", [(client addresses, frame, snapshot)]) and ("load", {match_id: average tick time in seconds}).
+
+    :param conn: pipe connection to the front-end
+    :param codec: name of the codec in events.codecs
+    :param fps: number of ticks per second
+    :param physics_rate: number of fixed physics steps per second (see StageModel)
+    :param model_broadcast_rate: number of model broadcasts per second
+    :param load_report_interval: the tick times are reported in this interval (in seconds)
+    :param interest_cell_size: cell size of the interest management (see ServerController)
+    """
+    # The front-end handles the KeyboardInterrupt and stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    encode, decode, header = events.codecs[codec]
+    sender = FrameSender(encode, header)
+    pipe_sender = PipeSender(conn)
+    matches = {}  # {match_id: match}
+    tick_costs = {}  # {match_id: exponential moving average of the tick time}
+    interval = 1.0 / fps
+    last_tick = time.time()
+    next_tick = last_tick
+    last_report = 0
+    elapsed_time = 0
+    while True:
+        # Handle the commands of the front-end.
+        while conn.poll():
+            for command in conn.recv():
+                if command[0] == "add_match":
+                    match_id = command[1]
+                    matches[match_id] = match_host.Match(match_id, sender, physics_rate=physics_rate,
+                                                         model_broadcast_rate=model_broadcast_rate,
+                                                         interest_cell_size=interest_cell_size)
+                    matches[match_id].start()
+                elif command[0] == "add_client":
+                    matches[command[1]].server.add_client(command[2])
+                elif command[0] == "remove_client":
+                    matches[command[1]].server.remove_client(command[2])
+                elif command[0] == "event":
+                    matches[command[1]].server.put(command[2], command[3])
+                elif command[0] == "stop":
+                    for match in matches.itervalues():
+                        match.shutdown()
+                    # The pending replies are dropped, the front-end does not need them anymore.
+                    pipe_sender.close()
+                    conn.close()
+                    return
+                else:
+                    raise Exception("Unknown match worker command: %s" % command[0])
+
+        # Tick the matches and measure the time of each tick.
+        for match_id, match in matches.iteritems():
+            start = time.time()
+            match.tick(elapsed_time)
+            cost = time.time() - start
+            if match_id in tick_costs:
+                tick_costs[match_id] = 0.9 * tick_costs[match_id] + 0.1 * cost
+            else:
+                tick_costs[match_id] = cost
+
+        replies = []
+        frames = sender.pop_frames()
+        if len(frames) > 0:
+            replies.append(("frames", frames))
+        last_report += elapsed_time
+        if last_report >= load_report_interval:
+            last_report = 0
+            replies.append(("load", dict(tick_costs)))
+        if len(replies) > 0:
+            pipe_sender.send(replies)
+
+        # Wait for the next tick.
+        next_tick += interval
+        now = time.time()
+        if next_tick > now:
+            time.sleep(next_tick - now)
+        else:
+            next_tick = now
+        now = time.time()
+        elapsed_time = now - last_tick
+        last_tick = now
+
+
+class MatchPool(object):
+    """
+    The MatchPool distributes the matches over several worker processes, so that the matches are not limited to one
+    core by the GIL. The front-end (this class) owns the listening socket and the client connections. It forwards the
+    events of the clients to the worker that runs their match and sends the frames that the workers encode.
+
+    Like the MatchHost, a client joins a match with a JoinMatch event. If a client joins with the match id -1 and all
+    matches are full, a new match is created on the worker with the smallest measured tick time.
+    The match pool is driven by the tick events of the given event manager.
+    """
+
+    def __init__(self, ev_manager, num_workers=None, num_matches=1, max_num_matches=None, clients_per_match=2,
+                 port=32072, codec="json", engine="select", max_queued_bytes=None, max_queued_snapshots=1, fps=60,
+                 physics_rate=None, model_broadcast_rate=20, interest_cell_size=None):
+        """
+        :param ev_manager: event manager that sends the init and tick events
+        :param num_workers: number of worker processes (number of cores if None)
+        :param num_matches: number of matches that are created on init
+        :param max_num_matches: maximum number of matches (no limit if None)
+        :param clients_per_match: number of clients that can join a match
+        :param port: port
+        :param codec: name of the codec in events.codecs
+        :param engine: name of the network server in network.server_engines
+        :param max_queued_bytes: a client is disconnected if more bytes are waiting to be sent to it
+        :param max_queued_snapshots: only this many model broadcasts are queued per client, older ones are dropped
+        :param fps: number of ticks per second of the workers
+        :param physics_rate: number of fixed physics steps per second (see StageModel)
+        :param model_broadcast_rate: number of model broadcasts per second
+        :param interest_cell_size: cell size of the interest management (see ServerController)
+        """
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        assert num_workers > 0
+        assert num_matches >= 0
+        assert isinstance(ev_manager, events.EventManager)
+        self._ev_manager = ev_manager
+        self._ev_manager.register_listener(self, [events.InitEvent, events.TickEvent])
+        encode, decode, header = events.codecs[codec]
+        self._server = network.server_engines[engine](port=port, decode=decode, encode=encode, header=header,
+                                                      max_queued_bytes=max_queued_bytes,
+                                                      max_queued_snapshots=max_queued_snapshots, batch=True)
+        self._num_matches = num_matches
+        self._max_num_matches = max_num_matches
+        self._clients_per_match = clients_per_match
+        self._workers = []  # [(process, pipe connection)]
+        for i in xrange(num_workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_match_worker, args=(worker_conn,),
+                                              kwargs={"codec": codec, "fps": fps, "physics_rate": physics_rate,
+                                                      "model_broadcast_rate": model_broadcast_rate,
+                                                      "interest_cell_size": interest_cell_size})
+            process.daemon = True
+            self._workers.append((process, conn))
+        self._pipe_senders = []  # the PipeSender of each worker, created when the workers are started
+        self._commands = [[] for _ in xrange(num_workers)]  # commands that are sent to the workers on the next tick
+        self._match_workers = []  # the worker index of each match
+        self._match_clients = []  # the clients of each match
+        self._tick_costs = {}  # {match_id: average tick time reported by the worker}
+        self._lobby = set()  # clients that did not join a match yet
+        self._client_matches = {}  # {client address: match_id}
+
+    def notify(self, event):
+        if isinstance(event, events.InitEvent):
+            for process, conn in self._workers:
+                process.start()
+                self._pipe_senders.append(PipeSender(conn))
+            for i in xrange(self._num_matches):
+                self._add_match()
+            self._server.accept_clients()
+        elif isinstance(event, events.TickEvent):
+            new_client_names, removed_client_names = self._server.update_client_list()
+            for addr in new_client_names:
+                self._lobby.add(addr)
+            for addr in removed_client_names:
+                self._lobby.discard(addr)
+                if addr in self._client_matches:
+                    match_id = self._client_matches.pop(addr)
+                    self._match_clients[match_id].discard(addr)
+                    self._commands[self._match_workers[match_id]].append(("remove_client", match_id, addr))
+
+            # Route the network events to the workers.
+            for addr, ev in self._server.get_objects_with_senders():
+                if addr in self._client_matches:
+                    match_id = self._client_matches[addr]
+                    self._commands[self._match_workers[match_id]].append(("event", match_id, addr, ev))
+                elif isinstance(ev, events.JoinMatch):
+                    self._join(addr, ev.match_id)
+                else:
+                    logging.debug("MatchPool: Ignoring %s from client %s without match." % (ev.name, str(addr)))
+
+            for i, (process, conn) in enumerate(self._workers):
+                if len(self._commands[i]) > 0:
+                    self._pipe_senders[i].send(self._commands[i])
+                    self._commands[i] = []
+
+            # Send the frames of the workers.
+            for process, conn in self._workers:
+                while conn.poll():
+                    for reply in conn.recv():
+                        if reply[0] == "frames":
+                            for addrs, frame, snapshot in reply[1]:
+                                self._server.send_frame_to_many(addrs, frame, snapshot)
+                        elif reply[0] == "load":
+                            self._tick_costs.update(reply[1])
+            self._server.flush()
+
+    def worker_loads(self):
+        """
+        Return the summed tick time of the matches of each worker. Matches without measurement are assumed to take
+        the average tick time of the measured matches.
+        """
+        if len(self._tick_costs) > 0:
+            default_cost = sum(self._tick_costs.itervalues()) / len(self._tick_costs)
+        else:
+            default_cost = 1.0
+        loads = [0.0] * len(self._workers)
+        for match_id, worker in enumerate(self._match_workers):
+            loads[worker] += self._tick_costs.get(match_id, default_cost)
+        return loads
+
+    def _add_match(self):
+        """Create a new match on the worker with the smallest load and return its id.
+        """
+        loads = self.worker_loads()
+        worker = loads.index(min(loads))
+        match_id = len(self._match_workers)
+        self._match_workers.append(worker)
+        self._match_clients.append(set())
+        self._commands[worker].append(("add_match", match_id))
+        logging.debug("MatchPool: Created match %d on worker %d." % (match_id, worker))
+        return match_id
+
+    def _join(self, addr, match_id):
+        """
+        Add the client to the match with the given id. If the id is -1, the client is added to the first free match or
+        to a new match.
+        """
+        if match_id == -1:
+            for i, clients in enumerate(self._match_clients):
+                if len(clients) < self._clients_per_match:
+                    match_id = i
+                    break
+            else:
+                if self._max_num_matches is not None and len(self._match_workers) >= self._max_num_matches:
+                    logging.warning("MatchPool: Client %s could not join a match, all matches are full." % str(addr))
+                    return
+                match_id = self._add_match()
+        elif 0 <= match_id < len(self._match_workers):
+            if len(self._match_clients[match_id]) >= self._clients_per_match:
+                logging.warning("MatchPool: Client %s could not join match %d, it is full." % (str(addr), match_id))
+                return
+        else:
+            logging.warning("MatchPool: Client %s tried to join unknown match %d." % (str(addr), match_id))
+            return
+        self._lobby.discard(addr)
+        self._client_matches[addr] = match_id
+        self._match_clients[match_id].add(addr)
+        self._commands[self._match_workers[match_id]].append(("add_client", match_id, addr))
+        logging.debug("MatchPool: Client %s joined match %d." % (str(addr), match_id))
+
+    def shutdown(self):
+        # Only the started workers have a pipe sender.
+        started_workers = self._workers[:len(self._pipe_senders)]
+        for (process, conn), pipe_sender in zip(started_workers, self._pipe_senders):
+            if process.is_alive():
+                pipe_sender.send([("stop",)])
+            pipe_sender.close()
+        for process, conn in started_workers:
+            # Keep receiving until the worker stops, it may wait for the pipe before it gets the stop command.
+            while process.is_alive():
+                if conn.poll(0.01):
+                    try:
+                        conn.recv()
+                    except EOFError:
+                        break
+            process.join()
+        self._pipe_senders = []
+        self._server.close_all()
@@ -79,10 +79,10 @@ class MenuModel(object):
     A menu has coordinates from (0, 0) to (10, 10).
     """
 
-    def __init__(self, ev_manager, bg_img, buttons=None):
+    def __init__(self, ev_manager, bg_img, buttons=None, event_classes=None):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._id = self._ev_manager.register_listener(self, event_classes)
         self.bg_img = bg_img
         if buttons is None:
             self.buttons = []
@@ -108,7 +108,9 @@ class MainMenuModel(MenuModel):
                      action=self.load_level)
 
         buttons = [btn]
-        super(MainMenuModel, self).__init__(ev_manager, menu_bg, buttons=buttons)
+        event_classes = [events.InitEvent, events.ButtonHoverRequestedEvent, events.ButtonUnhoverRequestedEvent,
+                         events.ButtonPressRequestedEvent, events.ButtonActionRequestedEvent, events.CloseCurrentModel]
+        super(MainMenuModel, self).__init__(ev_manager, menu_bg, buttons=buttons, event_classes=event_classes)
 
     def load_level(self):
         self._ev_manager.post(events.CloseCurrentModel(next_model_name="Stage"))
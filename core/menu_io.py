@@ -11,7 +11,7 @@ class MenuIOController(object):
     def __init__(self, ev_manager, menu, view):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._id = self._ev_manager.register_listener(self, [events.TickEvent, events.CloseCurrentModel])
         self._menu = menu
         self._view = view
 
@@ -20,6 +20,8 @@ class MenuIOController(object):
             for pygame_event in pygame.event.get():
                 if pygame_event.type == pygame.QUIT:
                     self._ev_manager.post(events.CloseCurrentModel(next_model_name=None))
+                elif pygame_event.type == pygame.VIDEOEXPOSE:
+                    self._view.invalidate()
                 elif pygame_event.type == pygame.KEYDOWN:
                     if pygame_event.key == pygame.K_ESCAPE:
                         self._ev_manager.post(events.CloseCurrentModel(next_model_name=None))
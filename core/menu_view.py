@@ -3,15 +3,25 @@ import events
 import logging
 import resource_manager
 import pygame_view
+import profiling
 
 
 class MenuPygameView(pygame_view.PygameView):
     """
     Show a menu model using a Pygame window.
+    Only the screen areas that changed since the last tick are updated on the display. If nothing changed for
+    idle_delay seconds, the view sends an IdleStateEvent, so the ticker can lower the tick rate.
     """
 
-    def __init__(self, ev_manager):
-        super(MenuPygameView, self).__init__(ev_manager)
+    def __init__(self, ev_manager, idle_delay=0.5):
+        super(MenuPygameView, self).__init__(ev_manager, [events.MenuCreatedEvent, events.TickEvent,
+                                                          events.ButtonHoverEvent, events.ButtonUnhoverEvent,
+                                                          events.ButtonPressEvent, events.CloseCurrentModel])
+        self._dirty_rects = []  # the screen areas that changed since the last update of the display
+        self._full_update = False
+        self._idle_delay = idle_delay
+        self._idle_time = 0  # the time since the last update of the display
+        self._idle = False
 
     def _get_button_image(self, button):
         w, h = self.to_screen_xy(button.width, button.height)
@@ -19,27 +29,46 @@ class MenuPygameView(pygame_view.PygameView):
         x, y = self.to_screen_xy(button.x, button.y)
         return im, (x, y)
 
+    def _blit_button(self, button):
+        im, (x, y) = self._get_button_image(button)
+        self._dirty_rects.append(self._screen.blit(im, (x, y)))
+
+    def invalidate(self):
+        """Update the whole display on the next tick (e. g. after the window was uncovered).
+        """
+        self._full_update = True
+
     def notify(self, event):
         if isinstance(event, events.MenuCreatedEvent):
             im = resource_manager.ResourceManager.instance().get_image(event.bg_img, size=self._screen.get_size())
             self._screen.blit(im, (0, 0))
             for b in event.buttons:
-                im, (x, y) = self._get_button_image(b)
-                self._screen.blit(im, (x, y))
+                self._blit_button(b)
+            self._full_update = True
         elif isinstance(event, events.TickEvent):
-            pygame.display.flip()
+            if self._full_update or len(self._dirty_rects) > 0:
+                with profiling.section(self._ev_manager.profiler, "render.present"):
+                    if self._full_update:
+                        pygame.display.flip()
+                    else:
+                        pygame.display.update(self._dirty_rects)
+                self._full_update = False
+                self._dirty_rects = []
+                self._idle_time = 0
+                if self._idle:
+                    self._idle = False
+                    self._ev_manager.post(events.IdleStateEvent(False))
+            else:
+                self._idle_time += event.elapsed_time
+                if not self._idle and self._idle_time >= self._idle_delay:
+                    self._idle = True
+                    self._ev_manager.post(events.IdleStateEvent(True))
         elif isinstance(event, events.ButtonHoverEvent):
-            b = event.button
-            im, (x, y) = self._get_button_image(b)
-            self._screen.blit(im, (x, y))
+            self._blit_button(event.button)
         elif isinstance(event, events.ButtonUnhoverEvent):
-            b = event.button
-            im, (x, y) = self._get_button_image(b)
-            self._screen.blit(im, (x, y))
+            self._blit_button(event.button)
         elif isinstance(event, events.ButtonPressEvent):
-            b = event.button
-            im, (x, y) = self._get_button_image(b)
-            self._screen.blit(im, (x, y))
+            self._blit_button(event.button)
         elif isinstance(event, events.CloseCurrentModel):
             next_model_name = event.next_model_name
             if next_model_name != "Main Menu":
@@ -0,0 +1,301 @@
+"""
+Network condition simulator.
+
+The NetworkSimulator is a local proxy between the clients and a server. It forwards the data with configurable latency,
+jitter, bandwidth, loss and reordering, so the network code can be tested reproducibly on a single machine:
+
+    simulator = NetworkSimulator(server_host, server_port, upstream=LinkConditions(latency=0.05, loss=0.01),
+                                 downstream=LinkConditions(latency=0.05, loss=0.01), protocol="udp")
+    simulator.start()
+    client = network.UdpNetworkClient(socket.gethostname(), simulator.port, ...)
+    ...
+    simulator.stop()
+
+TCP cannot lose or reorder data, so on a TCP link a lost chunk is delayed by the retransmission_delay instead (and
+delays all following chunks), and reordering is ignored.
+"""
+import socket
+import select
+import collections
+import threading
+import heapq
+import random
+import logging
+import time
+import errno
+
+
+class LinkConditions(object):
+    """
+    The conditions of one direction of a simulated link.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, loss=0.0, reorder=0.0, reorder_delay=0.05,
+                 retransmission_delay=0.2):
+        """
+        :param latency: one-way delay in seconds
+        :param jitter: additional random delay in seconds (uniform in [0, jitter])
+        :param bandwidth: bytes per second (unlimited if None)
+        :param loss: probability that a datagram (or TCP chunk) is lost
+        :param reorder: probability that a datagram is delayed by reorder_delay, so later datagrams overtake it
+        :param reorder_delay: extra delay of reordered datagrams in seconds
+        :param retransmission_delay: extra delay of a lost TCP chunk in seconds
+        """
+        assert latency >= 0 and jitter >= 0
+        assert bandwidth is None or bandwidth > 0
+        assert 0 <= loss <= 1 and 0 <= reorder <= 1
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.retransmission_delay = retransmission_delay
+
+
+class SimulatedLink(object):
+    """
+    Computes the delivery times of the data that is sent over one direction of a link.
+    If ordered is True (TCP), the data is delivered in the order it was sent. Links with the same seed lose and delay
+    the same data, so each link should get its own seed.
+    """
+
+    def __init__(self, conditions, ordered, seed=None):
+        self._conditions = conditions
+        self._ordered = ordered
+        self._random = random.Random(seed)
+        self._busy_until = 0.0  # the link transmits the previous data until this time
+        self.last_delivery = 0.0
+        self.num_bytes = 0
+        self.num_lost = 0
+
+    def schedule(self, size, now):
+        """Return the time at which size bytes that are sent now arrive, or None if they are lost.
+        """
+        c = self._conditions
+        self.num_bytes += size
+        t = now
+        if c.bandwidth is not None:
+            t = max(t, self._busy_until) + float(size) / c.bandwidth
+            self._busy_until = t
+        t += c.latency
+        if c.jitter > 0:
+            t += self._random.uniform(0, c.jitter)
+        if c.loss > 0 and self._random.random() < c.loss:
+            self.num_lost += 1
+            if not self._ordered:
+                return None
+            t += c.retransmission_delay
+        if self._ordered:
+            t = max(t, self.last_delivery)
+            self.last_delivery = t
+        elif c.reorder > 0 and self._random.random() < c.reorder:
+            t += c.reorder_delay
+        return t
+
+
+class NetworkSimulator(object):
+    """
+    A proxy that listens on a local port and forwards all connections (TCP) or datagrams (UDP) to the target server.
+    The upstream conditions apply to the data from the clients to the server, the downstream conditions to the data
+    from the server to the clients. Each connection (or UDP client address) gets its own links. The seeds of the links
+    are drawn from one random number generator, so a run is reproducible with the same seed, but the links are not
+    correlated. The proxy runs in its own thread. All sockets are non-blocking and the delivered TCP data waits in an
+    output buffer per socket until the socket is writable, so a slow reader does not delay the other connections.
+    """
+
+    def __init__(self, target_host, target_port, upstream=None, downstream=None, protocol="tcp", port=0, seed=None):
+        """
+        :param target_host: server host
+        :param target_port: server port
+        :param upstream: LinkConditions from the clients to the server
+        :param downstream: LinkConditions from the server to the clients
+        :param protocol: "tcp" or "udp"
+        :param port: local port of the proxy (a free port is chosen if 0, see the port attribute)
+        :param seed: seed of the random number generator that seeds the links (for reproducible runs)
+        """
+        if protocol not in ("tcp", "udp"):
+            raise Exception("Unknown protocol: %s" % protocol)
+        self._target = (socket.gethostbyname(target_host), target_port)
+        self._upstream = upstream if upstream is not None else LinkConditions()
+        self._downstream = downstream if downstream is not None else LinkConditions()
+        self._protocol = protocol
+        self._random = random.Random(seed)
+        if protocol == "tcp":
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            self._listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((socket.gethostname(), port))
+        self._listener.setblocking(0)
+        if protocol == "tcp":
+            self._listener.listen(5)
+        self.port = self._listener.getsockname()[1]
+        self._stop = threading.Event()
+        self._thread = None
+        self._scheduled = []  # heap with (delivery time, counter, socket, data, address)
+        self._counter = 0
+        self._forwards = {}  # {socket: (target socket or client address, link)} of the sockets that are read
+        self._outgoing = {}  # {socket: deque with the delivered TCP data that was not written yet}
+        self._closing = set()  # sockets that are closed when their outgoing data is written
+        self._udp_clients = {}  # {client address: (socket that is connected to the target, upstream link)}
+        self._links = {"upstream": [], "downstream": []}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        logging.debug("NetworkSimulator: Forwarding port %d to %s:%d" % ((self.port,) + self._target))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for s in set(self._forwards) | set(self._outgoing) | self._closing:
+            s.close()
+        self._listener.close()
+
+    def stats(self):
+        """
+        Return the dictionary with the number of forwarded bytes and lost datagrams (or TCP chunks) per direction.
+        """
+        stats = {}
+        for direction, links in self._links.iteritems():
+            stats[direction + "_bytes"] = sum(link.num_bytes for link in links)
+            stats[direction + "_lost"] = sum(link.num_lost for link in links)
+        return stats
+
+    def _new_link(self, direction):
+        conditions = self._upstream if direction == "upstream" else self._downstream
+        link = SimulatedLink(conditions, self._protocol == "tcp", seed=self._random.getrandbits(32))
+        self._links[direction].append(link)
+        return link
+
+    def _schedule(self, link, sock, data, addr, now):
+        t = link.schedule(len(data), now)
+        if t is not None:
+            heapq.heappush(self._scheduled, (t, self._counter, sock, data, addr))
+            self._counter += 1
+
+    def _schedule_close(self, link, sock, now):
+        """Close the socket after the data that is in transit on the link was delivered.
+        """
+        heapq.heappush(self._scheduled, (max(now, link.last_delivery), self._counter, sock, None, None))
+        self._counter += 1
+
+    def _deliver(self, now):
+        while len(self._scheduled) > 0 and self._scheduled[0][0] <= now:
+            t, counter, sock, data, addr = heapq.heappop(self._scheduled)
+            if data is None:
+                self._forwards.pop(sock, None)
+                if sock in self._outgoing:
+                    self._closing.add(sock)
+                else:
+                    sock.close()
+            elif addr is None:
+                self._outgoing.setdefault(sock, collections.deque()).append(data)
+            else:
+                try:
+                    sock.sendto(data, addr)
+                except socket.error as e:
+                    # A full socket buffer loses the datagram like a real network.
+                    logging.debug("NetworkSimulator: Could not deliver datagram: %s" % e)
+
+    def _write(self, sock):
+        """Write as much of the outgoing data of the socket as it accepts.
+        """
+        chunks = self._outgoing[sock]
+        while len(chunks) > 0:
+            try:
+                n = sock.send(chunks[0])
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                logging.debug("NetworkSimulator: Could not deliver data: %s" % e)
+                chunks.clear()
+                break
+            if n < len(chunks[0]):
+                chunks[0] = chunks[0][n:]
+                return
+            chunks.popleft()
+        del self._outgoing[sock]
+        if sock in self._closing:
+            self._closing.discard(sock)
+            sock.close()
+
+    def _run(self):
+        while not self._stop.isSet():
+            now = time.time()
+            self._deliver(now)
+            timeout = 0.1
+            if len(self._scheduled) > 0:
+                timeout = max(0.0, min(timeout, self._scheduled[0][0] - now))
+            readable, writable, _ = select.select([self._listener] + list(self._forwards), list(self._outgoing), [],
+                                                  timeout)
+            for s in writable:
+                self._write(s)
+            now = time.time()
+            for s in readable:
+                if s is self._listener and self._protocol == "tcp":
+                    self._accept_tcp()
+                elif s is self._listener:
+                    self._forward_udp_upstream(now)
+                elif s in self._forwards:
+                    self._forward(s, now)
+
+    def _accept_tcp(self):
+        try:
+            client_sock, addr = self._listener.accept()
+        except socket.error:
+            return
+        target_sock = socket.create_connection(self._target)
+        client_sock.setblocking(0)
+        target_sock.setblocking(0)
+        self._forwards[client_sock] = (target_sock, self._new_link("upstream"))
+        self._forwards[target_sock] = (client_sock, self._new_link("downstream"))
+
+    def _forward_udp_upstream(self, now):
+        """
+        Forward a datagram from a client to the target. Each client gets its own socket, so the server can tell the
+        clients apart.
+        """
+        try:
+            data, addr = self._listener.recvfrom(65535)
+        except socket.error:
+            # E. g. an ICMP port unreachable from a closed client.
+            return
+        if addr not in self._udp_clients:
+            target_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            target_sock.connect(self._target)
+            target_sock.setblocking(0)
+            self._udp_clients[addr] = (target_sock, self._new_link("upstream"))
+            self._forwards[target_sock] = (addr, self._new_link("downstream"))
+        target_sock, link = self._udp_clients[addr]
+        self._schedule(link, target_sock, data, None, now)
+
+    def _forward(self, s, now):
+        other, link = self._forwards[s]
+        if self._protocol == "udp":
+            # A datagram from the target to the client.
+            try:
+                data = s.recv(65535)
+            except socket.error as e:
+                if e.errno in (errno.ECONNREFUSED, errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self._schedule(link, self._listener, data, other, now)
+            return
+        try:
+            data = s.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ""
+        if len(data) == 0:
+            del self._forwards[s]
+            self._outgoing.pop(s, None)
+            self._closing.discard(s)
+            s.close()
+            self._schedule_close(link, other, now)
+        else:
+            self._schedule(link, other, data, None, now)
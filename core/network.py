@@ -2,7 +2,56 @@ import socket
 import logging
 import json
 import Queue
+import collections
 import threading
+import struct
+import select
+import errno
+import itertools
+import time
+import heapq
+import random
+
+
+class AsciiLengthHeader(object):
+    """
+    Frame header that consists of the decimal data length followed by the marker #.
+    """
+
+    def pack(self, data):
+        """Return the data prefixed with the header.
+        """
+        return str(len(data)) + "#" + data
+
+    def unpack(self, buf, start, end):
+        """
+        Read the header at buf[start:end]. Return the tuple (data_start, data_len) or None if the header is incomplete.
+        """
+        i = buf.find("#", start, end)
+        if i == -1:
+            return None
+        return i + 1, int(str(buf[start:i]))
+
+
+class BinaryLengthHeader(object):
+    """
+    Frame header that consists of the data length as 4 byte unsigned integer in network byte order.
+    """
+
+    _struct = struct.Struct("!I")
+
+    def pack(self, data):
+        """Return the data prefixed with the header.
+        """
+        return self._struct.pack(len(data)) + data
+
+    def unpack(self, buf, start, end):
+        """
+        Read the header at buf[start:end]. Return the tuple (data_start, data_len) or None if the header is incomplete.
+        """
+        if end - start < self._struct.size:
+            return None
+        return start + self._struct.size, self._struct.unpack_from(buf, start)[0]
 
 
 def accept_clients(port, qu, stop_event, max_num_connections=None, timeout=1.0):
@@ -47,7 +96,87 @@ def accept_clients(port, qu, stop_event, max_num_connections=None, timeout=1.0):
     sock.close()
 
 
-def listen_on_connection(conn, qu, stop_event, timeout=1.0):
+class ReceiveBuffer(object):
+    """
+    Preallocated receive buffer for framed data.
+    The socket writes directly into the buffer (recv_into). The received data is kept in the region [start, end) and
+    all complete frames are taken from that region without copying the remaining data. The incomplete frame is moved
+    to the front of the buffer only when the buffer end is reached, and the buffer only grows if a single frame does
+    not fit into it.
+    """
+
+    def __init__(self, header, size=65536):
+        self._header = header
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self._required = 0  # size of the incomplete frame at start (header and data), 0 if unknown
+
+    def recv_from(self, conn):
+        """
+        Receive data from the given socket into the buffer. Return the number of received bytes (0 if the connection
+        was closed by the peer).
+        """
+        if self._end == len(self._buf):
+            self._make_room()
+        n = conn.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def feed(self, data):
+        """Append the given data (e. g. the payload of a datagram) to the buffer.
+        """
+        n = len(data)
+        if self._end + n > len(self._buf):
+            self._required = max(self._required, self._end - self._start + n)
+            self._make_room()
+        self._buf[self._end:self._end+n] = data
+        self._end += n
+
+    def frames(self):
+        """Remove all complete frames from the buffer and return their data as list of strings.
+        """
+        frames = []
+        while True:
+            h = self._header.unpack(self._buf, self._start, self._end)
+            if h is None:
+                self._required = 0
+                break
+            data_start, data_len = h
+            data_end = data_start + data_len
+            if data_end > self._end:
+                self._required = data_end - self._start
+                break
+            frames.append(self._view[data_start:data_end].tobytes())
+            self._start = data_end
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+        return frames
+
+    def _make_room(self):
+        """
+        Move the incomplete frame to the front of the buffer. Replace the buffer by a larger one if the frame does not
+        fit into it.
+        """
+        n = self._end - self._start
+        size = len(self._buf)
+        if self._start == 0 or self._required > size:
+            while size < max(self._required, n + 1):
+                size *= 2
+            buf = bytearray(size)
+            buf[:n] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        else:
+            # Copy the data first, because source and target may overlap.
+            self._buf[:n] = self._view[self._start:self._end].tobytes()
+        self._start = 0
+        self._end = n
+
+
+def listen_on_connection(conn, qu, stop_event, timeout=1.0, header=None, sender=None):
     """
     Listen on the given connection and put the received items in the given queue. Exit when the stop event is set or
     when the maximum number of connections is reached.
@@ -56,45 +185,187 @@ def listen_on_connection(conn, qu, stop_event, timeout=1.0):
     :param qu: queue to put the items in
     :param stop_event: stop event
     :param timeout: socket timeout
+    :param header: frame header (AsciiLengthHeader if None)
+    :param sender: if not None, the tuple (sender, item) is put in the queue instead of the item
     """
+    if header is None:
+        header = AsciiLengthHeader()
 
     conn.settimeout(timeout)
-    data_string = ""  # data string that is filled by the socket's recv method.
-    data_len = None  # size of the current item
+    buf = ReceiveBuffer(header)
     connection_lost = False
     while True:
         if stop_event.isSet() or connection_lost:
             break
 
-        # Get the data that will be appended to the data string.
-        to_append = ""
+        # Receive the next chunk of data.
         try:
-            to_append = conn.recv(4096)
+            n = buf.recv_from(conn)
         except socket.timeout:
             continue
-        if to_append == "":
+        except socket.error:
+            n = 0
+        if n == 0:
             connection_lost = True
-        data_string += to_append
-
-        # Read the item size from the data string.
-        if data_len is None:
-            r_index = data_string.find("#")
-            if r_index == -1:
-                continue
-            data_len = int(data_string[:r_index])
-            data_string = data_string[r_index+1:]
 
-        # Decode the received string to an object.
-        if len(data_string) >= data_len:
-            obj_string = data_string[:data_len]
-            data_string = data_string[data_len:]
-            qu.put(obj_string, block=True)
-            data_len = None
+        # Put all complete items in the queue.
+        for obj_string in buf.frames():
+            if sender is None:
+                qu.put(obj_string, block=True)
+            else:
+                qu.put((sender, obj_string), block=True)
 
     logging.debug("Network: Closed client connection.")
     conn.close()
 
 
+class SendQueue(object):
+    """
+    Queue with the frames that wait to be sent over one connection.
+    The frames are not copied, so a broadcast frame that is put in the queues of all clients is shared between them.
+
+    Two backpressure policies can be configured:
+    * max_snapshots: Frames can be marked as snapshots (state updates that are superseded by the next snapshot). If more
+      than max_snapshots snapshots are queued, the oldest ones are dropped.
+    * max_bytes: If more than max_bytes bytes are queued, the queue overflows and put() returns False. The client
+      should then be disconnected.
+
+    The queue is not thread-safe.
+    """
+
+    def __init__(self, max_bytes=None, max_snapshots=None):
+        assert max_snapshots is None or max_snapshots > 0
+        self._max_bytes = max_bytes
+        self._max_snapshots = max_snapshots
+        self._frames = collections.deque()  # [(data, is_snapshot)]
+        self._offset = 0  # number of bytes of the first frame that were already sent
+        self._num_peeked = 0  # number of frames in the data of the last peek() that was not consumed yet
+        self._num_snapshots = 0
+        self.num_bytes = 0
+        self.num_dropped = 0
+        self.failed = False  # is set, when sending failed
+
+    def __len__(self):
+        return len(self._frames)
+
+    def overflown(self):
+        return self._max_bytes is not None and self.num_bytes > self._max_bytes
+
+    def put(self, data, snapshot=False):
+        """Append the frame to the queue. Return False if the queue overflows.
+        """
+        self._frames.append((data, snapshot))
+        self.num_bytes += len(data)
+        if snapshot:
+            self._num_snapshots += 1
+            if self._max_snapshots is not None and self._num_snapshots > self._max_snapshots:
+                self._drop_snapshots(self._num_snapshots - self._max_snapshots)
+        return not self.overflown()
+
+    def _drop_snapshots(self, n):
+        """
+        Drop the n oldest snapshots. The frames that may be in transfer (a partially sent first frame and the frames
+        of the last peek) are never dropped. They do not count against the limit, so the newest snapshots are still
+        kept behind them.
+        """
+        num_protected = max(1 if self._offset > 0 else 0, self._num_peeked)
+        for data, snapshot in itertools.islice(self._frames, num_protected):
+            if snapshot:
+                n -= 1
+        frames = collections.deque()
+        for i, (data, snapshot) in enumerate(self._frames):
+            if snapshot and n > 0 and i >= num_protected:
+                n -= 1
+                self._num_snapshots -= 1
+                self.num_bytes -= len(data)
+                self.num_dropped += 1
+            else:
+                frames.append((data, snapshot))
+        self._frames = frames
+
+    def peek(self, max_size=65536):
+        """
+        Return the unsent data at the front of the queue (None if the queue is empty). The following frames are
+        appended until max_size bytes are reached, so that several frames can be sent with one system call.
+        The returned frames are not dropped by the snapshot policy until the next consume(), so the data can be sent
+        without holding the lock of the queue.
+        """
+        if len(self._frames) == 0:
+            self._num_peeked = 0
+            return None
+        first = self._frames[0][0]
+        size = len(first) - self._offset
+        if len(self._frames) == 1 or size >= max_size:
+            self._num_peeked = 1
+            return memoryview(first)[self._offset:]
+        parts = [first[self._offset:]]
+        for data, snapshot in itertools.islice(self._frames, 1, None):
+            if size >= max_size:
+                break
+            parts.append(data)
+            size += len(data)
+        self._num_peeked = len(parts)
+        return "".join(parts)
+
+    def consume(self, n):
+        """Remove n sent bytes from the front of the queue.
+        """
+        self._num_peeked = 0
+        self.num_bytes -= n
+        self._offset += n
+        while len(self._frames) > 0 and self._offset >= len(self._frames[0][0]):
+            data, snapshot = self._frames.popleft()
+            self._offset -= len(data)
+            if snapshot:
+                self._num_snapshots -= 1
+
+    def send(self, conn):
+        """
+        Send as many frames as the non-blocking socket accepts. Raise socket.error if the connection is broken.
+        """
+        while True:
+            data = self.peek()
+            if data is None:
+                break
+            try:
+                n = conn.send(data)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            self.consume(n)
+            if n < len(data):
+                break
+
+
+def send_on_connection(conn, send_queue, cond, stop_event):
+    """
+    Send the frames from the send queue over the given connection. Exit when the stop event is set or when the
+    connection is broken (send_queue.failed is set then).
+
+    :param conn: socket connection
+    :param send_queue: SendQueue
+    :param cond: condition that protects the send queue and is notified when frames are put in the queue
+    :param stop_event: stop event
+    """
+    while not stop_event.isSet():
+        with cond:
+            data = send_queue.peek()
+            if data is None:
+                cond.wait(1.0)
+                continue
+        try:
+            n = conn.send(data)
+        except socket.timeout:
+            continue
+        except socket.error:
+            with cond:
+                send_queue.failed = True
+            break
+        with cond:
+            send_queue.consume(n)
+
+
 class NetworkServer(object):
     """
     The NetworkServer class accepts connections from clients and can be used to send and receive arbitrary objects.
@@ -105,12 +376,27 @@ class NetworkServer(object):
     Internally, the following protocol is used to send data:
     def send(obj):
         data_string = encode(obj)
-        send_string = str(len(data_string)) + "#" + data_string
+        send_string = header.pack(data_string)
         socket.send(send_string)
+    The header defaults to AsciiLengthHeader, which prefixes the data with str(len(data_string)) + "#".
+
+    The data is not sent in the calling thread. Each client has a SendQueue that is drained by a sender thread, so a
+    slow client does not block the caller. See SendQueue for the meaning of max_queued_bytes and max_queued_snapshots.
+
+    If batch is True, the sender threads are only woken up by flush(). All frames that were queued for a client until
+    then are sent with one system call.
     """
 
-    def __init__(self, port, decode=None, encode=None):
+    def __init__(self, port, decode=None, encode=None, header=None, max_queued_bytes=None, max_queued_snapshots=None,
+                 batch=False):
         self._port = port
+        self._batch = batch
+        self._max_queued_bytes = max_queued_bytes
+        self._max_queued_snapshots = max_queued_snapshots
+        if header is None:
+            self._header = AsciiLengthHeader()
+        else:
+            self._header = header
         if decode is None:
             self._decode = json.loads
         else:
@@ -121,6 +407,7 @@ class NetworkServer(object):
             self._encode = encode
         self._clients = []
         self._stop_clients = []
+        self._senders = []  # [(send queue, condition, sender thread)] with the same order as the clients
         self._client_queue = Queue.Queue()
         self._client_listeners = []
         self._item_queue = Queue.Queue()
@@ -162,10 +449,17 @@ class NetworkServer(object):
             new_client_names.append(addr)
             stop = threading.Event()
             self._stop_clients.append(stop)
-            t = threading.Thread(target=listen_on_connection, args=(c, self._item_queue, stop))
+            t = threading.Thread(target=listen_on_connection, args=(c, self._item_queue, stop),
+                                 kwargs={"header": self._header, "sender": addr})
             t.daemon = True
             t.start()
             self._clients.append((c, addr, t))
+            send_queue = SendQueue(self._max_queued_bytes, self._max_queued_snapshots)
+            cond = threading.Condition()
+            sender = threading.Thread(target=send_on_connection, args=(c, send_queue, cond, stop))
+            sender.daemon = True
+            sender.start()
+            self._senders.append((send_queue, cond, sender))
 
         # Check if the client acceptor is done.
         if self._client_acceptor is not None:
@@ -174,12 +468,18 @@ class NetworkServer(object):
                 self._client_acceptor = None
 
         # Remove old clients.
+        for i, (send_queue, cond, sender) in enumerate(self._senders):
+            if send_queue.failed:
+                self._to_be_removed.append(i)
         removed_client_names = []
-        for i in reversed(self._to_be_removed):
+        for i in sorted(set(self._to_be_removed), reverse=True):
             self._stop_clients[i].set()
+            with self._senders[i][1]:
+                self._senders[i][1].notify()
             removed_client_names.append(self._clients[i][1])
             del self._clients[i]
             del self._stop_clients[i]
+            del self._senders[i]
         self._to_be_removed = []
         # TODO: Eventually restart the network acceptor.
 
@@ -188,11 +488,16 @@ class NetworkServer(object):
     def get_objects(self):
         """Return a list with all objects that came in from the listener threads.
         """
+        return [item for addr, item in self.get_objects_with_senders()]
+
+    def get_objects_with_senders(self):
+        """Return a list with the tuples (client address, object) of all objects that came in from the listener threads.
+        """
         items = []
         while not self._item_queue.empty():
-            item_string = self._item_queue.get()
+            addr, item_string = self._item_queue.get()
             item = self._decode(item_string)
-            items.append(item)
+            items.append((addr, item))
             self._item_queue.task_done()
         return items
 
@@ -204,33 +509,758 @@ class NetworkServer(object):
             self._client_acceptor.join()
         for stop in self._stop_clients:
             stop.set()
+        for send_queue, cond, sender in self._senders:
+            with cond:
+                cond.notify()
+            sender.join()
         for c, addr, t in self._clients:
             t.join()
 
-    def broadcast(self, obj):
-        """Send the object to all clients.
+    def _enqueue(self, i, data_string, snapshot):
+        send_queue, cond, sender = self._senders[i]
+        with cond:
+            if not send_queue.put(data_string, snapshot):
+                logging.debug("Network: Send queue of client %s overflowed." % str(self._clients[i][1]))
+                self._to_be_removed.append(i)
+            if not self._batch:
+                cond.notify()
+
+    def flush(self, addrs=None):
+        """Wake up the sender threads of the clients with the given addresses (all clients if None).
         """
-        data = self._encode(obj)
-        data_string = str(len(data)) + "#" + data
-        for i, (c, addr, t) in enumerate(self._clients):
+        for i, (c, a, t) in enumerate(self._clients):
+            if addrs is None or a in addrs:
+                send_queue, cond, sender = self._senders[i]
+                with cond:
+                    if len(send_queue) > 0:
+                        cond.notify()
+
+    def broadcast(self, obj, snapshot=False):
+        """Send the object to all clients. The object is encoded only once.
+
+        :param obj: object
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        data_string = self._header.pack(self._encode(obj))
+        for i in xrange(len(self._clients)):
+            self._enqueue(i, data_string, snapshot)
+
+    def send_to(self, addr, obj, snapshot=False):
+        """Send the object to the client with the given address.
+
+        :param addr: client address
+        :param obj: object
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        self.send_to_many([addr], obj, snapshot)
+
+    def send_to_many(self, addrs, obj, snapshot=False):
+        """Send the object to the clients with the given addresses. The object is encoded only once.
+
+        :param addrs: client addresses
+        :param obj: object
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        self.send_frame_to_many(addrs, self._header.pack(self._encode(obj)), snapshot)
+
+    def send_frame_to_many(self, addrs, frame, snapshot=False):
+        """Send an already encoded object (including the header) to the clients with the given addresses.
+
+        :param addrs: client addresses
+        :param frame: header.pack(encode(obj))
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        for i, (c, a, t) in enumerate(self._clients):
+            if a in addrs:
+                self._enqueue(i, frame, snapshot)
+
+
+class SelectNetworkServer(object):
+    """
+    The SelectNetworkServer class has the same interface as the NetworkServer class, but uses non-blocking sockets
+    instead of threads. Accepting, receiving and sending is multiplexed with select() and done in the calling thread
+    whenever the server is polled (update_client_list() and get_objects() poll the server).
+    Data that cannot be sent immediately is kept in a per-client SendQueue and sent on the next poll. See SendQueue for
+    the meaning of max_queued_bytes and max_queued_snapshots.
+
+    If batch is True, the data is only sent by flush() (or the next poll). All frames that were queued for a client
+    until then are sent with one system call.
+    """
+
+    def __init__(self, port, decode=None, encode=None, header=None, max_queued_bytes=None, max_queued_snapshots=None,
+                 batch=False):
+        self._port = port
+        self._batch = batch
+        self._max_queued_bytes = max_queued_bytes
+        self._max_queued_snapshots = max_queued_snapshots
+        if header is None:
+            self._header = AsciiLengthHeader()
+        else:
+            self._header = header
+        if decode is None:
+            self._decode = json.loads
+        else:
+            self._decode = decode
+        if encode is None:
+            self._encode = json.dumps
+        else:
+            self._encode = encode
+        self._listener = None
+        self._max_num_connections = None
+        self._num_connections = 0
+        self._clients = {}  # {socket: (addr, receive buffer, send queue)}
+        self._new_client_names = []
+        self._removed_client_names = []
+        self._items = []
+
+    def num_clients(self):
+        return len(self._clients)
+
+    def accept_clients(self, max_num_connections=None):
+        """
+        Accept the given number of connections on the next polls. If max_num_connections is None, all connections are
+        accepted until the server closes.
+
+        :param max_num_connections: maximum number of connections
+        """
+        if self._listener is not None:
+            raise Exception("The client acceptor is already running.")
+        self._max_num_connections = max_num_connections
+        self._num_connections = 0
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setblocking(0)
+        sock.bind((socket.gethostname(), self._port))
+        sock.listen(5)
+        self._listener = sock
+        logging.debug("Network: Listening for connections on port %d" % self._port)
+
+    def _close_listener(self):
+        self._listener.close()
+        self._listener = None
+
+    def _accept(self):
+        while self._listener is not None:
             try:
-                c.sendall(data_string)
+                c, addr = self._listener.accept()
             except socket.error:
-                # The client has closed the connection.
-                self._to_be_removed.append(i)
+                break
+            c.setblocking(0)
+            send_queue = SendQueue(self._max_queued_bytes, self._max_queued_snapshots)
+            self._clients[c] = (addr, ReceiveBuffer(self._header), send_queue)
+            self._new_client_names.append(addr)
+            self._num_connections += 1
+            logging.debug("Network: Accepted client with address %s" % str(addr))
+            if self._max_num_connections is not None and self._num_connections >= self._max_num_connections:
+                logging.debug("Network: Accepted the desired number of connections.")
+                self._close_listener()
+
+    def _remove(self, c):
+        addr, recv_buf, send_queue = self._clients.pop(c)
+        self._removed_client_names.append(addr)
+        c.close()
+        logging.debug("Network: Closed client connection.")
+
+    def _receive(self, c):
+        addr, recv_buf, send_queue = self._clients[c]
+        try:
+            n = recv_buf.recv_from(c)
+        except socket.error:
+            n = 0
+        self._items.extend((addr, item_string) for item_string in recv_buf.frames())
+        if n == 0:
+            self._remove(c)
+
+    def _send(self, c):
+        """Send as much of the client's send queue as the socket accepts.
+        """
+        addr, recv_buf, send_queue = self._clients[c]
+        try:
+            send_queue.send(c)
+        except socket.error:
+            # The client has closed the connection.
+            self._remove(c)
+
+    def poll(self, timeout=0.0):
+        """
+        Accept new clients, receive the available data and send the buffered data. Wait at most timeout seconds for
+        the sockets to become ready.
+        """
+        readers = list(self._clients)
+        if self._listener is not None:
+            readers.append(self._listener)
+        writers = [c for c, (addr, recv_buf, send_queue) in self._clients.iteritems() if len(send_queue) > 0]
+        if len(readers) == 0:
+            return
+        readable, writable, _ = select.select(readers, writers, [], timeout)
+        for c in readable:
+            if c is self._listener:
+                self._accept()
+            elif c in self._clients:
+                self._receive(c)
+        for c in writable:
+            if c in self._clients:
+                self._send(c)
 
-    def send_to(self, addr, obj):
+    def update_client_list(self):
+        """
+        Poll the server and return the names of the clients that were accepted and removed since the last call.
+        """
+        self.poll()
+        new_client_names, self._new_client_names = self._new_client_names, []
+        removed_client_names, self._removed_client_names = self._removed_client_names, []
+        return new_client_names, removed_client_names
+
+    def get_objects(self):
+        """Poll the server and return a list with all objects that came in since the last call.
+        """
+        return [item for addr, item in self.get_objects_with_senders()]
+
+    def get_objects_with_senders(self):
+        """
+        Poll the server and return a list with the tuples (client address, object) of all objects that came in since
+        the last call.
+        """
+        self.poll()
+        items = [(addr, self._decode(item_string)) for addr, item_string in self._items]
+        self._items = []
+        return items
+
+    def close_all(self):
+        """Close all connections.
+        """
+        if self._listener is not None:
+            self._close_listener()
+        for c in list(self._clients):
+            self._remove(c)
+
+    def _enqueue(self, c, data_string, snapshot):
+        addr, recv_buf, send_queue = self._clients[c]
+        send_now = len(send_queue) == 0
+        if not send_queue.put(data_string, snapshot):
+            logging.debug("Network: Send queue of client %s overflowed." % str(addr))
+            self._remove(c)
+        elif send_now and not self._batch:
+            self._send(c)
+
+    def flush(self, addrs=None):
+        """Send the queued data of the clients with the given addresses (all clients if None).
+        """
+        for c, (a, recv_buf, send_queue) in self._clients.items():
+            if (addrs is None or a in addrs) and len(send_queue) > 0:
+                self._send(c)
+
+    def broadcast(self, obj, snapshot=False):
+        """Send the object to all clients. The object is encoded only once.
+
+        :param obj: object
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        data_string = self._header.pack(self._encode(obj))
+        for c in list(self._clients):
+            self._enqueue(c, data_string, snapshot)
+
+    def send_to(self, addr, obj, snapshot=False):
         """Send the object to the client with the given address.
+
+        :param addr: client address
+        :param obj: object
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
         """
-        data = self._encode(obj)
-        data_string = str(len(data)) + "#" + data
-        for i, (c, a, t) in enumerate(self._clients):
-            if addr == a:
-                try:
-                    c.sendall(data_string)
-                except socket.error:
-                    # The client has closed the connection.
-                    self._to_be_removed.append(i)
+        self.send_to_many([addr], obj, snapshot)
+
+    def send_to_many(self, addrs, obj, snapshot=False):
+        """Send the object to the clients with the given addresses. The object is encoded only once.
+
+        :param addrs: client addresses
+        :param obj: object
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        self.send_frame_to_many(addrs, self._header.pack(self._encode(obj)), snapshot)
+
+    def send_frame_to_many(self, addrs, frame, snapshot=False):
+        """Send an already encoded object (including the header) to the clients with the given addresses.
+
+        :param addrs: client addresses
+        :param frame: header.pack(encode(obj))
+        :param snapshot: whether the object is a snapshot that may be dropped if a newer one is queued
+        """
+        for c, (a, recv_buf, send_queue) in self._clients.items():
+            if a in addrs:
+                self._enqueue(c, frame, snapshot)
+
+
+# Packet kinds and channels of the UDP transport.
+UDP_CONNECT = 0
+UDP_DATA = 1
+UDP_ACK = 2
+UDP_DISCONNECT = 3
+UDP_KEEPALIVE = 4
+UDP_FRAGMENT = 5
+UNRELIABLE_SEQUENCED = 0
+RELIABLE_ORDERED = 1
+
+# Every datagram starts with the packet kind, the channel and a 16 bit sequence number.
+_udp_packet_struct = struct.Struct("!BBH")
+_udp_max_datagram_size = 65507
+# A fragment datagram continues with the index of the fragment and the number of fragments.
+_udp_fragment_struct = struct.Struct("!BB")
+_udp_max_fragments = 255
+# The receiver keeps the fragments of this many incomplete unreliable datagrams.
+_udp_max_partial_datagrams = 4
+
+
+def _sequence_newer(a, b):
+    """Return whether the 16 bit sequence number a is newer than b (with wrap-around).
+    """
+    return a != b and ((a - b) & 0xFFFF) < 0x8000
+
+
+def _split_frames(header, payload):
+    """Return the data of all frames in the payload of a datagram.
+    """
+    frames = []
+    start = 0
+    end = len(payload)
+    while start < end:
+        h = header.unpack(payload, start, end)
+        if h is None or h[0] + h[1] > end:
+            raise Exception("Incomplete frame in datagram.")
+        data_start, data_len = h
+        frames.append(payload[data_start:data_start+data_len])
+        start = data_start + data_len
+    return frames
+
+
+class DatagramShim(object):
+    """
+    Sends datagrams over a UDP socket, but drops them with the probability loss and delays them by latency (plus a
+    random jitter) seconds. The delayed datagrams are sent by poll(). This is meant to test the UDP transport over
+    loopback.
+    """
+
+    def __init__(self, sock, loss=0.0, latency=0.0, jitter=0.0, seed=None):
+        self._sock = sock
+        self._loss = loss
+        self._latency = latency
+        self._jitter = jitter
+        self._random = random.Random(seed)
+        self._delayed = []  # heap with (send time, counter, data, address)
+        self._counter = 0
+
+    def sendto(self, data, addr):
+        if self._loss > 0 and self._random.random() < self._loss:
+            return
+        delay = self._latency
+        if self._jitter > 0:
+            delay += self._random.uniform(0, self._jitter)
+        if delay <= 0:
+            self._sendto(data, addr)
+        else:
+            heapq.heappush(self._delayed, (time.time() + delay, self._counter, data, addr))
+            self._counter += 1
+
+    def poll(self):
+        """Send the delayed datagrams that are due.
+        """
+        now = time.time()
+        while len(self._delayed) > 0 and self._delayed[0][0] <= now:
+            send_time, counter, data, addr = heapq.heappop(self._delayed)
+            self._sendto(data, addr)
+
+    def _sendto(self, data, addr):
+        try:
+            self._sock.sendto(data, addr)
+        except socket.error as e:
+            # The datagram is lost, like on a real network.
+            logging.debug("Network: Could not send datagram to %s: %s" % (str(addr), e))
+
+
+class UdpPeer(object):
+    """
+    The channel state of one side of a UDP connection.
+
+    Frames are queued on one of two channels and sent together on the next call of packets():
+    * UNRELIABLE_SEQUENCED: The frames are sent once. The receiver drops datagrams that are older than the newest one
+      it received, so old snapshots are never applied after new ones.
+    * RELIABLE_ORDERED: Each datagram is resent every resend_timeout seconds until the receiver acknowledges it. The
+      receiver delivers the frames in order and drops duplicates.
+    Several frames are packed into one datagram as long as the datagram stays below max_payload bytes. On the reliable
+    channel, the frames are sent as a stream that is cut into payloads of max_payload bytes, so a frame may span several
+    datagrams and frames of any size can be sent. On the unreliable channel, a frame that is larger than max_payload is
+    sent as UDP_FRAGMENT datagrams with the same sequence number. The receiver delivers the frame when it has all
+    fragments and drops it if one fragment is lost. Unreliable frames with more than _udp_max_fragments fragments are
+    dropped.
+    """
+
+    def __init__(self, addr, header, resend_timeout=0.2, max_payload=1200):
+        self.addr = addr
+        self._header = header
+        self._resend_timeout = resend_timeout
+        self._max_payload = max_payload
+        self._pending = ([], [])  # frames that wait to be sent on the unreliable and the reliable channel
+        self._unreliable_send_sequence = 0
+        self._unreliable_receive_sequence = None
+        self._fragments = collections.OrderedDict()  # {sequence: (number of fragments, {index: fragment})}
+        self._reliable_send_sequence = 0
+        self._unacked = collections.OrderedDict()  # {sequence: [datagram, last send time]}
+        self._reliable_receive_sequence = 0  # the next expected sequence number
+        self._out_of_order = {}  # {sequence: payload} of reliable datagrams that came too early
+        self._reliable_buffer = ReceiveBuffer(header, 4096)  # reliable data that was delivered in order
+        self.num_unacked_bytes = 0
+        self.last_receive_time = time.time()
+        self.last_send_time = 0
+
+    def queue(self, frame, reliable):
+        if not reliable and len(frame) > _udp_max_fragments * self._max_payload:
+            logging.warning("Network: Dropped an unreliable frame of %d bytes that needs too many fragments."
+                            % len(frame))
+            return
+        self._pending[RELIABLE_ORDERED if reliable else UNRELIABLE_SEQUENCED].append(frame)
+
+    def _payloads(self, frames):
+        """Pack the frames into as few payloads as possible. A frame that is larger than max_payload gets its own payload.
+        """
+        payloads = []
+        current = []
+        size = 0
+        for frame in frames:
+            if len(current) > 0 and size + len(frame) > self._max_payload:
+                payloads.append("".join(current))
+                current = []
+                size = 0
+            current.append(frame)
+            size += len(frame)
+        if len(current) > 0:
+            payloads.append("".join(current))
+        return payloads
+
+    def _stream_payloads(self, frames):
+        """
+        Cut the frames into payloads of at most max_payload bytes. The receiver must join the payloads in order, so this
+        is only used on the reliable channel.
+        """
+        data = "".join(frames)
+        return [data[i:i+self._max_payload] for i in xrange(0, len(data), self._max_payload)]
+
+    def packets(self, now):
+        """Return the datagrams with the queued frames and the reliable datagrams that must be resent.
+        """
+        datagrams = []
+        for sequence, entry in self._unacked.iteritems():
+            if now - entry[1] >= self._resend_timeout:
+                entry[1] = now
+                datagrams.append(entry[0])
+        for payload in self._payloads(self._pending[UNRELIABLE_SEQUENCED]):
+            if len(payload) <= self._max_payload:
+                datagrams.append(_udp_packet_struct.pack(UDP_DATA, UNRELIABLE_SEQUENCED,
+                                                         self._unreliable_send_sequence) + payload)
+            else:
+                header = _udp_packet_struct.pack(UDP_FRAGMENT, UNRELIABLE_SEQUENCED, self._unreliable_send_sequence)
+                count = (len(payload) - 1) // self._max_payload + 1
+                for i in xrange(count):
+                    datagrams.append(header + _udp_fragment_struct.pack(i, count) +
+                                     payload[i*self._max_payload:(i+1)*self._max_payload])
+            self._unreliable_send_sequence = (self._unreliable_send_sequence + 1) & 0xFFFF
+        for payload in self._stream_payloads(self._pending[RELIABLE_ORDERED]):
+            datagram = _udp_packet_struct.pack(UDP_DATA, RELIABLE_ORDERED, self._reliable_send_sequence) + payload
+            self._unacked[self._reliable_send_sequence] = [datagram, now]
+            self.num_unacked_bytes += len(datagram)
+            self._reliable_send_sequence = (self._reliable_send_sequence + 1) & 0xFFFF
+            datagrams.append(datagram)
+        del self._pending[UNRELIABLE_SEQUENCED][:]
+        del self._pending[RELIABLE_ORDERED][:]
+        if len(datagrams) > 0:
+            self.last_send_time = now
+        return datagrams
+
+    def receive(self, kind, channel, sequence, payload, now):
+        """
+        Handle a received datagram. Return the list with the data of the frames that can be delivered and the list of
+        datagrams that must be sent in reply (acknowledgements).
+        """
+        self.last_receive_time = now
+        if kind == UDP_ACK:
+            entry = self._unacked.pop(sequence, None)
+            if entry is not None:
+                self.num_unacked_bytes -= len(entry[0])
+            return [], []
+        if kind not in (UDP_DATA, UDP_FRAGMENT):
+            return [], []
+        if channel == UNRELIABLE_SEQUENCED:
+            if self._unreliable_receive_sequence is not None and \
+                    not _sequence_newer(sequence, self._unreliable_receive_sequence):
+                return [], []
+            if kind == UDP_FRAGMENT:
+                payload = self._add_fragment(sequence, payload)
+                if payload is None:
+                    return [], []
+            self._unreliable_receive_sequence = sequence
+            for s in [s for s in self._fragments if not _sequence_newer(s, sequence)]:
+                del self._fragments[s]
+            return _split_frames(self._header, payload), []
+        if kind != UDP_DATA:
+            return [], []
+
+        # Reliable channel: Always acknowledge, deliver in order.
+        ack = _udp_packet_struct.pack(UDP_ACK, RELIABLE_ORDERED, sequence)
+        if sequence == self._reliable_receive_sequence:
+            self._reliable_buffer.feed(payload)
+            self._reliable_receive_sequence = (self._reliable_receive_sequence + 1) & 0xFFFF
+            while self._reliable_receive_sequence in self._out_of_order:
+                self._reliable_buffer.feed(self._out_of_order.pop(self._reliable_receive_sequence))
+                self._reliable_receive_sequence = (self._reliable_receive_sequence + 1) & 0xFFFF
+            return self._reliable_buffer.frames(), [ack]
+        if _sequence_newer(sequence, self._reliable_receive_sequence):
+            self._out_of_order[sequence] = payload
+        return [], [ack]
+
+
+    def _add_fragment(self, sequence, data):
+        """Store the fragment of an unreliable datagram. Return the joined payload if all fragments are there.
+        """
+        if len(data) < _udp_fragment_struct.size:
+            return None
+        index, count = _udp_fragment_struct.unpack_from(data)
+        if index >= count:
+            return None
+        entry = self._fragments.get(sequence)
+        if entry is None or entry[0] != count:
+            entry = (count, {})
+            self._fragments[sequence] = entry
+            while len(self._fragments) > _udp_max_partial_datagrams:
+                self._fragments.popitem(last=False)
+        entry[1][index] = data[_udp_fragment_struct.size:]
+        if len(entry[1]) < count:
+            return None
+        del self._fragments[sequence]
+        return "".join(entry[1][i] for i in xrange(count))
+
+
+class UdpNetworkServer(object):
+    """
+    The UdpNetworkServer class has the same interface as the SelectNetworkServer class, but sends the objects as UDP
+    datagrams (see UdpPeer). Snapshots are sent on the unreliable-sequenced channel, so a lost snapshot does not delay
+    the following ones. All other objects are sent on the reliable-ordered channel.
+    A client connects by sending a UDP_CONNECT datagram and is removed when it sends UDP_DISCONNECT or nothing for
+    timeout seconds. If more than max_queued_bytes bytes are not acknowledged by a client, the client is removed.
+    The loss, latency and jitter arguments are given to a DatagramShim.
+    """
+
+    def __init__(self, port, decode=None, encode=None, header=None, max_queued_bytes=None, max_queued_snapshots=None,
+                 batch=False, timeout=10.0, resend_timeout=0.2, loss=0.0, latency=0.0, jitter=0.0):
+        self._port = port
+        self._batch = batch
+        self._max_queued_bytes = max_queued_bytes
+        self._timeout = timeout
+        self._resend_timeout = resend_timeout
+        self._shim_args = (loss, latency, jitter)
+        if header is None:
+            self._header = AsciiLengthHeader()
+        else:
+            self._header = header
+        if decode is None:
+            self._decode = json.loads
+        else:
+            self._decode = decode
+        if encode is None:
+            self._encode = json.dumps
+        else:
+            self._encode = encode
+        self._socket = None
+        self._shim = None
+        self._accepting = False
+        self._max_num_connections = None
+        self._num_connections = 0
+        self._peers = {}  # {address: UdpPeer}
+        self._new_client_names = []
+        self._removed_client_names = []
+        self._items = []
+
+    def num_clients(self):
+        return len(self._peers)
+
+    def accept_clients(self, max_num_connections=None):
+        """
+        Accept the given number of connections on the next polls. If max_num_connections is None, all connections are
+        accepted until the server closes.
+
+        :param max_num_connections: maximum number of connections
+        """
+        if self._accepting:
+            raise Exception("The client acceptor is already running.")
+        self._accepting = True
+        self._max_num_connections = max_num_connections
+        self._num_connections = 0
+        if self._socket is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setblocking(0)
+            sock.bind((socket.gethostname(), self._port))
+            self._socket = sock
+            loss, latency, jitter = self._shim_args
+            self._shim = DatagramShim(sock, loss=loss, latency=latency, jitter=jitter)
+        logging.debug("Network: Listening for UDP connections on port %d" % self._port)
+
+    def _remove(self, addr):
+        del self._peers[addr]
+        self._removed_client_names.append(addr)
+        logging.debug("Network: Removed UDP client %s." % str(addr))
+
+    def _receive(self, now):
+        while True:
+            try:
+                datagram, addr = self._socket.recvfrom(_udp_max_datagram_size)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                # E. g. an ICMP port unreachable from a closed client. The client is removed after the timeout.
+                continue
+            if len(datagram) < _udp_packet_struct.size:
+                continue
+            kind, channel, sequence = _udp_packet_struct.unpack_from(datagram)
+            peer = self._peers.get(addr)
+            if kind == UDP_CONNECT:
+                if peer is None and self._accepting:
+                    self._peers[addr] = UdpPeer(addr, self._header, self._resend_timeout)
+                    self._new_client_names.append(addr)
+                    self._num_connections += 1
+                    logging.debug("Network: Accepted UDP client with address %s" % str(addr))
+                    if self._max_num_connections is not None and self._num_connections >= self._max_num_connections:
+                        logging.debug("Network: Accepted the desired number of connections.")
+                        self._accepting = False
+                    peer = self._peers[addr]
+                if peer is not None:
+                    peer.last_receive_time = now
+                    self._shim.sendto(_udp_packet_struct.pack(UDP_CONNECT, 0, 0), addr)
+            elif peer is None:
+                continue
+            elif kind == UDP_DISCONNECT:
+                self._remove(addr)
+            else:
+                frames, replies = peer.receive(kind, channel, sequence, datagram[_udp_packet_struct.size:], now)
+                self._items.extend((addr, frame) for frame in frames)
+                for reply in replies:
+                    self._shim.sendto(reply, addr)
+
+    def _send(self, peer, now):
+        for datagram in peer.packets(now):
+            self._shim.sendto(datagram, peer.addr)
+
+    def poll(self):
+        """
+        Receive the available datagrams, resend the unacknowledged reliable datagrams and remove the clients that
+        timed out or have too much unacknowledged data.
+        """
+        if self._socket is None:
+            return
+        now = time.time()
+        self._receive(now)
+        for addr, peer in self._peers.items():
+            if now - peer.last_receive_time > self._timeout:
+                logging.debug("Network: UDP client %s timed out." % str(addr))
+                self._remove(addr)
+            elif self._max_queued_bytes is not None and peer.num_unacked_bytes > self._max_queued_bytes:
+                logging.debug("Network: Unacknowledged data of UDP client %s overflowed." % str(addr))
+                self._remove(addr)
+            else:
+                self._send(peer, now)
+        self._shim.poll()
+
+    def update_client_list(self):
+        """
+        Poll the server and return the names of the clients that were accepted and removed since the last call.
+        """
+        self.poll()
+        new_client_names, self._new_client_names = self._new_client_names, []
+        removed_client_names, self._removed_client_names = self._removed_client_names, []
+        return new_client_names, removed_client_names
+
+    def get_objects(self):
+        """Poll the server and return a list with all objects that came in since the last call.
+        """
+        return [item for addr, item in self.get_objects_with_senders()]
+
+    def get_objects_with_senders(self):
+        """
+        Poll the server and return a list with the tuples (client address, object) of all objects that came in since
+        the last call.
+        """
+        self.poll()
+        items = [(addr, self._decode(item_string)) for addr, item_string in self._items]
+        self._items = []
+        return items
+
+    def close_all(self):
+        """Tell all clients that the server closes and close the socket.
+        """
+        self._accepting = False
+        if self._socket is None:
+            return
+        for addr in self._peers.keys():
+            self._socket.sendto(_udp_packet_struct.pack(UDP_DISCONNECT, 0, 0), addr)
+            self._remove(addr)
+        self._socket.close()
+        self._socket = None
+
+    def broadcast(self, obj, snapshot=False):
+        """Send the object to all clients. The object is encoded only once.
+
+        :param obj: object
+        :param snapshot: whether the object is a snapshot (sent on the unreliable-sequenced channel)
+        """
+        self.send_frame_to_many(self._peers.keys(), self._header.pack(self._encode(obj)), snapshot)
+
+    def send_to(self, addr, obj, snapshot=False):
+        """Send the object to the client with the given address.
+
+        :param addr: client address
+        :param obj: object
+        :param snapshot: whether the object is a snapshot (sent on the unreliable-sequenced channel)
+        """
+        self.send_to_many([addr], obj, snapshot)
+
+    def send_to_many(self, addrs, obj, snapshot=False):
+        """Send the object to the clients with the given addresses. The object is encoded only once.
+
+        :param addrs: client addresses
+        :param obj: object
+        :param snapshot: whether the object is a snapshot (sent on the unreliable-sequenced channel)
+        """
+        self.send_frame_to_many(addrs, self._header.pack(self._encode(obj)), snapshot)
+
+    def send_frame_to_many(self, addrs, frame, snapshot=False):
+        """Send an already encoded object (including the header) to the clients with the given addresses.
+
+        :param addrs: client addresses
+        :param frame: header.pack(encode(obj))
+        :param snapshot: whether the object is a snapshot (sent on the unreliable-sequenced channel)
+        """
+        for addr in addrs:
+            peer = self._peers.get(addr)
+            if peer is not None:
+                peer.queue(frame, reliable=not snapshot)
+                if not self._batch:
+                    self._send(peer, time.time())
+
+    def flush(self, addrs=None):
+        """Send the queued data of the clients with the given addresses (all clients if None).
+        """
+        if self._socket is None:
+            return
+        now = time.time()
+        for addr, peer in self._peers.iteritems():
+            if addrs is None or addr in addrs:
+                self._send(peer, now)
+        self._shim.poll()
+
+
+# The available server implementations.
+server_engines = {
+    "threads": NetworkServer,
+    "select": SelectNetworkServer,
+    "udp": UdpNetworkServer
+}
 
 
 class NetworkClient(object):
@@ -242,11 +1272,16 @@ class NetworkClient(object):
     Internally, the following protocol is used to send data:
     def send(obj):
         data_string = encode(obj)
-        send_string = str(len(data_string)) + "#" + data_string
+        send_string = header.pack(data_string)
         socket.send(send_string)
+    The header defaults to AsciiLengthHeader, which prefixes the data with str(len(data_string)) + "#".
     """
 
-    def __init__(self, host, port, decode=None, encode=None):
+    def __init__(self, host, port, decode=None, encode=None, header=None):
+        if header is None:
+            self._header = AsciiLengthHeader()
+        else:
+            self._header = header
         if decode is None:
             self._decode = json.loads
         else:
@@ -260,16 +1295,38 @@ class NetworkClient(object):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._socket.connect((host, port))
         logging.debug("Network: Established connection to %s:%d" % (host, port))
-        self._network_listener = threading.Thread(target=listen_on_connection, args=(self._socket, self._queue, self._stop))
+        self._network_listener = threading.Thread(target=listen_on_connection,
+                                                  args=(self._socket, self._queue, self._stop),
+                                                  kwargs={"header": self._header})
         self._network_listener.daemon = True
         self._network_listener.start()
+        self._pending = []  # frames that are sent on the next flush
+        self.num_bytes_sent = 0  # encoded size of the sent objects
+        self.num_bytes_received = 0  # encoded size of the received objects
+        self.num_objects_sent = 0
+        self.num_objects_received = 0
+
+    def send(self, obj, reliable=True):
+        """Send the object to the server (together with the queued objects).
+        """
+        self.queue(obj, reliable)
+        self.flush()
+
+    def queue(self, obj, reliable=True):
+        """Queue the object. It is sent on the next flush() or send(). TCP is always reliable, so reliable is ignored.
+        """
+        data_string = self._encode(obj)
+        self.num_bytes_sent += len(data_string)
+        self.num_objects_sent += 1
+        self._pending.append(self._header.pack(data_string))
 
-    def send(self, obj):
-        """Send the object to the server.
+    def flush(self):
+        """Send all queued objects with one system call.
         """
-        data = self._encode(obj)
-        data_string = str(len(data)) + "#" + data
-        self._socket.sendall(data_string)
+        if len(self._pending) > 0:
+            data_string = "".join(self._pending)
+            self._pending = []
+            self._socket.sendall(data_string)
 
     def get_objects(self):
         """Take all items from the item queue, put them in a list. Clear the queue and return the list.
@@ -277,11 +1334,144 @@ class NetworkClient(object):
         items = []
         while not self._queue.empty():
             item_string = self._queue.get()
+            self.num_bytes_received += len(item_string)
             item = self._decode(item_string)
             items.append(item)
             self._queue.task_done()
+        self.num_objects_received += len(items)
         return items
 
     def close_all(self):
         self._stop.set()
         self._network_listener.join()
+
+
+class UdpNetworkClient(object):
+    """
+    The UdpNetworkClient class has the same interface as the NetworkClient class, but connects to a UdpNetworkServer.
+    Objects that are sent with reliable=False use the unreliable-sequenced channel (see UdpPeer). The client does not
+    use a thread: The datagrams are received and the reliable datagrams are resent whenever get_objects() or flush() is
+    called. If nothing was sent for keepalive_interval seconds, a keepalive datagram is sent, so the server does not
+    remove the client.
+    The loss, latency and jitter arguments are given to a DatagramShim.
+    """
+
+    def __init__(self, host, port, decode=None, encode=None, header=None, resend_timeout=0.2, keepalive_interval=1.0,
+                 connect_timeout=5.0, loss=0.0, latency=0.0, jitter=0.0):
+        if header is None:
+            self._header = AsciiLengthHeader()
+        else:
+            self._header = header
+        if decode is None:
+            self._decode = json.loads
+        else:
+            self._decode = decode
+        if encode is None:
+            self._encode = json.dumps
+        else:
+            self._encode = encode
+        self._keepalive_interval = keepalive_interval
+        self._addr = (socket.gethostbyname(host), port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._shim = DatagramShim(self._socket, loss=loss, latency=latency, jitter=jitter)
+        self._peer = UdpPeer(self._addr, self._header, resend_timeout)
+        self._items = []
+        self.num_bytes_sent = 0  # encoded size of the sent objects
+        self.num_bytes_received = 0  # encoded size of the received objects
+        self.num_objects_sent = 0
+        self.num_objects_received = 0
+        self._connect(connect_timeout, resend_timeout)
+        self._socket.setblocking(0)
+        logging.debug("Network: Established UDP connection to %s:%d" % (host, port))
+
+    def _connect(self, connect_timeout, resend_timeout):
+        """Send UDP_CONNECT until the server answers.
+        """
+        deadline = time.time() + connect_timeout
+        connect = _udp_packet_struct.pack(UDP_CONNECT, 0, 0)
+        while time.time() < deadline:
+            self._shim.sendto(connect, self._addr)
+            self._shim.poll()
+            self._socket.settimeout(resend_timeout)
+            try:
+                datagram, addr = self._socket.recvfrom(_udp_max_datagram_size)
+            except socket.timeout:
+                continue
+            except socket.error:
+                # The server port is not open yet.
+                time.sleep(resend_timeout)
+                continue
+            if addr == self._addr and len(datagram) >= _udp_packet_struct.size and \
+                    _udp_packet_struct.unpack_from(datagram)[0] == UDP_CONNECT:
+                self._peer.last_receive_time = time.time()
+                return
+        raise Exception("Could not connect to %s:%d" % self._addr)
+
+    def _poll(self):
+        now = time.time()
+        while True:
+            try:
+                datagram, addr = self._socket.recvfrom(_udp_max_datagram_size)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                continue
+            if addr != self._addr or len(datagram) < _udp_packet_struct.size:
+                continue
+            kind, channel, sequence = _udp_packet_struct.unpack_from(datagram)
+            if kind == UDP_DISCONNECT:
+                logging.debug("Network: The UDP server closed the connection.")
+                continue
+            frames, replies = self._peer.receive(kind, channel, sequence, datagram[_udp_packet_struct.size:], now)
+            self._items.extend(frames)
+            for reply in replies:
+                self._shim.sendto(reply, self._addr)
+        self._send(now)
+
+    def _send(self, now):
+        for datagram in self._peer.packets(now):
+            self._shim.sendto(datagram, self._addr)
+        if now - self._peer.last_send_time >= self._keepalive_interval:
+            self._peer.last_send_time = now
+            self._shim.sendto(_udp_packet_struct.pack(UDP_KEEPALIVE, 0, 0), self._addr)
+        self._shim.poll()
+
+    def send(self, obj, reliable=True):
+        """Send the object to the server (together with the queued objects).
+        """
+        self.queue(obj, reliable)
+        self.flush()
+
+    def queue(self, obj, reliable=True):
+        """Queue the object on the reliable or the unreliable channel. It is sent on the next flush() or send().
+        """
+        data_string = self._encode(obj)
+        self.num_bytes_sent += len(data_string)
+        self.num_objects_sent += 1
+        self._peer.queue(self._header.pack(data_string), reliable)
+
+    def flush(self):
+        """Send all queued objects.
+        """
+        self._send(time.time())
+
+    def get_objects(self):
+        """Receive the available datagrams and return a list with all objects that came in since the last call.
+        """
+        self._poll()
+        items = [self._decode(item_string) for item_string in self._items]
+        self.num_bytes_received += sum(len(item_string) for item_string in self._items)
+        self.num_objects_received += len(items)
+        self._items = []
+        return items
+
+    def close_all(self):
+        self._socket.sendto(_udp_packet_struct.pack(UDP_DISCONNECT, 0, 0), self._addr)
+        self._socket.close()
+
+
+# The available client implementations.
+client_transports = {
+    "tcp": NetworkClient,
+    "udp": UdpNetworkClient
+}
@@ -1,6 +1,9 @@
 import network
 import events
 import logging
+import snapshot
+import interest
+import profiling
 
 
 class ServerController(object):
@@ -9,20 +12,66 @@ class ServerController(object):
     Post all events that come from the network on the event manager.
     """
 
-    def __init__(self, ev_manager, port=32072, max_num_clients=None):
+    def __init__(self, ev_manager, port=32072, max_num_clients=None, codec="json", engine="threads",
+                 max_queued_bytes=None, max_queued_snapshots=1, model_broadcast_rate=20, delta_snapshots=True,
+                 server=None, interest_cell_size=None, interest_radius=1, flush_events=None):
+        """
+        :param ev_manager: event manager
+        :param port: port
+        :param max_num_clients: maximum number of clients
+        :param codec: name of the codec in events.codecs
+        :param engine: name of the network server in network.server_engines
+        :param max_queued_bytes: a client is disconnected if more bytes are waiting to be sent to it
+        :param max_queued_snapshots: only this many model broadcasts are queued per client, older ones are dropped
+        :param model_broadcast_rate: number of model broadcasts per second
+        :param delta_snapshots: whether the model broadcasts are sent as delta to the last acknowledged broadcast
+        :param server: use this network server instead of creating one (e. g. a match_host.MatchServer), the port,
+                       codec, engine and queue arguments are ignored in that case
+        :param interest_cell_size: if not None, each client only gets the state of the bodies near its character, the
+                                   stage is divided into cells of this size (see the interest module)
+        :param interest_radius: a client gets the bodies that are at most this many cells away from its character
+        :param flush_events: events of these classes are sent immediately, all other events are sent together at the
+                             end of the tick (see TickDoneEvent)
+        """
+        assert model_broadcast_rate > 0
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
         self._ev_manager.register_listener(self)
-        self._server = network.NetworkServer(port=port, decode=events.to_event, encode=events.to_string)
+        if server is None:
+            encode, decode, header = events.codecs[codec]
+            encode = profiling.timed(ev_manager.profiler, "network.encode", encode)
+            decode = profiling.timed(ev_manager.profiler, "network.decode", decode)
+            self._server = network.server_engines[engine](port=port, decode=decode, encode=encode, header=header,
+                                                          max_queued_bytes=max_queued_bytes,
+                                                          max_queued_snapshots=max_queued_snapshots, batch=True)
+        else:
+            self._server = server
         self._max_num_clients = max_num_clients
         self._num_clients = 0
-        self._post_ignore_events = [events.TickEvent, events.InitEvent, events.CloseCurrentModel, events.WorldStep]
+        self._client_names = []
+        if flush_events is None:
+            self._flush_events = ()
+        else:
+            self._flush_events = tuple(flush_events)
+        self._post_ignore_events = [events.TickEvent, events.InitEvent, events.CloseCurrentModel, events.WorldStep,
+                                    events.TickDoneEvent]
+        # The character requests are not sent, because their effect is contained in the model broadcasts.
         self._send_ignore_events = [events.TickEvent, events.InitEvent, events.ModelMetaBroadcastRequest,
-                                    events.ModelBroadcastRequest, events.AssignCharacter, events.WorldStep]
+                                    events.ModelBroadcastRequest, events.AssignCharacter, events.WorldStep,
+                                    events.CharacterMoveLeftRequest, events.CharacterMoveRightRequest,
+                                    events.CharacterJumpRequest, events.CharacterInputState, events.TickDoneEvent]
         # TODO: Complete the list of ignore-events.
 
         self._last_model_broadcast = 0  # elapsed time since the model was sent to all clients
-        self._model_broadcast_interval = 1.0  # the network clients are updated in this interval
+        self._model_broadcast_interval = 1.0 / model_broadcast_rate  # the network clients are updated in this interval
+        if delta_snapshots:
+            self._delta_encoder = snapshot.DeltaEncoder()
+        else:
+            self._delta_encoder = None
+        if interest_cell_size is not None:
+            self._interest_manager = interest.InterestManager(interest_cell_size, interest_radius)
+        else:
+            self._interest_manager = None
 
     def notify(self, event):
         if isinstance(event, events.InitEvent):
@@ -32,7 +81,7 @@ class ServerController(object):
             new_client_names, removed_client_names = self._server.update_client_list()
             if self._num_clients != self._server.num_clients():
                 self._num_clients = self._server.num_clients()
-                if self._num_clients > self._max_num_clients:
+                if self._max_num_clients is not None and self._num_clients > self._max_num_clients:
                     raise Exception("Maximum number of clients exceeded.")
             for client in new_client_names:
                 self._ev_manager.post(events.ClientAccepted(client))
@@ -40,8 +89,13 @@ class ServerController(object):
                 self._ev_manager.post(events.ClientRemoved(client))
 
             # Get the network events from the clients and post them to the event manager.
-            network_events = self._server.get_objects()
-            for ev in network_events:
+            network_events = self._server.get_objects_with_senders()
+            for client, ev in network_events:
+                if isinstance(ev, events.ModelBroadcastAck):
+                    if self._delta_encoder is not None:
+                        self._delta_encoder.ack(client, ev.sequence)
+                    continue
+
                 # Send the event only if its class is not in the ignore list.
                 for cl in self._post_ignore_events:
                     if isinstance(ev, cl):
@@ -51,17 +105,74 @@ class ServerController(object):
 
             self._last_model_broadcast += event.elapsed_time
             if self._last_model_broadcast >= self._model_broadcast_interval:
-                self._last_model_broadcast = 0
+                self._last_model_broadcast -= self._model_broadcast_interval
+                if self._last_model_broadcast >= self._model_broadcast_interval:
+                    # Do not try to catch up after a slow frame.
+                    self._last_model_broadcast = 0
                 self._ev_manager.post(events.ModelBroadcastRequest())
+        elif isinstance(event, events.TickDoneEvent):
+            # Send all events of this tick.
+            with profiling.section(self._ev_manager.profiler, "network.send"):
+                self._server.flush()
         elif isinstance(event, events.AssignCharacterToClient):
             ev = events.AssignCharacter(event.character_id)
             self._server.send_to(event.client_name, ev)
+            if isinstance(ev, self._flush_events):
+                self._server.flush()
+            if self._interest_manager is not None:
+                self._interest_manager.assign_character(event.client_name, event.character_id)
+        elif isinstance(event, events.ClientAccepted):
+            self._client_names.append(event.client_name)
+            if self._delta_encoder is not None:
+                self._delta_encoder.add_client(event.client_name)
+        elif isinstance(event, events.ClientRemoved):
+            if event.client_name in self._client_names:
+                self._client_names.remove(event.client_name)
+            if self._delta_encoder is not None:
+                self._delta_encoder.remove_client(event.client_name)
+            if self._interest_manager is not None:
+                self._interest_manager.remove_client(event.client_name)
+        elif isinstance(event, events.ModelBroadcast):
+            if self._delta_encoder is not None:
+                self._send_delta_broadcasts(event.data)
+                return
+            elif self._interest_manager is not None:
+                self._send_filtered_broadcasts(event.data)
+                return
 
         for cl in self._send_ignore_events:
             if isinstance(event, cl):
                 break
         else:
-            self._server.broadcast(event)
+            self._server.broadcast(event, snapshot=isinstance(event, events.ModelBroadcast))
+            if isinstance(event, self._flush_events):
+                self._server.flush()
+
+    def _send_delta_broadcasts(self, data):
+        """Send the model state to each client as delta to the last model broadcast the client acknowledged.
+        """
+        if self._interest_manager is not None:
+            interests = self._interest_manager.interests(data)
+        else:
+            interests = None
+        sequence, deltas = self._delta_encoder.encode(data, interests)
+        for baseline, delta, clients in deltas:
+            ev = events.ModelDeltaBroadcast(sequence, baseline, delta)
+            self._server.send_to_many(clients, ev, snapshot=True)
+
+    def _send_filtered_broadcasts(self, data):
+        """Send each client the state of the bodies near its character. Clients without character get all bodies.
+        """
+        interests = self._interest_manager.interests(data)
+        others = []
+        for client in self._client_names:
+            if client in interests:
+                ev = events.ModelBroadcast(interest.filter_records(data, interests[client]))
+                self._server.send_to(client, ev, snapshot=True)
+            else:
+                others.append(client)
+        if len(others) > 0:
+            self._server.send_to_many(others, events.ModelBroadcast(data), snapshot=True)
 
     def shutdown(self):
         self._server.close_all()
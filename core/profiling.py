@@ -0,0 +1,182 @@
+"""
+Frame profiling.
+
+A Profiler collects the durations of named phases of a frame in rolling histograms. If an event manager has a profiler
+(see EventManager), it records the time of each listener per event class ("notify.<listener>.<event>") and of each
+tick ("tick"). The components record their own phases through the profiler of their event manager, e. g.
+"physics.step", "render.draw", "render.present", "network.encode", "network.decode" and "network.send".
+Durations include the nested phases, e. g. the notify time of the NetworkEventManager contains the notify times of its
+listeners.
+
+The summaries can be written as JSON or served over HTTP on the local host by a MetricsServer:
+
+    profiler = Profiler()
+    ev_manager = events.EventManager(profiler=profiler)
+    metrics_server = MetricsServer(profiler, port=32080)
+    metrics_server.start()  # GET http://127.0.0.1:32080/metrics
+"""
+import BaseHTTPServer
+import collections
+import json
+import logging
+import threading
+import time
+import stats
+
+
+class RollingHistogram(object):
+    """
+    Keeps the last size samples, so the summary follows the current behaviour of the game.
+    """
+
+    def __init__(self, size=1000):
+        assert size > 0
+        self._samples = collections.deque(maxlen=size)
+        self.total_count = 0
+
+    def add(self, value):
+        self._samples.append(value)
+        self.total_count += 1
+
+    def summary(self):
+        """Return the summary of the kept samples (see stats.summarize) and the total number of samples.
+        """
+        summary = stats.summarize(list(self._samples))
+        summary["total_count"] = self.total_count
+        return summary
+
+
+class Profiler(object):
+    """
+    Collects the durations of named phases in rolling histograms of the given size. The durations may be recorded and
+    read from different threads.
+    """
+
+    def __init__(self, size=1000):
+        self._size = size
+        self._histograms = {}  # {name: rolling histogram}
+        self._lock = threading.Lock()
+
+    def record(self, name, duration):
+        """Add the duration (in seconds) of the phase with the given name.
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = RollingHistogram(self._size)
+                self._histograms[name] = histogram
+            histogram.add(duration)
+
+    def summary(self):
+        """Return the dictionary {name: summary} of all phases (see RollingHistogram.summary).
+        """
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self._histograms.iteritems()}
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+    def write_json(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.to_json())
+
+
+class _Section(object):
+    """Records the time between entering and leaving a with block.
+    """
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler.record(self._name, time.time() - self._start)
+
+
+class _NullSection(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_section = _NullSection()
+
+
+def section(profiler, name):
+    """
+    Return a context manager that records the duration of its with block as the phase with the given name. If the
+    profiler is None, nothing is recorded.
+    """
+    if profiler is None:
+        return _null_section
+    return _Section(profiler, name)
+
+
+def timed(profiler, name, func):
+    """Return a function that records the duration of each call of func. If the profiler is None, return func.
+    """
+    if profiler is None:
+        return func
+
+    def timed_func(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.record(name, time.time() - start)
+    return timed_func
+
+
+class MetricsServer(object):
+    """
+    Serves the summary of a profiler as JSON over HTTP (GET /metrics). The server runs in its own thread and only
+    listens on the local host.
+    """
+
+    def __init__(self, profiler, port=0, host="127.0.0.1"):
+        """
+        :param profiler: the profiler
+        :param port: port (a free port is chosen if 0, see the port attribute)
+        :param host: host address the server listens on
+        """
+        metrics_profiler = profiler
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics_profiler.to_json()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("MetricsServer: " + format % args)
+
+        self._server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        logging.debug("MetricsServer: Serving the metrics on port %d" % self.port)
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
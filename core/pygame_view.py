@@ -7,10 +7,10 @@ class PygameView(object):
     Abstract Pygame view class.
     """
 
-    def __init__(self, ev_manager):
+    def __init__(self, ev_manager, event_classes=None):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._id = self._ev_manager.register_listener(self, event_classes)
         self._screen = pygame.display.get_surface()
 
     def to_screen_x(self, x):
@@ -1,5 +1,6 @@
 import pygame
 import logging
+import collections
 
 
 class SingletonExistsException(Exception):
@@ -15,15 +16,26 @@ class ResourceManager(object):
     """
     Manages all loadable files (such as images, sounds, ...).
     This is a singleton class, meaning that you must not create more than one instance of this class.
+
+    The loaded (and scaled) images are kept in a least recently used cache. If the images need more than
+    max_image_bytes, the least recently used images are dropped, except for the images of pinned files.
     """
 
     __instance = None
 
-    def __init__(self):
+    def __init__(self, max_image_bytes=64*1024*1024):
         if ResourceManager.__instance is not None:
             raise SingletonExistsException("Tried to create a ResourceManager, but there already is one.")
         ResourceManager.__instance = self
-        self._images = {}
+        assert max_image_bytes >= 0
+        self._images = collections.OrderedDict()  # {(filename, size): image}, the least recently used image first
+        self._image_bytes = {}  # {(filename, size): size of the image in bytes}
+        self._pinned_files = set()
+        self._max_image_bytes = max_image_bytes
+        self.num_image_bytes = 0
+        self.image_hits = 0
+        self.image_misses = 0
+        self.image_evictions = 0
 
     @staticmethod
     def instance():
@@ -34,16 +46,71 @@ class ResourceManager(object):
     def get_image(self, filename, size=None):
         if size is None:
             size = (0, 0)
-        if (filename, size) not in self._images:
-            try:
-                logging.debug("Resource Manager: Loading image from file: %s" % filename)
-                im = pygame.image.load(filename).convert()
-            except pygame.error:
-                raise IOError("File %s not found." % filename)
-            if size != (0, 0):
-                logging.debug("Resource Manager: Resizing image %s to (%d, %d)" % (filename, size[0], size[1]))
-                im = pygame.transform.scale(im, size)
-            self._images[(filename, size)] = im
+        key = (filename, size)
+        if key in self._images:
+            self.image_hits += 1
+            im = self._images.pop(key)
+            self._images[key] = im
             return im
-        else:
-            return self._images[(filename, size)]
+
+        self.image_misses += 1
+        try:
+            logging.debug("Resource Manager: Loading image from file: %s" % filename)
+            im = pygame.image.load(filename).convert()
+        except pygame.error:
+            raise IOError("File %s not found." % filename)
+        if size != (0, 0):
+            logging.debug("Resource Manager: Resizing image %s to (%d, %d)" % (filename, size[0], size[1]))
+            im = pygame.transform.scale(im, size)
+        self._images[key] = im
+        self._image_bytes[key] = im.get_width() * im.get_height() * im.get_bytesize()
+        self.num_image_bytes += self._image_bytes[key]
+        self._evict_images(keep=key)
+        return im
+
+    def set_max_image_bytes(self, max_image_bytes):
+        """Set the byte budget of the image cache and drop images until it is met.
+        """
+        assert max_image_bytes >= 0
+        self._max_image_bytes = max_image_bytes
+        self._evict_images()
+
+    def _remove_image(self, key):
+        del self._images[key]
+        self.num_image_bytes -= self._image_bytes.pop(key)
+
+    def _evict_images(self, keep=None):
+        """
+        Drop the least recently used images that are not pinned until the images fit into the byte budget. The image
+        with the key keep is not dropped, even if it alone exceeds the budget.
+        """
+        if self.num_image_bytes <= self._max_image_bytes:
+            return
+        for key in list(self._images):
+            if self.num_image_bytes <= self._max_image_bytes:
+                break
+            if key != keep and key[0] not in self._pinned_files:
+                logging.debug("Resource Manager: Dropping image %s (%d, %d)" % (key[0], key[1][0], key[1][1]))
+                self._remove_image(key)
+                self.image_evictions += 1
+
+    def pin_image(self, filename):
+        """Keep all images that are loaded from the given file in the cache, regardless of the byte budget.
+        """
+        self._pinned_files.add(filename)
+
+    def unpin_image(self, filename):
+        self._pinned_files.discard(filename)
+        self._evict_images()
+
+    def drop_image(self, filename):
+        """Remove all images (all sizes) of the given file from the cache.
+        """
+        for key in [key for key in self._images if key[0] == filename]:
+            self._remove_image(key)
+
+    def image_cache_stats(self):
+        """Return the dictionary with the number of cached images, their size in bytes and the hit and miss counters.
+        """
+        return {"images": len(self._images), "bytes": self.num_image_bytes, "max_bytes": self._max_image_bytes,
+                "hits": self.image_hits, "misses": self.image_misses, "evictions": self.image_evictions}
@@ -0,0 +1,216 @@
+"""
+Snapshots of the physical state of a stage.
+
+A snapshot is a flat list of numbers that contains RECORD_SIZE numbers per body:
+    kind, id, x, y, angle, linear velocity x, linear velocity y, angular velocity, awake, input sequence, input steps
+The kind is one of the body kinds below and (kind, id) identifies the body in the stage model. The input sequence is
+the sequence number of the last input the server applied to a character and the input steps are the number of world
+steps the server made since then (at most MAX_INPUT_STEPS, 0 for other bodies). Clients use them to drop the predicted
+world steps the server has simulated and to replay the other ones.
+
+Snapshots can be sent as deltas: The server numbers the snapshots and each client acknowledges the last snapshot it
+applied. The next snapshot for that client only contains the records of the bodies whose quantized state changed
+since the acknowledged snapshot (the baseline). Bodies that do not move (e. g. sleeping bodies) are not sent. A body
+that was in the baseline but is no longer sent to the client (e. g. it left the interest set of the client) is sent as
+removal record, whose awake value is REMOVED.
+"""
+import collections
+
+# The body kinds.
+WORLD = 0
+CHARACTER = 1
+THROWABLE = 2
+
+# The body kinds as they appear in the user data of the bodies.
+KIND_NAMES = {WORLD: "world", CHARACTER: "character", THROWABLE: "throwable"}
+
+RECORD_SIZE = 11
+
+# The awake value of a removal record in a delta snapshot.
+REMOVED = -1
+
+# The input steps are limited, so the record of a character without new inputs stops changing.
+MAX_INPUT_STEPS = 255
+
+
+def append_body(data, kind, body_id, body, input_sequence=0, input_steps=0):
+    """Append the record of the given Box2D body to the snapshot data.
+    """
+    position = body.position
+    velocity = body.linearVelocity
+    data.extend((kind, body_id, position[0], position[1], body.angle, velocity[0], velocity[1], body.angularVelocity,
+                 1 if body.awake else 0, input_sequence, input_steps))
+
+
+def records(data):
+    """Return the list of body records (tuples of length RECORD_SIZE) in the snapshot data.
+    """
+    return [tuple(data[i:i+RECORD_SIZE]) for i in xrange(0, len(data), RECORD_SIZE)]
+
+
+def removal_record(key):
+    """Return the removal record of the body with the given key (kind, id).
+    """
+    return (key[0], key[1], 0, 0, 0, 0, 0, 0, REMOVED, 0, 0)
+
+
+# The quantization steps that are used to decide whether a body changed.
+POSITION_QUANTUM = 0.001
+ANGLE_QUANTUM = 0.001
+VELOCITY_QUANTUM = 0.01
+
+
+def quantize(record):
+    """Return the quantized state of the given body record.
+    """
+    kind, body_id, x, y, angle, vx, vy, omega, awake, input_sequence, input_steps = record
+    return (int(round(x / POSITION_QUANTUM)), int(round(y / POSITION_QUANTUM)), int(round(angle / ANGLE_QUANTUM)),
+            int(round(vx / VELOCITY_QUANTUM)), int(round(vy / VELOCITY_QUANTUM)), int(round(omega / VELOCITY_QUANTUM)),
+            awake != 0, int(input_sequence), int(input_steps))
+
+
+class DeltaEncoder(object):
+    """
+    Creates the delta snapshots on the server.
+    Keeps a ring buffer with the quantized states of the last history_size snapshots and the last acknowledged snapshot
+    of each client.
+    """
+
+    def __init__(self, history_size=32):
+        assert history_size > 0
+        self._history_size = history_size
+        self._history = collections.OrderedDict()  # {sequence: {(kind, id): quantized state}}
+        self._acks = {}  # {client: sequence of the last acknowledged snapshot (-1 if none)}
+        self._interest_history = {}  # {client: {sequence: set of keys the client was interested in}}
+        self._next_sequence = 0
+
+    def add_client(self, client):
+        self._acks[client] = -1
+        self._interest_history[client] = {}
+
+    def remove_client(self, client):
+        self._acks.pop(client, None)
+        self._interest_history.pop(client, None)
+
+    def ack(self, client, sequence):
+        if client in self._acks and sequence > self._acks[client]:
+            self._acks[client] = sequence
+
+    def encode(self, data, interests=None):
+        """
+        Add the snapshot data to the history and compute the deltas for all clients.
+        Return the sequence number of the snapshot and the list of tuples (baseline, delta data, clients). Clients with
+        the same baseline share the same delta.
+
+        If interests is given, the clients in it only get the records of the bodies they are interested in. A body that
+        was not of interest in the baseline is sent completely, because the client may have missed its changes.
+
+        :param data: snapshot data
+        :param interests: None or a dictionary {client: set of body keys (kind, id)} (see the interest module)
+        """
+        if interests is None:
+            interests = {}
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        deltas = []
+        current_records = records(data)
+        current = {}
+        for r in current_records:
+            current[(r[0], r[1])] = quantize(r)
+
+        # Group the clients by their baseline. Clients with interests get their own delta.
+        baselines = {}
+        for client, baseline in self._acks.iteritems():
+            if baseline not in self._history:
+                baseline = -1
+            if client in interests:
+                deltas.append((baseline, self._interest_delta(client, sequence, baseline, current_records, current,
+                                                              interests[client]), [client]))
+            else:
+                if baseline in self._interest_history[client]:
+                    # The client only got some of the bodies in the baseline.
+                    baseline = -1
+                self._interest_history[client].clear()
+                baselines.setdefault(baseline, []).append(client)
+
+        for baseline, clients in baselines.iteritems():
+            if baseline == -1:
+                deltas.append((baseline, data, clients))
+                continue
+            previous = self._history[baseline]
+            delta = []
+            for r in current_records:
+                key = (r[0], r[1])
+                if previous.get(key) != current[key]:
+                    delta.extend(r)
+            for key in previous:
+                if key not in current:
+                    delta.extend(removal_record(key))
+            deltas.append((baseline, delta, clients))
+
+        self._history[sequence] = current
+        while len(self._history) > self._history_size:
+            self._history.popitem(last=False)
+        return sequence, deltas
+
+    def _interest_delta(self, client, sequence, baseline, current_records, current, keys):
+        """Return the delta for a client that is only interested in the bodies with the given keys.
+        """
+        interest_history = self._interest_history[client]
+        if baseline == -1:
+            previous = {}
+            previous_keys = ()
+        else:
+            previous = self._history[baseline]
+            previous_keys = interest_history.get(baseline, ())
+        delta = []
+        sent_keys = set()
+        for r in current_records:
+            key = (r[0], r[1])
+            if key in keys:
+                sent_keys.add(key)
+                if key not in previous_keys or previous.get(key) != current[key]:
+                    delta.extend(r)
+        for key in previous_keys:
+            if key not in sent_keys and key in previous:
+                delta.extend(removal_record(key))
+        interest_history[sequence] = sent_keys
+        for s in [s for s in interest_history if s <= sequence - self._history_size]:
+            del interest_history[s]
+        return delta
+
+
+class DeltaDecoder(object):
+    """
+    Reconstructs the full snapshots from the delta snapshots on the client.
+    Keeps the states of the last history_size snapshots, so the server may use any of them as baseline.
+    """
+
+    def __init__(self, history_size=32):
+        assert history_size > 0
+        self._history_size = history_size
+        self._history = collections.OrderedDict()  # {sequence: {(kind, id): record}}
+
+    def decode(self, sequence, baseline, data):
+        """
+        Return the full snapshot data with the given sequence number. Return None if the baseline snapshot is unknown.
+        The bodies of removal records are removed from the state.
+        """
+        if baseline == -1:
+            state = {}
+        elif baseline in self._history:
+            state = dict(self._history[baseline])
+        else:
+            return None
+        for r in records(data):
+            if r[8] == REMOVED:
+                state.pop((r[0], r[1]), None)
+            else:
+                state[(r[0], r[1])] = r
+        self._history[sequence] = state
+        while len(self._history) > self._history_size:
+            self._history.popitem(last=False)
+        full = []
+        for r in state.itervalues():
+            full.extend(r)
+        return full
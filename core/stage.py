@@ -4,17 +4,33 @@ import Box2D
 import events
 import IPython
 import math
+import collections
+import profiling
+import snapshot
 
 
 class StageModel(object):
     """
     The stage model.
+
+    If physics_rate is None, the world makes one step with the elapsed time of each tick. Otherwise, the world makes
+    steps of the fixed size 1/physics_rate: The elapsed tick times are accumulated and as many steps as fit into the
+    accumulated time are made, but at most max_substeps per tick (the remaining time is dropped). The fraction of a step
+    that remains in the accumulator is available as interpolation_alpha, so views can interpolate between the previous
+    and the current body transforms.
     """
 
-    def __init__(self, ev_manager, ignore_model_broadcasts=False):
+    def __init__(self, ev_manager, ignore_model_broadcasts=False, max_prediction_frames=120, physics_rate=None,
+                 max_substeps=5):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._id = self._ev_manager.register_listener(self, [events.InitEvent, events.ModelMetaBroadcast,
+                                                             events.TickEvent, events.CharacterMoveLeftRequest,
+                                                             events.CharacterMoveRightRequest,
+                                                             events.CharacterJumpRequest, events.CharacterInputState,
+                                                             events.ModelBroadcastRequest,
+                                                             events.ModelBroadcast, events.ModelDeltaBroadcast,
+                                                             events.AssignCharacter, events.AssignCharacterToClient])
         self.world = Box2D.b2World(gravity=(0, -10), doSleep=True)
         self._world_bodies = {}
         self._throwable_bodies = {}
@@ -22,9 +38,34 @@ class StageModel(object):
         self._character_names = {}
         self.colors = {}
         self._ignore_model_broadcasts = ignore_model_broadcasts
+        self._delta_decoder = snapshot.DeltaDecoder()
+        self._last_input_sequences = {}  # {character id: sequence number of the last applied input}
+        self._input_steps = {}  # {character id: number of world steps since the last applied input}
+        self._held_buttons = {}  # {character id: bitmask of the held buttons (see CharacterInputState)}
+
+        # Client-side prediction: The inputs for the local character are applied immediately. Each world step is
+        # recorded as a prediction frame, so the frames the server has not simulated yet can be replayed on top of an
+        # authoritative snapshot. A frame is tagged with the sequence number of the last input applied before its step.
+        self._local_character_id = None
+        self._pending_inputs = []  # inputs that were applied since the last world step
+        self._last_input_sequence = 0  # sequence number of the last input for the local character
+        # [(sequence, inputs, held buttons, step time)]
+        self._prediction_frames = collections.deque(maxlen=max_prediction_frames)
         self._meta = None
         self._created_level = False
 
+        # Fixed timestep.
+        assert physics_rate is None or physics_rate > 0
+        assert max_substeps > 0
+        if physics_rate is None:
+            self._fixed_step_time = None
+        else:
+            self._fixed_step_time = 1.0 / physics_rate
+        self._max_substeps = max_substeps
+        self._accumulator = 0.0
+        self.interpolation_alpha = 1.0
+        self.previous_transforms = {}  # {user data: (x, y, angle)} of the dynamic bodies before the last step
+
     def _clear_level(self):
         for i in self._world_bodies:
             self.world.DestroyBody(self._world_bodies[i])
@@ -75,6 +116,141 @@ class StageModel(object):
         self._character_bodies[character_id] = body
         self._character_names[character_id] = character_name
 
+    def _body_tables(self):
+        return {snapshot.WORLD: self._world_bodies,
+                snapshot.CHARACTER: self._character_bodies,
+                snapshot.THROWABLE: self._throwable_bodies}
+
+    def create_snapshot(self):
+        """
+        Return the snapshot data (see the snapshot module) with the state of all bodies. Static bodies are part of the
+        level and are not contained in the snapshot.
+        """
+        data = []
+        for kind, bodies in self._body_tables().iteritems():
+            for i, body in bodies.iteritems():
+                if body.type != Box2D.b2_staticBody:
+                    input_sequence = 0
+                    input_steps = 0
+                    if kind == snapshot.CHARACTER:
+                        input_sequence = self._last_input_sequences.get(i, 0)
+                        input_steps = min(self._input_steps.get(i, 0), snapshot.MAX_INPUT_STEPS)
+                    snapshot.append_body(data, kind, i, body, input_sequence, input_steps)
+        return data
+
+    def apply_snapshot(self, data):
+        """
+        Set the state of all bodies that are contained in the given snapshot data. Then replay the predicted inputs of
+        the local character that are not yet contained in the snapshot.
+        """
+        tables = self._body_tables()
+        acked = None
+        for kind, i, x, y, angle, vx, vy, omega, awake, input_sequence, input_steps in snapshot.records(data):
+            body = tables[int(kind)].get(int(i))
+            if body is None:
+                continue
+            body.transform = ((x, y), angle)
+            body.linearVelocity = (vx, vy)
+            body.angularVelocity = omega
+            body.awake = awake != 0
+            if kind == snapshot.CHARACTER and int(i) == self._local_character_id:
+                acked = (int(input_sequence), int(input_steps))
+        if acked is not None:
+            self._reconcile(*acked)
+
+    def _reconcile(self, acked_sequence, acked_steps):
+        """
+        Drop the prediction frames the server has already simulated and replay the remaining ones. The server has
+        simulated the frames before the input with the acked sequence number and acked_steps frames from that input on.
+        The inputs the server has applied are not applied again.
+        """
+        while len(self._prediction_frames) > 0 and self._prediction_frames[0][0] < acked_sequence:
+            self._prediction_frames.popleft()
+        while acked_steps > 0 and len(self._prediction_frames) > 0 and \
+                self._prediction_frames[0][0] == acked_sequence:
+            self._prediction_frames.popleft()
+            acked_steps -= 1
+        for sequence, inputs, buttons, elapsed_time in self._prediction_frames:
+            for ev in inputs:
+                if ev.sequence > acked_sequence:
+                    self._apply_input(ev)
+            self._move_character(self._local_character_id, buttons)
+            with profiling.section(self._ev_manager.profiler, "physics.replay_step"):
+                self.world.Step(elapsed_time, 10, 10)
+        for ev in self._pending_inputs:
+            self._apply_input(ev)
+
+    def _advance(self, elapsed_time):
+        """Advance the world by the given time, either in one step or in fixed steps.
+        """
+        if self._fixed_step_time is None:
+            self._step(elapsed_time)
+            return
+
+        dt = self._fixed_step_time
+        self._accumulator += elapsed_time
+        num_steps = 0
+        while self._accumulator >= dt and num_steps < self._max_substeps:
+            self.previous_transforms = {}
+            for body in self.world.bodies:
+                if body.type != Box2D.b2_staticBody and body.awake:
+                    position = body.position
+                    self.previous_transforms[body.userData] = (position[0], position[1], body.angle)
+            self._step(dt)
+            self._accumulator -= dt
+            num_steps += 1
+        if self._accumulator >= dt:
+            # Too many steps were needed: Drop the remaining time instead of falling further behind.
+            self._accumulator %= dt
+        self.interpolation_alpha = self._accumulator / dt
+
+    def _step(self, elapsed_time):
+        if self._local_character_id is not None and not self._ignore_model_broadcasts:
+            buttons = self._held_buttons.get(self._local_character_id, 0)
+            self._prediction_frames.append((self._last_input_sequence, self._pending_inputs, buttons, elapsed_time))
+        self._pending_inputs = []
+        for character_id, buttons in self._held_buttons.iteritems():
+            self._move_character(character_id, buttons)
+        with profiling.section(self._ev_manager.profiler, "physics.step"):
+            self.world.Step(elapsed_time, 10, 10)
+        # TODO: Maybe replace the number of iterations (here: 10) by a more meaningful value.
+        if self._ignore_model_broadcasts:
+            for character_id in self._character_bodies:
+                self._input_steps[character_id] = self._input_steps.get(character_id, 0) + 1
+
+    def _move_character(self, character_id, buttons):
+        """Apply the movement of the given held buttons (see CharacterInputState) to the character body.
+        """
+        body = self._character_bodies.get(character_id)
+        if body is None:
+            return
+        direction = 0
+        if buttons & events.CharacterInputState.LEFT:
+            direction -= 1
+        if buttons & events.CharacterInputState.RIGHT:
+            direction += 1
+        if direction != 0:
+            body.ApplyLinearImpulse((0.2 * direction, 0), body.worldCenter, True)
+            MAX_VELO = 2.7
+            if abs(body.linearVelocity[0]) > MAX_VELO:
+                body.linearVelocity[0] = math.copysign(MAX_VELO, body.linearVelocity[0])
+            # TODO: Improve the movement.
+
+    def _apply_input(self, event):
+        """Apply the given character request to the character body.
+        """
+        if isinstance(event, events.CharacterMoveLeftRequest):
+            self._move_character(event.character_id, events.CharacterInputState.LEFT)
+        elif isinstance(event, events.CharacterMoveRightRequest):
+            self._move_character(event.character_id, events.CharacterInputState.RIGHT)
+        elif isinstance(event, events.CharacterInputState):
+            self._held_buttons[event.character_id] = event.buttons
+        elif isinstance(event, events.CharacterJumpRequest):
+            character_id = event.character_id
+            body = self._character_bodies[character_id]
+            body.ApplyLinearImpulse((0, 5), body.worldCenter, True)
+            # # TODO: Let the character jump, but only when he touches the ground.
+
     def notify(self, event):
         if isinstance(event, events.InitEvent):
             self._ev_manager.post(events.ModelMetaBroadcastRequest())
@@ -92,59 +268,72 @@ class StageModel(object):
                     self._create_character(i, name)
                 self._ev_manager.post(events.ModelBroadcastRequest())
         elif isinstance(event, events.TickEvent):
-            elapsed_time = event.elapsed_time
-            self.world.Step(elapsed_time, 10, 10)
-            # TODO: Maybe replace the number of iterations (here: 10) by a more meaningful value.
-        elif isinstance(event, events.CharacterMoveLeftRequest):
-            character_id = event.character_id
-            body = self._character_bodies[character_id]
-            body.ApplyLinearImpulse((-0.2, 0), body.worldCenter, True)
-            MAX_VELO = 2.7
-            if abs(body.linearVelocity[0]) > MAX_VELO:
-                body.linearVelocity[0] = math.copysign(MAX_VELO, body.linearVelocity[0])
-            # TODO: Improve the movement.
-        elif isinstance(event, events.CharacterMoveRightRequest):
-            character_id = event.character_id
-            body = self._character_bodies[character_id]
-            body.ApplyLinearImpulse((0.2, 0), body.worldCenter, True)
-            MAX_VELO = 2.7
-            if abs(body.linearVelocity[0]) > MAX_VELO:
-                body.linearVelocity[0] = math.copysign(MAX_VELO, body.linearVelocity[0])
-            # TODO: Improve the movement
-        elif isinstance(event, events.CharacterJumpRequest):
-            character_id = event.character_id
-            body = self._character_bodies[character_id]
-            body.ApplyLinearImpulse((0, 5), body.worldCenter, True)
-            # # TODO: Let the character jump, but only when he touches the ground.
+            self._advance(event.elapsed_time)
+        elif isinstance(event, events.AssignCharacter):
+            self._local_character_id = event.character_id
+        elif isinstance(event, events.AssignCharacterToClient):
+            # The character gets a new controller: Forget the held buttons and the input sequence of the old one.
+            self._held_buttons.pop(event.character_id, None)
+            self._last_input_sequences.pop(event.character_id, None)
+            self._input_steps.pop(event.character_id, None)
+        elif isinstance(event, events.CharacterMoveLeftRequest) or \
+                isinstance(event, events.CharacterMoveRightRequest) or \
+                isinstance(event, events.CharacterJumpRequest) or \
+                isinstance(event, events.CharacterInputState):
+            if isinstance(event, events.CharacterInputState) and self._ignore_model_broadcasts and \
+                    0 < event.sequence < self._last_input_sequences.get(event.character_id, 0):
+                # The state was superseded by a newer input (e. g. a resent state that arrived late).
+                return
+            self._apply_input(event)
+            if event.sequence > 0:
+                if self._ignore_model_broadcasts:
+                    self._last_input_sequences[event.character_id] = event.sequence
+                    self._input_steps[event.character_id] = 0
+                elif event.character_id == self._local_character_id:
+                    self._last_input_sequence = event.sequence
+                    self._pending_inputs.append(event)
         elif isinstance(event, events.ModelBroadcastRequest):
-            data = {}
-            self._ev_manager.post(events.ModelBroadcast(data))
-            # TODO: Create an event that can be sent to update the model.
-            pass
+            # Only the authoritative model (the one that ignores model broadcasts) answers the request.
+            if self._ignore_model_broadcasts:
+                self._ev_manager.post(events.ModelBroadcast(self.create_snapshot()))
         elif isinstance(event, events.ModelBroadcast) and not self._ignore_model_broadcasts:
-            # TODO: Update the model.
-            pass
+            self.apply_snapshot(event.data)
+            self._ev_manager.post(events.ModelSnapshotApplied(event.data))
+        elif isinstance(event, events.ModelDeltaBroadcast) and not self._ignore_model_broadcasts:
+            data = self._delta_decoder.decode(event.sequence, event.baseline, event.data)
+            if data is not None:
+                self.apply_snapshot(data)
+                self._ev_manager.post(events.ModelBroadcastAck(event.sequence))
+                self._ev_manager.post(events.ModelSnapshotApplied(data))
 
 
 class StageStateController(object):
     """
-    This controller sends meta information about the current stage.
+    This controller sends meta information about the current stage and assigns the characters to the players.
+    If local_player is True, the first character is controlled locally. Each accepted client gets one of the remaining
+    characters. The character of a removed client is given to the next accepted client.
     """
 
-    def __init__(self, ev_manager):
+    def __init__(self, ev_manager, local_player=True):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._id = self._ev_manager.register_listener(self, [events.InitEvent, events.ModelMetaBroadcastRequest,
+                                                             events.ClientAccepted, events.ClientRemoved])
         self._current_level = None
         self._character_names = []
-        self._character_controllers = [0]  # the server always controls the first character
+        self._local_player = local_player
+        if local_player:
+            self._character_controllers = [0]  # the server controls the first character
+        else:
+            self._character_controllers = []
 
     def notify(self, event):
         if isinstance(event, events.InitEvent):
             # TODO: Somehow get the current level.
             self._current_level = "Level 1"
             self._character_names = ["char0", "char1"]
-            self._ev_manager.post(events.AssignCharacter(0))
+            if self._local_player:
+                self._ev_manager.post(events.AssignCharacter(0))
         elif isinstance(event, events.ModelMetaBroadcastRequest):
             if self._current_level is None:
                 raise Exception("A ModelMetaBroadcastRequest came before the InitEvent.")
@@ -152,21 +341,42 @@ class StageStateController(object):
                     "character_names": self._character_names}
             self._ev_manager.post(events.ModelMetaBroadcast(data))
         elif isinstance(event, events.ClientAccepted):
-            for i in xrange(len(self._character_controllers), len(self._character_names)):
+            if None in self._character_controllers:
+                i = self._character_controllers.index(None)
+                self._character_controllers[i] = event.client_name
+            else:
+                i = len(self._character_controllers)
+                if i >= len(self._character_names):
+                    return
                 self._character_controllers.append(event.client_name)
-                self._ev_manager.post(events.AssignCharacterToClient(event.client_name, i))
+            self._ev_manager.post(events.AssignCharacterToClient(event.client_name, i))
+        elif isinstance(event, events.ClientRemoved):
+            if event.client_name in self._character_controllers:
+                i = self._character_controllers.index(event.client_name)
+                self._character_controllers[i] = None
+                # Release the buttons the client held, so the character does not keep running.
+                self._ev_manager.post(events.CharacterInputState(i, 0))
+
+    def num_client_characters(self):
+        """Return the number of characters that can be assigned to clients.
+        """
+        if self._local_player:
+            return len(self._character_names) - 1
+        return len(self._character_names)
 
 
 class StageStateClientController(object):
     """
-    This controller takes meta information requests and sends them over the network.
+    This controller takes meta information and model state requests and model broadcast acknowledgements and sends them
+    over the network.
     """
 
     def __init__(self, ev_manager):
         assert isinstance(ev_manager, events.NetworkEventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._forward_events = [events.ModelMetaBroadcastRequest, events.ModelBroadcastRequest, events.ModelBroadcastAck]
+        self._id = self._ev_manager.register_listener(self, self._forward_events)
 
     def notify(self, event):
-        if isinstance(event, events.ModelMetaBroadcastRequest):
-            self._ev_manager.post(event)
+        # The listener is only registered for the events that are forwarded.
+        self._ev_manager.post(event)
@@ -6,14 +6,20 @@ import pygame
 class StageIOController(object):
     """
     Take Pygame events (mouse, keyboard and quit events) and send requests to control a stage model.
+    The held movement keys are sent as CharacterInputState when they change. The state is sent again every
+    input_resend_interval seconds, in case it was lost.
     """
 
-    def __init__(self, ev_manager, character_index=None):
+    def __init__(self, ev_manager, character_index=None, input_resend_interval=0.25):
         assert isinstance(ev_manager, events.EventManager)
         self._ev_manager = ev_manager
-        self._id = self._ev_manager.register_listener(self)
+        self._id = self._ev_manager.register_listener(self, [events.InitEvent, events.AssignCharacter,
+                                                             events.TickEvent])
         self._character_index = character_index
         self._character_id = None
+        self._buttons = 0
+        self._input_resend_interval = input_resend_interval
+        self._last_input_state = 0  # elapsed time since the input state was sent
 
     def notify(self, event):
         if isinstance(event, events.InitEvent):
@@ -37,7 +43,13 @@ class StageIOController(object):
             # Handle key pressed events.
             if self._character_id is not None:
                 pressed = pygame.key.get_pressed()
+                buttons = 0
                 if pressed[pygame.K_a]:
-                    self._ev_manager.post(events.CharacterMoveLeftRequest(self._character_id))
+                    buttons |= events.CharacterInputState.LEFT
                 if pressed[pygame.K_d]:
-                    self._ev_manager.post(events.CharacterMoveRightRequest(self._character_id))
+                    buttons |= events.CharacterInputState.RIGHT
+                self._last_input_state += event.elapsed_time
+                if buttons != self._buttons or self._last_input_state >= self._input_resend_interval:
+                    self._buttons = buttons
+                    self._last_input_state = 0
+                    self._ev_manager.post(events.CharacterInputState(self._character_id, buttons))
@@ -4,17 +4,169 @@ import Box2D
 import IPython
 import pygame_view
 import stage
+import snapshot
+import profiling
+import collections
+import numpy
+
+
+class InterpolationBuffer(object):
+    """
+    Keeps the last snapshots together with their arrival time and returns the body transforms at a given time.
+    Between two snapshots, position and angle are interpolated linearly. After the newest snapshot, the transforms are
+    extrapolated with the body velocities, but for at most max_extrapolation seconds.
+    """
+
+    def __init__(self, max_extrapolation=0.25, size=32):
+        self._max_extrapolation = max_extrapolation
+        self._snapshots = collections.deque(maxlen=size)  # [(time, {user data: (x, y, angle, vx, vy, omega)})]
+
+    def add(self, time, data):
+        """Add the snapshot data (see the snapshot module) that arrived at the given time.
+        """
+        states = {}
+        for kind, i, x, y, angle, vx, vy, omega, awake, input_sequence, input_steps in snapshot.records(data):
+            states[(snapshot.KIND_NAMES[int(kind)], int(i))] = (x, y, angle, vx, vy, omega)
+        self._snapshots.append((time, states))
+
+    def sample(self, time):
+        """Return the dict {user data: (x, y, angle)} with the body transforms at the given time.
+        """
+        if len(self._snapshots) == 0:
+            return {}
+
+        # Find the last snapshot that is not newer than the given time.
+        i = len(self._snapshots) - 1
+        while i > 0 and self._snapshots[i][0] > time:
+            i -= 1
+        t0, states0 = self._snapshots[i]
+
+        transforms = {}
+        if i + 1 < len(self._snapshots) and time >= t0:
+            # Interpolate between the surrounding snapshots.
+            t1, states1 = self._snapshots[i + 1]
+            alpha = (time - t0) / (t1 - t0) if t1 > t0 else 1.0
+            for key, (x0, y0, a0, vx0, vy0, w0) in states0.iteritems():
+                s1 = states1.get(key)
+                if s1 is None:
+                    transforms[key] = (x0, y0, a0)
+                else:
+                    x1, y1, a1 = s1[0], s1[1], s1[2]
+                    transforms[key] = (x0 + alpha * (x1 - x0), y0 + alpha * (y1 - y0), a0 + alpha * (a1 - a0))
+        else:
+            # Extrapolate the newest snapshot (or hold the oldest one if the time is before all snapshots).
+            dt = min(max(time - t0, 0.0), self._max_extrapolation)
+            for key, (x, y, a, vx, vy, w) in states0.iteritems():
+                transforms[key] = (x + dt * vx, y + dt * vy, a + dt * w)
+        return transforms
+
+
+class PolygonCache(object):
+    """
+    Keeps the polygon vertices of the bodies of a world in screen units and transforms them with NumPy.
+    The local vertices of all fixtures are scaled to screen units once. In each frame, the vertices of all bodies are
+    transformed in one vectorized operation, but only the vertices of the bodies whose transform changed since the
+    last frame (e. g. not the static and sleeping bodies) are recomputed.
+    """
+
+    def __init__(self, scale, screen_size):
+        """
+        :param scale: screen pixels per game unit
+        :param screen_size: size of the screen, the screen y axis points down
+        """
+        self._scale = float(scale)
+        self.screen_size = screen_size
+        self._keys = None  # user data of the cached bodies
+        self._polygons = []  # [(user data, index of the first vertex, index after the last vertex)]
+        self._local = None  # local vertices in screen units, shape (number of vertices, 2)
+        self._body_indices = None  # the index of the body of each vertex
+        self._transforms = None  # the body transforms of the screen vertices, shape (number of bodies, 3)
+        self._screen = None  # screen vertices, shape (number of vertices, 2)
+
+    def _build(self, bodies):
+        local = []
+        body_indices = []
+        self._polygons = []
+        for i, body in enumerate(bodies):
+            for fixture in body.fixtures:
+                # TODO: This works for polygon shapes only. Change this.
+                vertices = fixture.shape.vertices
+                self._polygons.append((body.userData, len(local), len(local) + len(vertices)))
+                local.extend(vertices)
+                body_indices.extend([i] * len(vertices))
+        self._local = numpy.array(local, dtype=float).reshape(-1, 2) * self._scale
+        self._body_indices = numpy.array(body_indices, dtype=int)
+        self._transforms = None
+        self._screen = numpy.zeros((len(local), 2), dtype=int)
+
+    def update(self, bodies, transforms):
+        """
+        Return the list of polygons (user data, list of screen vertices) of the bodies with the given transforms.
+        The cache is rebuilt if the bodies changed.
+
+        :param bodies: the bodies of the world
+        :param transforms: list with the transform (x, y, angle) of each body in game units
+        """
+        keys = [body.userData for body in bodies]
+        if keys != self._keys:
+            self._keys = keys
+            self._build(bodies)
+        transforms = numpy.array(transforms, dtype=float).reshape(-1, 3)
+        if self._transforms is None:
+            changed = numpy.ones(len(transforms), dtype=bool)
+        else:
+            changed = (transforms != self._transforms).any(axis=1)
+        self._transforms = transforms
+        if changed.any():
+            mask = changed[self._body_indices]
+            t = transforms[self._body_indices[mask]]
+            local = self._local[mask]
+            c = numpy.cos(t[:, 2])
+            s = numpy.sin(t[:, 2])
+            x = c * local[:, 0] - s * local[:, 1] + t[:, 0] * self._scale
+            y = s * local[:, 0] + c * local[:, 1] + t[:, 1] * self._scale
+            # Truncate like PygameView.to_screen_x and flip the y axis.
+            self._screen[mask, 0] = x.astype(int)
+            self._screen[mask, 1] = self.screen_size[1] - y.astype(int)
+        screen = self._screen.tolist()
+        return [(user_data, screen[start:end]) for user_data, start, end in self._polygons]
 
 
 class StagePygameView(pygame_view.PygameView):
     """
     Show a stage model using a Pygame window.
+    The remote bodies (all bodies that are updated by snapshots, except the local character) are rendered with the
+    given interpolation delay, so they move smoothly even if the snapshots arrive less often than the frames are drawn.
+    The other bodies are interpolated between their previous and current transform with the interpolation alpha of the
+    stage model (only if the model uses fixed steps).
+    The static bodies (the level) are rendered once into a background surface. In each frame, only the dynamic bodies
+    are drawn and only the areas they cover now or covered in the last frame are restored and updated on the display.
     """
 
-    def __init__(self, ev_manager, stage_model):
-        super(StagePygameView, self).__init__(ev_manager)
+    def __init__(self, ev_manager, stage_model, interpolation_delay=0.1, max_extrapolation=0.25):
+        super(StagePygameView, self).__init__(ev_manager, [events.TickEvent, events.ModelSnapshotApplied,
+                                                           events.AssignCharacter])
         assert isinstance(stage_model, stage.StageModel)
         self._stage_model = stage_model
+        self._interpolation_delay = interpolation_delay
+        self._interpolation_buffer = InterpolationBuffer(max_extrapolation=max_extrapolation)
+        self._time = 0.0  # the sum of the elapsed tick times
+        self._local_character = None  # user data of the local character
+        self._polygon_cache = None
+        self._background = None  # the static bodies rendered on the cleared screen
+        self._background_key = None  # the screen size and the user data of the static bodies of the background
+        self._dirty_rects = []  # the screen areas of the dynamic bodies in the last frame
+
+    def _render_background(self, static_bodies, screen_size):
+        """Render the static bodies into a new background surface with the size and format of the screen.
+        """
+        self._background = self._screen.copy()  # a copy has the pixel format of the screen
+        self._background.fill((0, 0, 0, 0))  # TODO: Use the stage background image instead.
+        colors = self._stage_model.colors
+        transforms = [(body.position[0], body.position[1], body.angle) for body in static_bodies]
+        polygon_cache = PolygonCache(screen_size[0] / 10.0, screen_size)
+        for user_data, vertices in polygon_cache.update(static_bodies, transforms):
+            pygame.draw.polygon(self._background, colors[user_data], vertices)
 
     def to_game_y(self, y):
         return self.to_game_x(y)
@@ -24,17 +176,59 @@ class StagePygameView(pygame_view.PygameView):
 
     def notify(self, event):
         if isinstance(event, events.TickEvent):
+            self._time += event.elapsed_time
+            remote_transforms = self._interpolation_buffer.sample(self._time - self._interpolation_delay)
+            previous_transforms = self._stage_model.previous_transforms
+            alpha = self._stage_model.interpolation_alpha
             world = self._stage_model.world
             colors = self._stage_model.colors
-            self._screen.fill((0, 0, 0, 0))  # TODO: Use the stage background image instead.
-            for body in world.bodies:
-                for fixture in body.fixtures:
-                    shape = fixture.shape
-
-                    # TODO: This works for polygon shapes only. Change this.
-                    vertices = [(body.transform*v) for v in shape.vertices]
-                    vertices = [self.to_screen_xy(v[0], v[1]) for v in vertices]
-                    vertices = [(v[0], self._screen.get_height() - v[1]) for v in vertices]
-                    pygame.draw.polygon(self._screen, colors[body.userData], vertices)
-
-            pygame.display.flip()
+            with profiling.section(self._ev_manager.profiler, "render.draw"):
+                bodies = []
+                static_bodies = []
+                transforms = []
+                for body in world.bodies:
+                    if body.type == Box2D.b2_staticBody:
+                        static_bodies.append(body)
+                    elif body.userData in remote_transforms and body.userData != self._local_character:
+                        bodies.append(body)
+                        transforms.append(remote_transforms[body.userData])
+                    else:
+                        bodies.append(body)
+                        position = body.position
+                        x, y, angle = position[0], position[1], body.angle
+                        if body.userData in previous_transforms:
+                            x0, y0, angle0 = previous_transforms[body.userData]
+                            x = x0 + alpha * (x - x0)
+                            y = y0 + alpha * (y - y0)
+                            angle = angle0 + alpha * (angle - angle0)
+                        transforms.append((x, y, angle))
+
+                # Restore the background (completely if it changed, otherwise the areas of the last frame).
+                width, height = self._screen.get_size()
+                background_key = ((width, height), [body.userData for body in static_bodies])
+                if self._background is None or self._background_key != background_key:
+                    self._background_key = background_key
+                    self._render_background(static_bodies, (width, height))
+                    self._screen.blit(self._background, (0, 0))
+                    dirty_rects = None
+                else:
+                    for rect in self._dirty_rects:
+                        self._screen.blit(self._background, rect, rect)
+                    dirty_rects = self._dirty_rects
+
+                if self._polygon_cache is None or self._polygon_cache.screen_size != (width, height):
+                    # The y axis uses the scale of the x axis (see to_screen_y).
+                    self._polygon_cache = PolygonCache(width / 10.0, (width, height))
+                self._dirty_rects = []
+                for user_data, vertices in self._polygon_cache.update(bodies, transforms):
+                    self._dirty_rects.append(pygame.draw.polygon(self._screen, colors[user_data], vertices))
+
+            with profiling.section(self._ev_manager.profiler, "render.present"):
+                if dirty_rects is None:
+                    pygame.display.flip()
+                else:
+                    pygame.display.update(dirty_rects + self._dirty_rects)
+        elif isinstance(event, events.ModelSnapshotApplied):
+            self._interpolation_buffer.add(self._time, event.data)
+        elif isinstance(event, events.AssignCharacter):
+            self._local_character = ("character", event.character_id)
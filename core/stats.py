@@ -0,0 +1,23 @@
+"""
+Summary statistics of measured times.
+"""
+import math
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0 <= p <= 100) of the values, using the nearest rank. Return None if empty.
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(values):
+    """Return a dictionary with the count, mean, percentiles and maximum of the values.
+    """
+    if len(values) == 0:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": percentile(values, 50),
+            "p90": percentile(values, 90), "p99": percentile(values, 99), "max": max(values)}
@@ -0,0 +1,152 @@
+"""
+Unit tests of the network condition simulator. Run them from the core directory:
+
+    python -m unittest test_netsim
+"""
+import socket
+import time
+import unittest
+import netsim
+
+
+def _losses(link, n=100):
+    """Return the indices of the datagrams of n that the link loses.
+    """
+    return [i for i in xrange(n) if link.schedule(10, 0.0) is None]
+
+
+class SimulatedLinkTest(unittest.TestCase):
+
+    def test_latency_and_bandwidth(self):
+        link = netsim.SimulatedLink(netsim.LinkConditions(latency=0.1, bandwidth=1000), ordered=True)
+        self.assertAlmostEqual(link.schedule(100, 0.0), 0.2)
+        # The second chunk waits until the first one is transmitted.
+        self.assertAlmostEqual(link.schedule(100, 0.0), 0.3)
+
+    def test_same_seed_is_reproducible(self):
+        conditions = netsim.LinkConditions(loss=0.3, jitter=0.05)
+        self.assertEqual(_losses(netsim.SimulatedLink(conditions, False, seed=7)),
+                         _losses(netsim.SimulatedLink(conditions, False, seed=7)))
+
+    def test_links_of_a_simulator_are_not_correlated(self):
+        conditions = netsim.LinkConditions(loss=0.3)
+        simulator = netsim.NetworkSimulator("localhost", 1, upstream=conditions, downstream=conditions,
+                                            protocol="udp", seed=7)
+        try:
+            losses = [_losses(simulator._new_link(direction)) for direction in ("upstream", "downstream", "upstream")]
+        finally:
+            simulator.stop()
+        self.assertNotEqual(losses[0], losses[1])
+        self.assertNotEqual(losses[0], losses[2])
+        for lost in losses:
+            self.assertTrue(10 < len(lost) < 50)
+
+        # The same simulator seed gives the same links.
+        simulator = netsim.NetworkSimulator("localhost", 1, upstream=conditions, downstream=conditions,
+                                            protocol="udp", seed=7)
+        try:
+            self.assertEqual(_losses(simulator._new_link("upstream")), losses[0])
+        finally:
+            simulator.stop()
+
+
+def _listen_tcp():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind((socket.gethostname(), 0))
+    listener.listen(5)
+    return listener
+
+
+def _connect(simulator, target):
+    """Connect a client through the simulator and return the client socket and the accepted target socket.
+    """
+    client = socket.create_connection((socket.gethostname(), simulator.port))
+    target.settimeout(2.0)
+    server, addr = target.accept()
+    client.settimeout(2.0)
+    server.settimeout(2.0)
+    return client, server
+
+
+class NetworkSimulatorTest(unittest.TestCase):
+    """Sends data through a simulator on the loopback interface.
+    """
+
+    def test_tcp_latency(self):
+        target = _listen_tcp()
+        simulator = netsim.NetworkSimulator(socket.gethostname(), target.getsockname()[1],
+                                            upstream=netsim.LinkConditions(latency=0.2))
+        simulator.start()
+        try:
+            client, server = _connect(simulator, target)
+            start = time.time()
+            client.sendall("ping")
+            self.assertEqual(server.recv(16), "ping")
+            self.assertTrue(0.2 <= time.time() - start < 1.0)
+            client.close()
+            server.close()
+        finally:
+            simulator.stop()
+            target.close()
+
+    def test_slow_reader_does_not_delay_other_connections(self):
+        target = _listen_tcp()
+        simulator = netsim.NetworkSimulator(socket.gethostname(), target.getsockname()[1])
+        simulator.start()
+        try:
+            slow_client, slow_server = _connect(simulator, target)
+            client, server = _connect(simulator, target)
+            # The slow client does not read, so the proxy cannot write all of this data.
+            slow_server.setblocking(0)
+            sent = 0
+            deadline = time.time() + 2.0
+            while sent < 16 * 1024 * 1024 and time.time() < deadline:
+                try:
+                    sent += slow_server.send("x" * 65536)
+                except socket.error:
+                    time.sleep(0.01)
+            server.sendall("pong")
+            start = time.time()
+            self.assertEqual(client.recv(16), "pong")
+            self.assertLess(time.time() - start, 1.0)
+            for s in (slow_client, slow_server, client, server):
+                s.close()
+        finally:
+            simulator.stop()
+            target.close()
+
+    def _udp_received(self, seed, n=100):
+        """Send n datagrams through a lossy UDP simulator and return the indices of the received ones.
+        """
+        target = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        target.bind((socket.gethostname(), 0))
+        target.settimeout(0.5)
+        simulator = netsim.NetworkSimulator(socket.gethostname(), target.getsockname()[1],
+                                            upstream=netsim.LinkConditions(loss=0.3), protocol="udp", seed=seed)
+        simulator.start()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for i in xrange(n):
+                client.sendto(str(i), (socket.gethostname(), simulator.port))
+                time.sleep(0.001)
+            received = []
+            try:
+                while True:
+                    received.append(int(target.recv(64)))
+            except socket.timeout:
+                pass
+            return received
+        finally:
+            client.close()
+            simulator.stop()
+            target.close()
+
+    def test_udp_seeded_loss(self):
+        received = self._udp_received(seed=3)
+        self.assertTrue(50 < len(received) < 90)
+        self.assertEqual(self._udp_received(seed=3), received)
+        self.assertNotEqual(self._udp_received(seed=4), received)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,484 @@
+"""
+Unit tests of the network layer. Run them from the core directory:
+
+    python -m unittest test_network
+"""
+import random
+import socket
+import threading
+import time
+import unittest
+import events
+import network
+import network_controller
+import snapshot
+
+
+def _peek(queue, max_size=65536):
+    """Return the data of queue.peek() as string.
+    """
+    data = queue.peek(max_size)
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+class SendQueueTest(unittest.TestCase):
+
+    def test_consume_partial_frames(self):
+        queue = network.SendQueue()
+        queue.put("abc")
+        queue.put("defg")
+        self.assertEqual(queue.num_bytes, 7)
+        queue.consume(2)
+        self.assertEqual(_peek(queue), "cdefg")
+        queue.consume(3)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(_peek(queue), "fg")
+        queue.consume(2)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.num_bytes, 0)
+        self.assertIsNone(_peek(queue))
+
+    def test_peek_max_size(self):
+        queue = network.SendQueue()
+        for data in ("aaaa", "bbbb", "cccc"):
+            queue.put(data)
+        self.assertEqual(_peek(queue, 6), "aaaabbbb")
+        self.assertEqual(_peek(queue, 2), "aaaa")
+
+    def test_drop_oldest_snapshots(self):
+        queue = network.SendQueue(max_snapshots=1)
+        queue.put("A")
+        queue.put("S1", snapshot=True)
+        queue.put("S2", snapshot=True)
+        queue.put("B")
+        queue.put("S3", snapshot=True)
+        self.assertEqual(_peek(queue), "ABS3")
+        self.assertEqual(queue.num_bytes, 4)
+        self.assertEqual(queue.num_dropped, 2)
+
+    def test_partially_sent_snapshot_is_kept(self):
+        queue = network.SendQueue(max_snapshots=1)
+        queue.put("S1xx", snapshot=True)
+        queue.consume(2)
+        queue.put("S2", snapshot=True)
+        queue.put("S3", snapshot=True)
+        # The rest of S1 must be sent, S3 is the newest snapshot and S2 is dropped.
+        self.assertEqual(_peek(queue), "xxS3")
+        self.assertEqual(queue.num_bytes, 4)
+        self.assertEqual(queue.num_dropped, 1)
+
+    def test_put_during_peek(self):
+        queue = network.SendQueue(max_snapshots=1)
+        queue.put("A")
+        queue.put("S", snapshot=True)
+        queue.put("B")
+        data = _peek(queue)
+        self.assertEqual(data, "ASB")
+        # The peeked snapshot may be in transfer, so a new snapshot must not drop it.
+        queue.put("T", snapshot=True)
+        self.assertEqual(queue.num_dropped, 0)
+        queue.consume(len(data))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.num_bytes, 1)
+        # After the consume, T is not in transfer anymore and can be dropped.
+        queue.put("U", snapshot=True)
+        self.assertEqual(_peek(queue), "U")
+        self.assertEqual(queue.num_dropped, 1)
+
+    def test_overflow(self):
+        queue = network.SendQueue(max_bytes=4)
+        self.assertTrue(queue.put("abcd"))
+        self.assertFalse(queue.put("e"))
+        self.assertTrue(queue.overflown())
+
+
+def _sample_events():
+    """Return one instance of each event class. The numbers are exact as 32 bit floats.
+    """
+    data = [snapshot.CHARACTER, 1, 2.5, 7.0, 0.25, 1.5, -2.0, 0.125, 1, 3, 0]
+    return [events.TickEvent(0.5), events.InitEvent(), events.MenuCreatedEvent("bg.png", ["start", "quit"]),
+            events.ButtonHoverRequestedEvent("start"), events.ButtonUnhoverRequestedEvent("start"),
+            events.ButtonHoverEvent("start"), events.ButtonUnhoverEvent("start"),
+            events.ButtonPressRequestedEvent("start"), events.ButtonPressEvent("start"),
+            events.ButtonActionRequestedEvent("start"), events.ButtonActionEvent("start"),
+            events.CloseCurrentModel("stage"), events.WorldStep(1), events.AssignCharacter(1),
+            events.CharacterMoveLeftRequest(1, 17), events.CharacterMoveRightRequest(1, 18),
+            events.CharacterJumpRequest(1, 19), events.ModelBroadcastRequest(), events.ModelBroadcast(data),
+            events.ModelMetaBroadcast({"level_name": "Level 1", "character_names": ["char0", "char1"]}),
+            events.ModelMetaBroadcastRequest(), events.ClientAccepted("client"), events.ClientRemoved("client"),
+            events.AssignCharacterToClient("client", 1), events.ModelDeltaBroadcast(42, 40, data),
+            events.ModelBroadcastAck(42), events.ModelSnapshotApplied(data), events.JoinMatch(-1),
+            events.TickDoneEvent(), events.CharacterInputState(1, 3, 20), events.IdleStateEvent(True)]
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_all_event_classes_are_sampled(self):
+        self.assertEqual([ev.__class__ for ev in _sample_events()], events._event_classes)
+
+    def test_round_trips(self):
+        for codec, (encode, decode, header) in sorted(events.codecs.iteritems()):
+            for event in _sample_events():
+                decoded = decode(encode(event))
+                self.assertIs(decoded.__class__, event.__class__, (codec, event.name))
+                self.assertEqual(decoded.__dict__, event.__dict__, (codec, event.name))
+
+    def test_frames(self):
+        for codec, (encode, decode, header) in sorted(events.codecs.iteritems()):
+            frame = header.pack(encode(events.ModelBroadcastAck(7)))
+            data_start, data_len = header.unpack(frame, 0, len(frame))
+            self.assertEqual(decode(frame[data_start:data_start+data_len]).sequence, 7)
+
+    def test_incomplete_header(self):
+        for header in (network.AsciiLengthHeader(), network.BinaryLengthHeader()):
+            data = header.pack("abc")
+            self.assertIsNone(header.unpack(data, 0, 1))
+            self.assertEqual(header.unpack(data, 0, len(data)), (len(data) - 3, 3))
+
+
+class _ChunkedConnection(object):
+    """Socket replacement that returns the data in chunks of the given size from recv_into.
+    """
+
+    def __init__(self, data, chunk_size):
+        self._data = data
+        self._chunk_size = chunk_size
+
+    def recv_into(self, view):
+        n = min(self._chunk_size, len(view), len(self._data))
+        view[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+
+
+class ReceiveBufferTest(unittest.TestCase):
+
+    def _receive(self, header, data, chunk_size, size):
+        buf = network.ReceiveBuffer(header, size)
+        conn = _ChunkedConnection(data, chunk_size)
+        frames = []
+        while buf.recv_from(conn) > 0:
+            frames.extend(buf.frames())
+        return frames
+
+    def test_partial_reads(self):
+        messages = ["first", "", "x" * 100, "last"]
+        for header in (network.AsciiLengthHeader(), network.BinaryLengthHeader()):
+            data = "".join(header.pack(m) for m in messages)
+            for chunk_size in (1, 3, 7, len(data)):
+                self.assertEqual(self._receive(header, data, chunk_size, 16), messages)
+
+    def test_feed(self):
+        header = network.BinaryLengthHeader()
+        data = header.pack("y" * 50) + header.pack("z")
+        buf = network.ReceiveBuffer(header, 8)
+        frames = []
+        for i in xrange(0, len(data), 5):
+            buf.feed(data[i:i+5])
+            frames.extend(buf.frames())
+        self.assertEqual(frames, ["y" * 50, "z"])
+
+
+def _record(kind, body_id, x, y=1.0, awake=1):
+    return [kind, body_id, x, y, 0.0, 0.0, 0.0, 0.0, awake, 0, 0]
+
+
+def _states(data):
+    return {(r[0], r[1]): r for r in snapshot.records(data)}
+
+
+class DeltaSnapshotTest(unittest.TestCase):
+
+    def _snapshots(self):
+        """Return a list of full snapshots of a character and two throwables that move and sleep.
+        """
+        result = []
+        for i in xrange(10):
+            data = _record(snapshot.CHARACTER, 0, 0.5 * i)
+            data += _record(snapshot.THROWABLE, 0, 3.0, awake=0)
+            if i < 6:
+                data += _record(snapshot.THROWABLE, 1, 10.0 - i)
+            result.append(data)
+        return result
+
+    def test_decode_matches_full_snapshot(self):
+        encoder = snapshot.DeltaEncoder()
+        decoder = snapshot.DeltaDecoder()
+        encoder.add_client("c")
+        total = 0
+        for i, data in enumerate(self._snapshots()):
+            sequence, deltas = encoder.encode(data)
+            self.assertEqual(len(deltas), 1)
+            baseline, delta, clients = deltas[0]
+            total += len(delta)
+            full = decoder.decode(sequence, baseline, delta)
+            self.assertEqual(_states(full), _states(data))
+            # Lose some acknowledgements.
+            if i % 3 != 1:
+                encoder.ack("c", sequence)
+        # The sleeping body is only sent with the full snapshots.
+        self.assertLess(total, sum(len(data) for data in self._snapshots()))
+
+    def test_unknown_baseline(self):
+        decoder = snapshot.DeltaDecoder()
+        self.assertIsNone(decoder.decode(5, 4, []))
+
+    def test_interest_removal(self):
+        encoder = snapshot.DeltaEncoder()
+        decoder = snapshot.DeltaDecoder()
+        encoder.add_client("c")
+        character = (snapshot.CHARACTER, 0)
+        throwable = (snapshot.THROWABLE, 1)
+        for i, data in enumerate(self._snapshots()[:5]):
+            keys = set([character, throwable]) if i % 2 == 0 else set([character])
+            sequence, deltas = encoder.encode(data, {"c": keys})
+            baseline, delta, clients = deltas[0]
+            full = decoder.decode(sequence, baseline, delta)
+            expected = dict((key, r) for key, r in _states(data).iteritems() if key in keys)
+            self.assertEqual(_states(full), expected)
+            encoder.ack("c", sequence)
+
+
+def _exchange(sender, receiver, datagrams, now=0.0):
+    """
+    Give the datagrams of sender to receiver and the replies of receiver back to sender. Return the delivered frames.
+    """
+    frames = []
+    for datagram in datagrams:
+        kind, channel, sequence = network._udp_packet_struct.unpack_from(datagram)
+        delivered, replies = receiver.receive(kind, channel, sequence, datagram[network._udp_packet_struct.size:],
+                                              now)
+        frames.extend(delivered)
+        for reply in replies:
+            kind, channel, sequence = network._udp_packet_struct.unpack_from(reply)
+            sender.receive(kind, channel, sequence, reply[network._udp_packet_struct.size:], now)
+    return frames
+
+
+class UdpPeerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.header = network.BinaryLengthHeader()
+        self.sender = network.UdpPeer(("sender", 1), self.header, resend_timeout=0.1, max_payload=1200)
+        self.receiver = network.UdpPeer(("receiver", 2), self.header, resend_timeout=0.1, max_payload=1200)
+
+    def test_reliable_frames_arrive_complete_and_in_order(self):
+        rand = random.Random(1)
+        messages = ["m%d" % i + "x" * rand.choice((0, 10, 3000)) for i in xrange(50)]
+        for m in messages:
+            self.sender.queue(self.header.pack(m), True)
+        frames = []
+        now = 0.0
+        datagrams = self.sender.packets(now)
+        while self.sender.num_unacked_bytes > 0:
+            # Lose, duplicate and reorder the datagrams.
+            datagrams = [d for d in datagrams if rand.random() > 0.3]
+            datagrams += rand.sample(datagrams, len(datagrams) // 3)
+            rand.shuffle(datagrams)
+            frames.extend(_exchange(self.sender, self.receiver, datagrams, now))
+            now += 0.1
+            datagrams = self.sender.packets(now)
+            self.assertLess(now, 10.0)
+        self.assertEqual(frames, messages)
+
+    def test_stale_unreliable_datagrams_are_dropped(self):
+        datagrams = []
+        for i in xrange(3):
+            self.sender.queue(self.header.pack("s%d" % i), False)
+            datagrams.extend(self.sender.packets(0.0))
+        self.assertEqual(_exchange(self.sender, self.receiver, [datagrams[1]]), ["s1"])
+        self.assertEqual(_exchange(self.sender, self.receiver, [datagrams[0], datagrams[1]]), [])
+        self.assertEqual(_exchange(self.sender, self.receiver, [datagrams[2]]), ["s2"])
+
+    def test_large_unreliable_frames_are_fragmented(self):
+        frame = "y" * 5000
+        self.sender.queue(self.header.pack(frame), False)
+        datagrams = self.sender.packets(0.0)
+        self.assertEqual(len(datagrams), 5)
+        for datagram in datagrams:
+            self.assertLessEqual(len(datagram), 1200 + network._udp_packet_struct.size +
+                                 network._udp_fragment_struct.size)
+        random.Random(2).shuffle(datagrams)
+        self.assertEqual(_exchange(self.sender, self.receiver, datagrams[:-1]), [])
+        self.assertEqual(_exchange(self.sender, self.receiver, datagrams[-1:]), [frame])
+
+    def test_incomplete_fragmented_frames_are_dropped(self):
+        self.sender.queue(self.header.pack("a" * 3000), False)
+        first = self.sender.packets(0.0)
+        self.sender.queue(self.header.pack("b" * 3000), False)
+        second = self.sender.packets(0.0)
+        self.assertEqual(_exchange(self.sender, self.receiver, first[:1] + second), ["b" * 3000])
+        # The late fragments of the first frame belong to an older datagram.
+        self.assertEqual(_exchange(self.sender, self.receiver, first[1:]), [])
+
+
+class DatagramShimTest(unittest.TestCase):
+    """Drives two UdpPeers over loopback sockets through lossy DatagramShims.
+    """
+
+    def test_lossy_loopback(self):
+        header = network.BinaryLengthHeader()
+        sockets = []
+        for i in xrange(2):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            sock.setblocking(0)
+            sockets.append(sock)
+        addrs = [sock.getsockname() for sock in sockets]
+        shims = [network.DatagramShim(sockets[i], loss=0.3, latency=0.001, jitter=0.002, seed=i) for i in xrange(2)]
+        peers = [network.UdpPeer(addrs[1 - i], header, resend_timeout=0.02) for i in xrange(2)]
+        messages = ["r%d" % i + "z" * (i * 100) for i in xrange(30)]
+        for m in messages:
+            peers[0].queue(header.pack(m), True)
+        reliable = []
+        unreliable = []
+        deadline = time.time() + 5.0
+        i = 0
+        try:
+            while len(reliable) < len(messages) and time.time() < deadline:
+                i += 1
+                peers[0].queue(header.pack("u%d" % i), False)
+                now = time.time()
+                for j in xrange(2):
+                    for datagram in peers[j].packets(now):
+                        shims[j].sendto(datagram, addrs[1 - j])
+                    shims[j].poll()
+                time.sleep(0.002)
+                for j in xrange(2):
+                    while True:
+                        try:
+                            datagram = sockets[j].recv(65535)
+                        except socket.error:
+                            break
+                        kind, channel, sequence = network._udp_packet_struct.unpack_from(datagram)
+                        frames, replies = peers[j].receive(kind, channel, sequence,
+                                                           datagram[network._udp_packet_struct.size:], time.time())
+                        for reply in replies:
+                            shims[j].sendto(reply, addrs[1 - j])
+                        for frame in frames:
+                            (reliable if frame.startswith("r") else unreliable).append(frame)
+        finally:
+            for sock in sockets:
+                sock.close()
+        self.assertEqual(reliable, messages)
+        # Some unreliable frames are lost, the others arrive in increasing order.
+        numbers = [int(frame[1:]) for frame in unreliable]
+        self.assertTrue(0 < len(numbers) < i)
+        self.assertEqual(numbers, sorted(set(numbers)))
+
+
+class UdpServerClientTest(unittest.TestCase):
+
+    def test_loopback(self):
+        encode, decode, header = events.codecs["binary"]
+        server = network.UdpNetworkServer(0, decode=decode, encode=encode, header=header)
+        server.accept_clients()
+        port = server._socket.getsockname()[1]
+        clients = []
+        connector = threading.Thread(target=lambda: clients.append(
+            network.UdpNetworkClient(socket.gethostname(), port, decode=decode, encode=encode, header=header)))
+        connector.daemon = True
+        connector.start()
+        try:
+            deadline = time.time() + 5.0
+            while connector.isAlive() and time.time() < deadline:
+                server.poll()
+                time.sleep(0.001)
+            self.assertEqual(len(clients), 1)
+            new_client_names, removed_client_names = server.update_client_list()
+            self.assertEqual(len(new_client_names), 1)
+            client = clients[0]
+
+            # A snapshot of 200 bodies does not fit into one datagram payload.
+            data = [float(i % 7) for i in xrange(200 * snapshot.RECORD_SIZE)]
+            server.broadcast(events.AssignCharacter(1))
+            server.broadcast(events.ModelBroadcast(data), snapshot=True)
+            server.flush()
+            received = []
+            while len(received) < 2 and time.time() < deadline:
+                server.poll()
+                time.sleep(0.001)
+                received.extend(client.get_objects())
+            self.assertEqual([ev.__class__ for ev in received], [events.AssignCharacter, events.ModelBroadcast])
+            self.assertEqual(received[1].data, data)
+            client.close_all()
+        finally:
+            server.close_all()
+
+
+class _RecordingServer(object):
+    """Network server replacement that records the calls of the server controller.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def send_to(self, addr, obj, snapshot=False):
+        self.calls.append(("send_to", addr, obj.__class__))
+
+    def broadcast(self, obj, snapshot=False):
+        self.calls.append(("broadcast", obj.__class__))
+
+    def flush(self):
+        self.calls.append(("flush",))
+
+
+class FlushEventsTest(unittest.TestCase):
+    """Flush events are sent immediately, all other events wait for the TickDoneEvent.
+    """
+
+    def _receive(self, conn, buf, n):
+        frames = []
+        while len(frames) < n:
+            buf.feed(conn.recv(4096))
+            frames.extend(buf.frames())
+        return frames
+
+    def test_client(self):
+        encode, decode, header = events.codecs["binary"]
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind((socket.gethostname(), 0))
+        listener.listen(1)
+        manager = events.NetworkEventManager(events.EventManager(), socket.gethostname(), listener.getsockname()[1],
+                                             codec="binary", flush_events=[events.CharacterJumpRequest])
+        conn, addr = listener.accept()
+        conn.settimeout(0.2)
+        buf = network.ReceiveBuffer(header)
+        try:
+            manager.post(events.CharacterMoveLeftRequest(1))
+            self.assertRaises(socket.timeout, conn.recv, 4096)
+
+            # The flush event takes the queued events with it.
+            manager.post(events.CharacterJumpRequest(1))
+            frames = self._receive(conn, buf, 2)
+            self.assertEqual([decode(f).__class__ for f in frames],
+                             [events.CharacterMoveLeftRequest, events.CharacterJumpRequest])
+
+            manager.post(events.CharacterMoveRightRequest(1))
+            self.assertRaises(socket.timeout, conn.recv, 4096)
+            manager.notify(events.TickDoneEvent())
+            frames = self._receive(conn, buf, 1)
+            self.assertEqual(decode(frames[0]).__class__, events.CharacterMoveRightRequest)
+        finally:
+            manager.shutdown()
+            conn.close()
+            listener.close()
+
+    def test_server(self):
+        server = _RecordingServer()
+        controller = network_controller.ServerController(events.EventManager(), server=server,
+                                                         flush_events=[events.AssignCharacter])
+        controller.notify(events.AssignCharacterToClient("a", 1))
+        self.assertEqual(server.calls[:2], [("send_to", "a", events.AssignCharacter), ("flush",)])
+
+        server = _RecordingServer()
+        controller = network_controller.ServerController(events.EventManager(), server=server)
+        controller.notify(events.AssignCharacterToClient("a", 1))
+        self.assertEqual(server.calls[0], ("send_to", "a", events.AssignCharacter))
+        self.assertNotIn(("flush",), server.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys
+import argparse
+import json
+import logging
+from core.loadgen import LoadGenerator
+
+
+def parse_command_line():
+    """Parses the command line arguments.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Smashmon load generator")
+    parser.add_argument("--bots", type=int, default=100,
+                        help="Number of bot clients")
+    parser.add_argument("--duration", type=float, default=30.0,
+                        help="Duration of the measurement in seconds")
+    parser.add_argument("--host", type=str, default=None,
+                        help="Host of a running server (a local match host server is started if not given)")
+    parser.add_argument("--port", type=int, default=32072,
+                        help="Server port")
+    parser.add_argument("--codec", type=str, default="json",
+                        choices=["json", "binary"],
+                        help="Encoding of the network events")
+    parser.add_argument("--transport", type=str, default="tcp",
+                        choices=["tcp", "udp"],
+                        help="Network transport")
+    parser.add_argument("--server-engine", type=str, default="select",
+                        choices=["threads", "select"],
+                        help="Network server implementation of the local server (ignored with --transport udp)")
+    parser.add_argument("--fps", type=int, default=30,
+                        help="Ticks per second of the bots")
+    parser.add_argument("--server-fps", type=int, default=60,
+                        help="Ticks per second of the local server")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the random bot inputs (for reproducible runs)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print verbose output")
+    args = parser.parse_args()
+    assert args.bots > 0
+    assert args.duration > 0
+    assert 0 < args.port < 65536
+    assert args.fps > 0
+    assert args.server_fps > 0
+
+    if args.verbose:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s")
+
+    return args
+
+
+def main():
+    """Runs the bots and prints the report as JSON.
+    """
+    args = parse_command_line()
+    generator = LoadGenerator(args.bots, host=args.host, port=args.port, codec=args.codec, transport=args.transport,
+                              engine=args.server_engine, fps=args.fps, server_fps=args.server_fps, seed=args.seed)
+    report = generator.run(args.duration)
+    print json.dumps(report, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -15,6 +15,10 @@ def parse_command_line():
                         help="Screen height")
     parser.add_argument("--fps", type=int, default=60,
                         help="Frames per second")
+    parser.add_argument("--idle-fps", type=int, default=10,
+                        help="Frames per second while the menu is idle")
+    parser.add_argument("--image-cache-size", type=int, default=64,
+                        help="Memory budget of the cached images in MiB")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="Print verbose output")
     parser.add_argument("--model", type=str, default="Main Menu",
@@ -25,10 +29,79 @@ def parse_command_line():
                               help="Run as a server")
     server_group.add_argument("--client", action="store_true",
                               help="Run as a client")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run a dedicated server without window and local player (requires --server)")
+    parser.add_argument("--host", type=str, default=None,
+                        help="Server host the client connects to (default: the local host name)")
+    parser.add_argument("--port", type=int, default=32072,
+                        help="Server port")
+    parser.add_argument("--max-clients", type=int, default=None,
+                        help="Maximum number of clients of a server (default: 1, or 2 with --headless)")
+    parser.add_argument("--matches", type=int, default=None,
+                        help="Host this many matches in one dedicated server (requires --headless)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Distribute the matches over this many processes (requires --matches, more matches are "
+                             "created when clients join with --match -1)")
+    parser.add_argument("--match", type=int, default=None,
+                        help="Match a client joins on a server with --matches (-1 joins the first free match)")
+    parser.add_argument("--codec", type=str, default="json",
+                        choices=["json", "binary"],
+                        help="Encoding of the network events")
+    parser.add_argument("--server-engine", type=str, default="threads",
+                        choices=["threads", "select"],
+                        help="Network server implementation (one thread per client or a single select loop)")
+    parser.add_argument("--transport", type=str, default="tcp",
+                        choices=["tcp", "udp"],
+                        help="Network transport (udp sends snapshots and input states unreliably)")
+    parser.add_argument("--netsim", action="store_true",
+                        help="Connect the client through a local proxy that simulates the --netsim-* conditions")
+    parser.add_argument("--netsim-latency", type=float, default=0.0,
+                        help="Simulated one-way latency in seconds")
+    parser.add_argument("--netsim-jitter", type=float, default=0.0,
+                        help="Simulated random additional latency in seconds")
+    parser.add_argument("--netsim-bandwidth", type=int, default=None,
+                        help="Simulated bandwidth in bytes per second (unlimited if not given)")
+    parser.add_argument("--netsim-loss", type=float, default=0.0,
+                        help="Simulated probability of a lost datagram")
+    parser.add_argument("--netsim-reorder", type=float, default=0.0,
+                        help="Simulated probability of a reordered datagram")
+    parser.add_argument("--netsim-seed", type=int, default=None,
+                        help="Seed of the network simulator (for reproducible runs)")
+    parser.add_argument("--snapshot-rate", type=int, default=20,
+                        help="Number of model state broadcasts per second sent by the server")
+    parser.add_argument("--interest-cell-size", type=float, default=None,
+                        help="Send each client only the bodies near its character, using a grid with this cell size")
+    parser.add_argument("--physics-rate", type=int, default=None,
+                        help="Number of fixed physics steps per second (one variable step per frame if not given)")
+    parser.add_argument("--interpolation-delay", type=float, default=0.1,
+                        help="Delay in seconds with which a client renders the bodies of other players")
+    parser.add_argument("--profile", action="store_true",
+                        help="Measure the time of the listeners and the frame phases")
+    parser.add_argument("--profile-output", type=str, default=None,
+                        help="Write the profile as JSON to this file on exit (implies --profile)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve the profile as JSON on http://127.0.0.1:<port>/metrics (implies --profile)")
     args = parser.parse_args()
     assert args.width > 0
     assert args.height > 0
     assert args.fps > 0
+    assert args.idle_fps > 0
+    assert args.image_cache_size >= 0
+    assert not args.headless or args.server
+    assert 0 < args.port < 65536
+    assert args.max_clients is None or args.max_clients > 0
+    assert args.matches is None or (args.headless and args.matches > 0)
+    assert args.workers is None or (args.matches is not None and args.workers > 0)
+    assert args.match is None or (args.client and args.match >= -1)
+    assert args.snapshot_rate > 0
+    assert args.interpolation_delay >= 0
+    assert not args.netsim or args.client
+    assert args.netsim_latency >= 0 and args.netsim_jitter >= 0
+    assert args.netsim_bandwidth is None or args.netsim_bandwidth > 0
+    assert 0 <= args.netsim_loss <= 1 and 0 <= args.netsim_reorder <= 1
+    assert args.interest_cell_size is None or args.interest_cell_size > 0
+    assert args.physics_rate is None or args.physics_rate > 0
+    assert args.metrics_port is None or 0 < args.metrics_port < 65536
 
     if args.verbose:
         logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)